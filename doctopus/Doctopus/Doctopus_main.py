@@ -62,6 +62,9 @@ class Handler(object):
         self.tags = self.conf.get('tags', None)
         self.table_name = self.conf.get('table_name', 'influxdb')
         self.unit = self.conf.get('unit', 's')
+        # interval between the samples of a batch in unit, used when the
+        # batch has no timestamp vector
+        self.sample_interval = self.conf.get('sample_interval', 0)
 
     def work(self, queues, **kwargs):
         self.data_queue = data_queue = queues['data_queue']
@@ -87,13 +90,25 @@ class Handler(object):
         if isinstance(processed_dicts, (types.GeneratorType, list)):
             for processed_dict in processed_dicts:
 
-                data = self.process_dict(processed_dict)
-                self.sender_pipe.put(data)
+                data = self.process(processed_dict)
+                if data is not None:
+                    self.sender_pipe.put(data)
 
         elif isinstance(processed_dicts, dict):
 
-            data = self.process_dict(processed_dicts)
-            self.sender_pipe.put(data)
+            data = self.process(processed_dicts)
+            if data is not None:
+                self.sender_pipe.put(data)
+
+    def process(self, processed_dict):
+        """
+        array-shaped data is processed as a batch, others as a single point
+        :param processed_dict:
+        :return:
+        """
+        if _is_batch(processed_dict):
+            return self.process_batch(processed_dict)
+        return self.process_dict(processed_dict)
 
     def process_dict(self, processed_dict):
         """
@@ -137,11 +152,66 @@ class Handler(object):
 
         return data_dict
 
+    def process_batch(self, processed_dict):
+        """
+        process array-shaped data to one batch, sender turns it into points
+        data_value is a 2-D array (one row per sample, one column per field
+        of field_name_list) or a dict of columns {'fieldname': array},
+        timestamp is a vector with one timestamp per sample. Without the
+        vector, the samples are sample_interval apart from timestamp (or
+        now), a batch of more than one sample is rejected if
+        sample_interval is not set
+        :param processed_dict:
+        :return: dict, a batch of points the sender need, None if rejected
+        """
+        table_name = processed_dict.get('table_name') or self.table_name
+
+        # make rows, numpy arrays are converted in bulk by tolist
+        value = processed_dict.get('data_value')
+        if isinstance(value, dict):
+            field_names = list(value.keys())
+            rows = list(zip(*[_to_list(value[name]) for name in field_names]))
+        else:
+            field_names = self.field_name_list
+            rows = _to_list(value)
+
+        # make timestamps
+        timestamps = processed_dict.get('timestamp')
+        if _is_sequence(timestamps):
+            timestamps = _to_list(timestamps)
+        elif len(rows) > 1 and not self.sample_interval:
+            # samples sharing one timestamp overwrite each other in influxdb
+            log.error('Reject a batch of {} samples of {} without timestamp '
+                      'vector or sample_interval.'.format(len(rows),
+                                                          table_name))
+            return None
+        else:
+            if timestamps is None:
+                if self.unit == 's':
+                    timestamps = pendulum.now().int_timestamp
+                else:
+                    timestamps = int(pendulum.now().float_timestamp * 1000000)
+            timestamps = [timestamps + i * self.sample_interval
+                          for i in range(len(rows))]
+
+        # data to put in send
+        batch_dict = {
+            "table_name": table_name,
+            "field_names": field_names,
+            "rows": rows,
+            "timestamps": timestamps,
+            "tags": processed_dict.get('tags') or self.tags,
+            "unit": self.unit
+        }
+
+        return batch_dict
+
     def re_load(self):
         self.conf = get_conf("conf/conf.toml")['user_conf']['handler']
         self.field_name_list = self.conf.get('field_name_list', [])
         self.table_name = self.conf.get('table_name', 'influxdb')
         self.unit = self.conf.get('unit', 's')
+        self.sample_interval = self.conf.get('sample_interval', 0)
         return self
 
     @abstractmethod
@@ -152,7 +222,32 @@ class Handler(object):
         tags,(choose)
         data_value,(must)
         measurement(must)
+        a 2-D array data_value, a timestamp vector, or batch = True with a
+        list of rows or dict of columns is sent as a batch, see
+        process_batch
         :param raw_data:
         :return:
         """
         pass
+
+
+def _is_sequence(value):
+    return isinstance(value, (list, tuple)) or hasattr(value, 'tolist') and \
+        getattr(value, 'ndim', 0) > 0
+
+
+def _to_list(value):
+    """
+    numpy array to list of python values, other sequences to list
+    """
+    return value.tolist() if hasattr(value, 'tolist') else list(value)
+
+
+def _is_batch(processed_dict):
+    """
+    data_value is a 2-D array, timestamp is a vector, or batch is set for a
+    list of rows or a dict of columns
+    """
+    return bool(processed_dict.get('batch')) or \
+        getattr(processed_dict.get('data_value'), 'ndim', 0) == 2 or \
+        _is_sequence(processed_dict.get('timestamp'))
@@ -75,7 +75,8 @@ def make_ziyan(name):
 
             # copy lua files
             for file in glob.glob(filepath + '/conf/*.lua'):
-                shutil.copyfile(file, name + '/lua/enque_script.lua')
+                shutil.copyfile(file,
+                                name + '/lua/' + os.path.basename(file))
 
             # copy userfiles
             for file in glob.glob(filepath + '/plugins/*.py'):
@@ -4,11 +4,31 @@
 -- 并且会每隔mark_range发送两条心跳信息
 
 local new_table_name = KEYS[1]
+-- 写入的stream，分片时由Sender指定
+local stream = KEYS[2] or "data_stream"
 local new_fields = ARGV[1]
 local new_timestamp = ARGV[2]
 
--- Stream的最大尺寸
-local MAXLEN = 100000
+-- Stream的最大尺寸，ARGV[4]~ARGV[6]由Sender按conf.toml的[sender]传入，不传时为默认值
+local MAXLEN = tonumber(ARGV[4]) or 100000
+-- "~"为近似裁剪（只删除整个宏节点，开销小，stream会略长于MAXLEN），"="为精确裁剪
+local TRIM = ARGV[5] or "~"
+-- 按时间保留的秒数，大于0时用MINID删除更早的数据（需要redis 6.2+）
+local RETENTION = tonumber(ARGV[6]) or 0
+
+-- 写入stream并裁剪
+local function xadd(...)
+    if MAXLEN > 0 then
+        redis.call("XADD", stream, "MAXLEN", TRIM, MAXLEN, "*", ...)
+    else
+        redis.call("XADD", stream, "*", ...)
+    end
+    if RETENTION > 0 then
+        local now = redis.call("TIME")
+        local minid = string.format("%d", (tonumber(now[1]) - RETENTION) * 1000)
+        redis.call("XTRIM", stream, "MINID", TRIM, minid)
+    end
+end
 
 -- 'new_timestamp'和'old_timestamp'之间差的时间（单位秒）
 local time_range = 10
@@ -123,7 +143,7 @@ if field_flag == true and mark_flag == true then
     }
 
     local msg = cmsgpack.pack(data)
-    redis.call("XADD", "data_stream", "*", "MAXLEN", MAXLEN, "data", msg)
+    xadd("data", msg)
 
     return 'Field enque completed.'
 elseif field_flag == true and mark_flag == false then
@@ -137,7 +157,7 @@ elseif field_flag == true and mark_flag == false then
     }
 
     local msg = cmsgpack.pack(data)
-    redis.call("XADD", "data_stream", "*", "MAXLEN", MAXLEN, "data", msg)
+    xadd("data", msg)
 
     return 'Field enque completed.'
 elseif time_flag == true and mark_flag == true then
@@ -151,7 +171,7 @@ elseif time_flag == true and mark_flag == true then
     }
 
     local msg = cmsgpack.pack(data)
-    redis.call("XADD", "data_stream", "*", "MAXLEN", MAXLEN, "data", msg)
+    xadd("data", msg)
 
     return 'Time enque completed.'
 elseif time_flag == true and mark_flag == false then
@@ -164,7 +184,7 @@ elseif time_flag == true and mark_flag == false then
     }
 
     local msg = cmsgpack.pack(data)
-    redis.call("XADD", "data_stream", "*", "MAXLEN", MAXLEN, "data", msg)
+    xadd("data", msg)
 
     return 'Time enque completed.'
 else
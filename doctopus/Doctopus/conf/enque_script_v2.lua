@@ -0,0 +1,179 @@
+-- enque_script.lua 的第二版，去重和心跳规则与第一版一致：
+-- 1. 'new_fields'和'old_fields'（指redis的键'threshold*'里的'fields'的值）之间是不同的
+-- 2. ‘new_timestamp’和‘old_timestamp'之间差了'time_range'秒以上
+-- 并且会每隔mark_range发送两条心跳信息
+--
+-- 与第一版的区别：
+-- 1. 'new_fields'只解包一次
+-- 2. 'threshold*'键用一次HMGET读取，最多一次HSET写入
+-- 3. 去掉了对已经不存在的'data_queue'键的LLEN检查
+-- 4. time_range、mark_range和数值字段的变化阈值可以按表配置，由Sender从conf.toml的[deadband]
+--    预加载到hash KEYS[3]中（field为表名，'*'为默认值），没有配置时与第一版相同；
+--    KEYS[3]为'deadband_conf:<配置的校验和>'，共用一个redis的多个ziyan实例互不覆盖
+-- 5. ARGV[3]为2时，写入data_stream的数据使用v2格式（只编码一次，见Doctopus/lib/stream_format.py）
+-- 6. KEYS[2]为写入的stream，分片时由Sender按eqpt_no和表名指定，默认为data_stream
+-- 7. ARGV[4]~ARGV[6]为stream的裁剪配置：MAXLEN、近似（~）或精确（=）裁剪、按时间保留的秒数
+
+local new_table_name = KEYS[1]
+local stream = KEYS[2] or "data_stream"
+local deadband_conf = KEYS[3] or "deadband_conf"
+local new_fields = ARGV[1]
+local new_timestamp = ARGV[2]
+local stream_format = tonumber(ARGV[3]) or 1
+
+-- Stream的最大尺寸，ARGV[4]~ARGV[6]由Sender按conf.toml的[sender]传入，不传时为默认值
+local MAXLEN = tonumber(ARGV[4]) or 100000
+-- "~"为近似裁剪（只删除整个宏节点，开销小，stream会略长于MAXLEN），"="为精确裁剪
+local TRIM = ARGV[5] or "~"
+-- 按时间保留的秒数，大于0时用MINID删除更早的数据（需要redis 6.2+）
+local RETENTION = tonumber(ARGV[6]) or 0
+
+-- 写入stream并裁剪
+local function xadd(...)
+    if MAXLEN > 0 then
+        redis.call("XADD", stream, "MAXLEN", TRIM, MAXLEN, "*", ...)
+    else
+        redis.call("XADD", stream, "*", ...)
+    end
+    if RETENTION > 0 then
+        local now = redis.call("TIME")
+        local minid = string.format("%d", (tonumber(now[1]) - RETENTION) * 1000)
+        redis.call("XTRIM", stream, "MINID", TRIM, minid)
+    end
+end
+
+local all_fields = cmsgpack.unpack(new_fields)
+local table_name = cmsgpack.unpack(new_table_name)
+
+-- 读取该表的去重配置
+local conf = redis.call("HGET", deadband_conf, table_name)
+if conf == false then
+    conf = redis.call("HGET", deadband_conf, "*")
+end
+if conf == false then
+    conf = {time_range = 10, mark_range = 300, abs = 0, rel = 0, fields = {}}
+else
+    conf = cmsgpack.unpack(conf)
+end
+
+-- 'new_timestamp'和'old_timestamp'之间差的时间（单位秒）
+local time_range = conf['time_range']
+-- mark_range必须是time_range的整数倍
+local mark_range = conf['mark_range']
+-- 'new_fields'中'unit'的值是'u'（微秒）时，x1000000才能正确计算'new_timetamp'和'old_timestamp'的差值
+if all_fields['unit'] == 'u' then
+    time_range = time_range * 1000000
+    mark_range = mark_range * 1000000
+end
+
+local timestamp = cmsgpack.unpack(new_timestamp)
+local threshold_name = string.format("threshold_%s_%s",
+    all_fields['tags']['eqpt_no'], table_name)
+
+local function has_tolerance()
+    if conf['abs'] > 0 or conf['rel'] > 0 then
+        return true
+    end
+    return next(conf['fields']) ~= nil
+end
+
+local function fields_changed(old_fields)
+    -- 比较'new_fields'和'old_fields'，数值字段的变化不超过阈值时认为没有变化
+    -- 阈值为 max(abs, rel * |old|)
+    if new_fields == old_fields then
+        return false
+    end
+    if not has_tolerance() then
+        return true
+    end
+
+    local old_all = cmsgpack.unpack(old_fields)
+    for name, _ in pairs(old_all) do
+        if all_fields[name] == nil then
+            return true
+        end
+    end
+    for name, value in pairs(all_fields) do
+        local old_value = old_all[name]
+        if type(value) == 'number' and type(old_value) == 'number' then
+            local tolerance = conf['fields'][name] or conf
+            local limit = math.max(tolerance['abs'] or 0, (tolerance['rel'] or 0) * math.abs(old_value))
+            if math.abs(value - old_value) > limit then
+                return true
+            end
+        elseif type(value) == 'table' and type(old_value) == 'table' then
+            if cmsgpack.pack(value) ~= cmsgpack.pack(old_value) then
+                return true
+            end
+        elseif value ~= old_value then
+            return true
+        end
+    end
+    return false
+end
+
+-- 从'threshold_name'中获取已存入redis的'fields'、'timestamp'和'timemark'的值
+local old = redis.call("HMGET", threshold_name, "fields", "timestamp", "timemark")
+local old_fields, old_timestamp, old_timemark = old[1], old[2], old[3]
+
+-- field_flag = true时代表'new_fields'和'old_fields'是不同的，可以写入数据
+-- time_flag = true时代表'new_timestamp'和'old_timestamp'之间差了'time_range'秒以上，可以写入数据
+-- mark_flag = true时代表'new_timestamp'和'old_timemark'之间差了'mark_range'秒以上，给出心跳信息
+local field_flag, time_flag, mark_flag
+if old_fields == false or old_timestamp == false or old_timemark == false then
+    field_flag, time_flag, mark_flag = true, true, true
+else
+    field_flag = fields_changed(old_fields)
+    time_flag = timestamp - tonumber(old_timestamp) >= time_range
+    mark_flag = timestamp - tonumber(old_timemark) >= mark_range
+end
+
+-- 一次HSET刷新'threshold*'键
+local threshold = {}
+if field_flag or time_flag then
+    threshold[#threshold + 1] = 'fields'
+    threshold[#threshold + 1] = new_fields
+    threshold[#threshold + 1] = 'timestamp'
+    threshold[#threshold + 1] = timestamp
+end
+if mark_flag then
+    threshold[#threshold + 1] = 'timemark'
+    threshold[#threshold + 1] = timestamp
+end
+if #threshold > 0 then
+    redis.call('HSET', threshold_name, unpack(threshold))
+end
+
+if not field_flag and not time_flag then
+    return 'Waiting for new data ...'
+end
+
+-- 根据field_flag、time_flag和mark_flag的值将对应格式的数据写入redis
+all_fields["heartbeat"] = {name = "heartbeat", title = "存活心跳", value = 1, type = "int", unit = nil} -- 固定表示存活
+if mark_flag then
+    all_fields["connbeat"] = {name = "connbeat", title = "网络心跳", value = 1, type = "int", unit = nil}   -- 表示网络连接（有瑕疵）
+end
+if field_flag then
+    all_fields["databeat"] = {name = "databeat", title = "数据心跳", value = 1, type = "int", unit = nil}   -- 表示有新数据
+end
+
+if stream_format == 2 then
+    local msg = cmsgpack.pack({
+        table_name = table_name,
+        time = timestamp,
+        fields = all_fields,
+    })
+    xadd("v", 2, "data", msg)
+else
+    local msg = cmsgpack.pack({
+        table_name = new_table_name,
+        time = new_timestamp,
+        fields = cmsgpack.pack(all_fields),
+    })
+    xadd("data", msg)
+end
+
+if field_flag then
+    return 'Field enque completed.'
+end
+return 'Time enque completed.'
@@ -10,20 +10,34 @@ LastEditTime: 2020-12-23 12:47:31
 
 import datetime
 import sys
+import time
 from logging import getLogger
 
 import msgpack
 import pendulum
+from redis import exceptions
+
+try:
+    from queue import Empty
+except Exception:
+    from Queue import Empty
 
 if sys.version_info[0] == 3 and sys.version_info[1] >= 5:
     from Doctopus.lib.communication import Communication
 else:
     from Doctopus.lib.communication_2 import Communication
 
-from Doctopus.lib.database_wrapper import RedisWrapper
+from Doctopus.lib.database_wrapper import (RedisWrapper, shard_of,
+                                           stream_name, trim_args)
+from Doctopus.lib.deadband import Deadband, preload
+from Doctopus.lib.wal import WriteAheadLog
 
 log = getLogger(__name__)
 
+# errors of redis being unavailable, data are kept in the WAL and retried
+RETRYABLE = (exceptions.ConnectionError, exceptions.TimeoutError,
+             exceptions.NoScriptError)
+
 
 class Sender(object):
     """
@@ -35,9 +49,33 @@ class Sender(object):
         self.redis_conf = configuration['redis']
         self.conf = configuration['sender']
         self.lua_path = self.conf['lua_path']
+        self.deadband_conf = configuration.get('deadband', dict())
+        # send at most batch_size data to redis with one round trip
+        self.batch_size = self.conf.get('batch_size', 1)
+        # format of data_stream entries, 2 needs enque_script_v2.lua
+        self.stream_format = self.conf.get('stream_format', 1)
+        # number of shard streams, must be the same as [data_stream] of chitu
+        self.shards = self.conf.get('shards', 1)
+        # maxlen, approximate and time retention of the streams, applied by
+        # the enque script on every XADD
+        self.trim = trim_args(self.conf)
 
         self.connect_redis()
 
+        # store and forward: data are appended to the WAL while redis is
+        # unavailable, and replayed in order after it recovers
+        if self.conf.get('wal', False):
+            self.wal = WriteAheadLog(
+                self.conf.get('wal_path', 'wal'),
+                self.conf.get('wal_segment_size', 4 * 1024 * 1024),
+                self.conf.get('wal_max_bytes', 256 * 1024 * 1024))
+        else:
+            self.wal = None
+        self.wal_batch = self.conf.get('wal_replay_batch', 500)
+        self.wal_retry_interval = self.conf.get('wal_retry_interval', 5)
+        self.wal_retry_time = 0
+        self.wal_metrics = {'appended': 0, 'replayed': 0, 'rejected': 0}
+
         # log format
         self.enque_log_flag = self.conf['enque_log']
         self.log_format = '\ntable_name: {}\nfields: {}\ntimestamp: {}\n'
@@ -45,11 +83,18 @@ class Sender(object):
         # init communication class (singleinstance)
         self.communication = Communication(configuration)
 
+        # drop unchanged data before sending them to redis
+        if self.deadband_conf.get('local', False):
+            self.deadband = Deadband(self.deadband_conf)
+        else:
+            self.deadband = None
+
         self.name = None
 
     def connect_redis(self):
         self.db = RedisWrapper(self.redis_conf)
         self.db.script_load(self.lua_path)
+        self.deadband_key = preload(self.db, self.deadband_conf)
 
     def work(self, queue, **kwargs):
         """
@@ -60,10 +105,77 @@ class Sender(object):
         """
         sender_pipe = queue['sender']
         while True:
-            data = sender_pipe.get()
-            # pack and send data to redis and watchdog
-            self.pack(data)
-            self.send_to_communication(data)
+            if self.wal and not self.wal.empty():
+                # replay the WAL even when there is no new data
+                try:
+                    data = sender_pipe.get(timeout=self.wal_retry_interval)
+                except Empty:
+                    self.replay_wal()
+                    continue
+            else:
+                data = sender_pipe.get()
+            if self.batch_size <= 1 and 'rows' not in data:
+                # pack and send data to redis and watchdog
+                if self.filter(data):
+                    self.pack(data)
+                self.send_to_communication(data)
+                continue
+
+            # drain whatever is in the queue, up to batch_size
+            items = [data]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(sender_pipe.get_nowait())
+                except Empty:
+                    break
+
+            datas = []
+            for item in items:
+                if 'rows' in item:
+                    datas.extend(self.expand_batch(item))
+                else:
+                    datas.append(item)
+            records = [data for data in datas if self.filter(data)]
+            if records:
+                self.pack_batch(records)
+            for data in datas:
+                self.send_to_communication(data)
+
+    def filter(self, data):
+        """
+        local deadband filter
+        :param data:
+        :return: bool, True means send it to redis
+        """
+        if self.deadband is None:
+            return True
+        if self.deadband.check(data):
+            return True
+        metrics = self.communication.metrics.setdefault(self.name, dict())
+        metrics['deadband_suppressed'] = self.deadband.suppressed
+        return False
+
+    @staticmethod
+    def expand_batch(batch):
+        """
+        turn a batch of Handler.process_batch into data points
+        :param batch: dict
+        :return: list
+        """
+        field_names = batch['field_names']
+        tags = batch['tags']
+        unit = batch['unit']
+        datas = []
+        for row, timestamp in zip(batch['rows'], batch['timestamps']):
+            fields = dict(zip(field_names, row))
+            fields['tags'] = tags
+            fields['unit'] = unit
+            datas.append({
+                'table_name': batch['table_name'],
+                'fields': fields,
+                'timestamp': timestamp
+            })
+        return datas
 
     def pack(self, data):
         """
@@ -71,43 +183,179 @@ class Sender(object):
         :param data:
         :return:
         """
+        record = self.serialize(data)
+        if self.wal:
+            return self.send_records([record])
+        # send data to redis
+        try:
+            lua_info = self.db.enqueue(**record)
+            log.info(lua_info.decode())
+        except Exception as err:
+            log.exception(err)
+            self.reconnect_redis()
+
+    def pack_batch(self, datas):
+        """
+        pack a batch of data and send them to redis with one pipeline
+        :param datas: list
+        :return:
+        """
+        records = [self.serialize(data) for data in datas]
+        if self.wal:
+            return self.send_records(records)
+        try:
+            lua_infos = self.db.enqueue_many(records)
+            for lua_info in lua_infos:
+                log.info(lua_info.decode())
+        except Exception as err:
+            log.exception(err)
+            self.reconnect_redis()
+
+    def send_records(self, records):
+        """
+        send records to redis, or append them to the WAL when redis is
+        unavailable. Records are appended behind the data already in the
+        WAL so they keep their order
+        :param records: list, serialized data
+        :return:
+        """
+        if self.wal.empty():
+            try:
+                self.enqueue_records(records)
+                return
+            except RETRYABLE as err:
+                log.error('Failed to send data to redis, append them to '
+                          'WAL: {}'.format(err))
+                # retry after wal_retry_interval
+                self.wal_retry_time = time.time()
+        self.wal.append([msgpack.packb(record, use_bin_type=True)
+                         for record in records])
+        self.wal_metrics['appended'] += len(records)
+        self.record_wal()
+        self.replay_wal()
+
+    def enqueue_records(self, records):
+        """
+        send records to redis with one round trip. Records rejected by redis,
+        e.g. by an error of the enque script, are logged and dropped, only
+        errors of redis being unavailable are raised
+        :param records: list, serialized data
+        :return: int, number of records sent
+        """
+        try:
+            lua_infos = self.db.enqueue_many(records, raise_on_error=False)
+        except RETRYABLE:
+            raise
+        except Exception as err:
+            if len(records) == 1:
+                self.reject(err)
+                return 0
+            # a record can not be encoded, send them one by one
+            return sum(self.enqueue_records([record]) for record in records)
+        sent = 0
+        for lua_info in lua_infos:
+            if isinstance(lua_info, exceptions.NoScriptError):
+                # redis restarted, the script is loaded again by replay_wal
+                raise lua_info
+            if isinstance(lua_info, Exception):
+                self.reject(lua_info)
+            else:
+                log.info(lua_info.decode())
+                sent += 1
+        return sent
+
+    def reject(self, err):
+        log.error('Data rejected by redis, drop it: {}'.format(err))
+        self.wal_metrics['rejected'] += 1
+
+    def replay_wal(self):
+        """
+        replay the WAL in order when redis is available again, at most once
+        every wal_retry_interval seconds
+        :return:
+        """
+        if time.time() - self.wal_retry_time < self.wal_retry_interval:
+            return
+        self.wal_retry_time = time.time()
+        if not self.db.ping():
+            return
+        try:
+            # scripts are gone if redis restarted
+            self.db.script_load(self.lua_path)
+            self.deadband_key = preload(self.db, self.deadband_conf)
+            while not self.wal.empty():
+                payloads, position = self.wal.read(self.wal_batch)
+                records = []
+                for payload in payloads:
+                    try:
+                        records.append(msgpack.unpackb(payload, raw=False))
+                    except Exception as err:
+                        self.reject(err)
+                sent = self.enqueue_records(records) if records else 0
+                # rejected records are committed too, they never block the
+                # data behind them
+                self.wal.commit(position)
+                self.wal_metrics['replayed'] += sent
+            log.info('WAL replayed, {} data in total.'.format(
+                self.wal_metrics['replayed']))
+        except RETRYABLE as err:
+            log.error('Failed to replay WAL: {}'.format(err))
+        self.record_wal()
+
+    def record_wal(self):
+        metrics = self.communication.metrics.setdefault(self.name, dict())
+        metrics['wal'] = dict(self.wal_metrics,
+                              bytes=self.wal.size(),
+                              dropped=self.wal.dropped,
+                              corrupt=self.wal.corrupt)
+
+    def reconnect_redis(self):
+        log.info('try to connect redis')
+        try:
+            self.connect_redis()
+        except Exception as err:
+            log.error(
+                'reconnect redis fail, check redis status and conf, info: \n{}'.format(
+                    err))
+
+    def serialize(self, data):
+        """
+        log data and pack it by msgpack ready to send to redis
+        :param data:
+        :return: dict, msgpack packed table_name, fields and timestamp
+        """
         table_name = data['table_name']
         fields = data['fields']
         timestamp = data['timestamp']
 
-        if 'unit' in fields.keys():
-            if fields['unit'] == 's':
-                date_time = pendulum.from_timestamp(
-                    timestamp, tz='Asia/Shanghai').to_datetime_string()
+        # show log or not
+        if self.enque_log_flag:
+            if 'unit' in fields.keys():
+                if fields['unit'] == 's':
+                    date_time = pendulum.from_timestamp(
+                        timestamp, tz='Asia/Shanghai').to_datetime_string()
+                else:
+                    date_time = pendulum.from_timestamp(
+                        timestamp / 1000000, tz='Asia/Shanghai').to_datetime_string()
             else:
                 date_time = pendulum.from_timestamp(
-                    timestamp / 1000000, tz='Asia/Shanghai').to_datetime_string()
-        else:
-            date_time = pendulum.from_timestamp(
-                timestamp, tz='Asia/Shanghai').to_datetime_string()
+                    timestamp, tz='Asia/Shanghai').to_datetime_string()
 
-        log_str = self.log_format.format(table_name, fields, date_time)
-        # show log or not
-        if self.enque_log_flag:
+            log_str = self.log_format.format(table_name, fields, date_time)
             log.info(log_str)
+        tags = fields.get('tags') or dict()
+        shard = shard_of(tags.get('eqpt_no'), table_name, self.shards)
+
         # pack data by msgpack ready to send to redis
-        table_name = msgpack.packb(table_name)
-        fields = msgpack.packb(fields)
-        timestamp = msgpack.packb(timestamp)
-        # send data to redis
-        try:
-            lua_info = self.db.enqueue(
-                table_name=table_name, fields=fields, timestamp=timestamp)
-            log.info(lua_info.decode())
-        except Exception as err:
-            log.exception(err)
-            log.info('try to connect redis')
-            try:
-                self.connect_redis()
-            except Exception as err:
-                log.error(
-                    'reconnect redis fail, check redis status and conf, info: \n{}'.format(
-                        err))
+        return {
+            'table_name': msgpack.packb(table_name),
+            'fields': msgpack.packb(fields),
+            'timestamp': msgpack.packb(timestamp),
+            'stream_format': self.stream_format,
+            'stream': stream_name(shard),
+            'deadband': self.deadband_key,
+            'trim': self.trim
+        }
 
     def send_to_communication(self, data):
         """
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+chitu 批量大小的自适应调整 (AIMD)
+
+每批写入 sink 后记录写入耗时和是否成功:
+1. 写入成功, 耗时不超过 write_latency_target 且错误率低于 error_threshold
+   时, batch_size 加 increase (加性增)
+2. 写入失败或耗时超过目标时, batch_size 乘以 decrease (乘性减)
+batch_size 限制在 [min_batch_size, max_batch_size] 之间, linger (凑批等待
+时间) 随 batch_size 按比例变化: sink 正常时攒大批, 吃力时小批快发, 避免
+大批超时后整批重试.
+
+用法:
+batcher = AdaptiveBatcher(stream_conf)
+batch_size, linger = batcher.batch_size, batcher.linger
+start = time.time()
+... send ...
+batcher.record(time.time() - start, ok)
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class AdaptiveBatcher(object):
+    """
+    AIMD setpoint of batch_size and linger from write latency and error rate
+    """
+
+    def __init__(self, conf):
+        """
+        :param conf: dict, [data_stream] conf of a sink
+        """
+        self.min_batch_size = max(conf.get('min_batch_size', 1), 1)
+        self.max_batch_size = max(conf.get('max_batch_size', 5000),
+                                  self.min_batch_size)
+        self.max_linger = conf.get('max_linger', 1000)
+        # ms, slower writes are treated as congestion
+        self.latency_target = conf.get('write_latency_target', 1000)
+        self.error_threshold = conf.get('error_threshold', 0.1)
+        self.increase = conf.get('batch_increase', 50)
+        self.decrease = conf.get('batch_decrease', 0.5)
+        # smoothing factor of the moving averages
+        self.alpha = 0.2
+
+        batch_size = conf.get('batch_size', 1)
+        self.batch_size = min(max(batch_size, self.min_batch_size),
+                              self.max_batch_size)
+        self.linger = self.scaled_linger()
+        self.latency = 0
+        self.error_rate = 0
+        self.increased = 0
+        self.decreased = 0
+
+    def scaled_linger(self):
+        """
+        linger in proportion to batch_size
+        :return: int, ms
+        """
+        return int(self.max_linger * self.batch_size / self.max_batch_size)
+
+    def record(self, seconds, ok=True):
+        """
+        Record a batch write and move the setpoint
+        :param seconds: float, time the write took
+        :param ok: bool, whether the write succeeded
+        :return: None
+        """
+        latency = seconds * 1000
+        self.latency = latency if not self.latency else \
+            (1 - self.alpha) * self.latency + self.alpha * latency
+        self.error_rate = (1 - self.alpha) * self.error_rate + \
+            self.alpha * (0 if ok else 1)
+
+        if not ok or latency > self.latency_target:
+            batch_size = max(int(self.batch_size * self.decrease),
+                             self.min_batch_size)
+            if batch_size < self.batch_size:
+                log.info('Write {} in {:.0f}ms, decrease batch size to '
+                         '{}.'.format('succeeded' if ok else 'failed',
+                                      latency, batch_size))
+                self.decreased += 1
+            self.batch_size = batch_size
+        elif self.error_rate < self.error_threshold:
+            batch_size = min(self.batch_size + self.increase,
+                             self.max_batch_size)
+            if batch_size > self.batch_size:
+                self.increased += 1
+            self.batch_size = batch_size
+        self.linger = self.scaled_linger()
+
+    def setpoint(self):
+        """
+        Current setpoint for metrics
+        :return: dict
+        """
+        return {
+            'batch_size': self.batch_size,
+            'linger': self.linger,
+            'latency': round(self.latency, 1),
+            'error_rate': round(self.error_rate, 3),
+            'increased': self.increased,
+            'decreased': self.decreased
+        }
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""
+chitu 的 asyncio 引擎
+
+一个事件循环内同时处理所有 redis 实例, 分片和 sink: 每个 AsyncTransport
+在同一个协程里读取新数据, 另一个协程重试 pending 数据; 每个 sink 最多
+concurrency 批数据同时在发送. influxdb 通过 aiohttp 异步写入, kafka 和
+mqtt 的客户端是阻塞的, 在线程池中发送.
+
+conf.toml 中 [data_stream] engine = 'asyncio' 时启用, 需要 python 3.5+,
+redis-py 4.2+ 和 aiohttp.
+"""
+import asyncio
+import logging
+import time
+
+import aiohttp
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from influxdb.line_protocol import make_lines
+from redis import asyncio as aioredis
+from redis import exceptions
+
+from Doctopus.lib.database_wrapper import RedisWrapper
+from Doctopus.lib.dead_letter import DeadLetter
+from Doctopus.lib.line_protocol import LineEncoder, gzip_body
+from Doctopus.lib import stream_format
+from Doctopus.lib.transport import (Transport, sink_conf, sinks,
+                                    stream_targets, transport_name)
+from Doctopus.utils.util import get_conf
+
+log = logging.getLogger(__name__)
+
+
+def async_client(conf):
+    """
+    asyncio client of a redis, its connections are bound to the event loop
+    so they are not shared with the pools of RedisWrapper
+    :param conf: dict, host, port, db or unix_socket_path of redis
+    :return: redis.asyncio.Redis
+    """
+    if conf.get('unix_socket_path'):
+        return aioredis.Redis(unix_socket_path=conf['unix_socket_path'],
+                              db=conf.get('db', 0))
+    return aioredis.Redis(host=conf.get('host', 'localhost'),
+                          port=conf.get('port', 6379),
+                          db=conf.get('db', 0))
+
+
+class AsyncInfluxdbWrapper:
+    """influxdb 的 asyncio 客户端, 通过 aiohttp 直接调用 /write 接口
+
+        用法：
+        db = AsyncInfluxdbWrapper(conf, pool_size=4)
+        await db.send(josn_data, 's')
+
+        与 InfluxdbWrapper.send 一样, 4xx 错误抛出 InfluxDBClientError,
+        5xx 抛出 InfluxDBServerError; 网络或服务端错误时 healthy 置为 False,
+        下一次写入成功后恢复. gzip 由 gzip_level 压缩, bytes 同时记录压缩后的字节数.
+        """
+
+    def __init__(self, conf, pool_size=1):
+        """
+        :param conf: dict, [influxdb] of conf.toml
+        :param pool_size: int, max keep-alive connections, pool_size of conf
+                          is used when it is set
+        """
+        self.url = '{}://{}:{}/write'.format(
+            'https' if conf.get('ssl', False) else 'http',
+            conf.get('host', 'localhost'), conf.get('port', 8086))
+        self.params = {
+            'db': conf['db'],
+            'u': conf['username'],
+            'p': conf['password']
+        }
+        self.timeout = conf.get('timeout', 10)
+        self.pool_size = conf.get('pool_size', pool_size)
+        self.gzip = conf.get('gzip', False)
+        self.gzip_level = conf.get('gzip_level', 6)
+        self.bytes = {'raw': 0, 'wire': 0, 'requests': 0}
+        self.session = None
+        self.healthy = True
+        self.encoder = LineEncoder() if conf.get('line_protocol',
+                                                 True) else None
+
+    async def send(self, json_body, time_precision='s'):
+        """Write points with one request
+            :param json_body: list of dictionaries, the points
+            :param time_precision: database time precision
+            :return: bool, True when the points are written
+        """
+        if self.session is None:
+            # created in the running event loop
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        if self.encoder:
+            body = self.encoder.encode(json_body, time_precision)
+        else:
+            body = make_lines({'points': json_body},
+                              time_precision).encode('utf-8')
+        params = dict(self.params, precision=time_precision)
+        headers = {'Content-Type': 'application/octet-stream'}
+        raw = len(body)
+        if self.gzip:
+            body = gzip_body(body, self.gzip_level)
+            headers['Content-Encoding'] = 'gzip'
+        try:
+            async with self.session.post(self.url, params=params, data=body,
+                                         headers=headers) as resp:
+                content = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            log.error('Failed to write InfluxDB: {}'.format(err))
+            self.healthy = False
+            raise err
+
+        if resp.status == 204:
+            self.healthy = True
+            self.bytes['raw'] += raw
+            self.bytes['wire'] += len(body)
+            self.bytes['requests'] += 1
+            return True
+        if resp.status >= 500:
+            self.healthy = False
+            raise InfluxDBServerError(content)
+        raise InfluxDBClientError(content, resp.status)
+
+
+class AsyncTransport(Transport):
+    """
+    Transport driven by asyncio, reads new data and retries pending data of
+    one stream for one sink
+    """
+
+    def __init__(self, conf, redis_address=None, shard=0, sink=None,
+                 redis_client=None, async_redis=None):
+        """
+        :param async_redis: redis.asyncio.Redis, shared by the transports of
+                            the same redis address
+        other params are the same as Transport
+        """
+        self.concurrency = sink_conf(conf, sink or sinks(conf)[0]).get(
+            'concurrency', 1)
+        super(AsyncTransport, self).__init__(conf, redis_address, shard, sink,
+                                             redis_client)
+        self.aredis = async_redis or async_client(redis_address)
+        # kafka is sent in the thread pool, no delivery callbacks
+        self.async_kafka = False
+        self.semaphore = None
+        self.sending = set()
+        self.retry_at = 0
+
+    def init_sink(self, conf):
+        if self.to_where == 'influxdb':
+            self.db = AsyncInfluxdbWrapper(conf['influxdb'], self.concurrency)
+            self.async_kafka = False
+        else:
+            super(AsyncTransport, self).init_sink(conf)
+
+    async def run(self):
+        """
+        Read new data and retry pending data until cancelled
+        :return: None
+        """
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(self.work_async(), self.pending_async())
+
+    async def work_async(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            # the sink failed, wait before reading more data
+            delay = self.retry_at - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.spill_conf and time.time() - self.spill_check_time >= \
+                    self.spill_check_interval:
+                await loop.run_in_executor(None, self.check_spill)
+
+            if self.batcher:
+                self.batch_size = self.batcher.batch_size
+                self.linger = self.batcher.linger
+            try:
+                entries = await self.read()
+            except exceptions.ResponseError as e:
+                # NOGROUP for data_stream, recreate it.
+                if "NOGROUP" in str(e):
+                    log.error('{}, recreate group: {}'.format(
+                        str(e), self.group))
+                    await loop.run_in_executor(None, self.redis.addGroup,
+                                               self.group, self.stream)
+                entries = []
+            except Exception as err:
+                log.exception(err)
+                await asyncio.sleep(self.retry_interval)
+                entries = []
+
+            if not entries:
+                continue
+
+            ids = set(raw_data["id"] for raw_data in entries)
+            entries, datas = self.pack_batch(entries)
+            # data moved to the dead letter stream are finished
+            self.in_flight.difference_update(
+                ids - set(raw_data["id"] for raw_data in entries))
+            if not datas:
+                continue
+
+            # at most concurrency batches are sent at the same time
+            await self.semaphore.acquire()
+            task = asyncio.ensure_future(self.send_async(entries, datas))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def read(self):
+        """
+        Async version of getBatchData
+        :return: [dict{"id":string, "data":bytes, "v":int}]
+        """
+        res = []
+        block = self.block
+        count = max(self.batch_size, 1)
+        deadline = time.time() + self.linger / 1000.0
+        while len(res) < count:
+            data = await self.aredis.xreadgroup(self.group,
+                                                self.consumer,
+                                                {self.stream: '>'},
+                                                count=count - len(res),
+                                                block=block)
+            if data:
+                foreign = []
+                for id, raw in data[0][1]:
+                    if self.foreign(raw):
+                        foreign.append(id)
+                        continue
+                    self.in_flight.add(id.decode())
+                    res.append({
+                        "id": id.decode(),
+                        "data": raw[b'data'],
+                        "v": stream_format.version(raw)
+                    })
+                if foreign:
+                    # re-injected for another group
+                    await self.aredis.xack(self.stream, self.group, *foreign)
+            block = int((deadline - time.time()) * 1000)
+            if not res or block <= 0:
+                break
+        return res
+
+    async def send_async(self, entries, datas):
+        """
+        Send a batch of new data, failed data stays pending
+        :return: None
+        """
+        start, sent = time.time(), False
+        try:
+            await self.send_batch_async(datas)
+            sent = True
+            self.record_batch(start)
+            await self.ack_async(*[raw_data["id"] for raw_data in entries])
+        except DeadLetter as err:
+            # find out the data the sink refused
+            log.warning(err)
+            await self.send_each_async(entries, datas)
+        except Exception as err:
+            log.exception(err)
+            if not sent:
+                self.record_batch(start, False)
+            self.retry_at = time.time() + self.retry_interval
+        finally:
+            self.in_flight.difference_update(
+                raw_data["id"] for raw_data in entries)
+            self.semaphore.release()
+
+    async def send_batch_async(self, datas):
+        """
+        Async version of send_batch
+        :param datas: list, items are what self.pack returns
+        :return: None
+        """
+        if self.to_where == 'influxdb':
+            points = dict()
+            for data in datas:
+                points.setdefault(data[0]['unit'], []).extend(data)
+            for time_precision, json_body in points.items():
+                try:
+                    info = await self.db.send(json_body, time_precision)
+                except InfluxDBClientError as e:
+                    self.influxdb_refused(e, json_body)
+                self.influxdb_written(json_body, info)
+        else:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.send_batch, datas)
+
+    async def send_each_async(self, entries, datas):
+        """
+        Async version of send_each
+        :return: None
+        """
+        loop = asyncio.get_event_loop()
+        for raw_data, data in zip(entries, datas):
+            try:
+                await self.send_batch_async([data])
+                await self.ack_async(raw_data["id"])
+            except DeadLetter as err:
+                await loop.run_in_executor(None, self.move_to_dead_letter,
+                                           [raw_data], err)
+            except Exception as err:
+                log.exception(err)
+                if self.out_of_retries(raw_data):
+                    await loop.run_in_executor(None, self.move_to_dead_letter,
+                                               [raw_data], err)
+
+    async def ack_async(self, *ids):
+        await self.aredis.xack(self.stream, self.group, *ids)
+        self.record_latency(ids)
+
+    async def pending_async(self):
+        """
+        Async version of pending
+        :return: None
+        """
+        loop = asyncio.get_event_loop()
+        cursor = '0-0'
+        while True:
+            if self.claim_idle and \
+                    time.time() - self.claim_time >= self.claim_interval:
+                self.claim_time = time.time()
+                try:
+                    await loop.run_in_executor(None, self.reclaim)
+                except Exception as err:
+                    log.exception(err)
+
+            if self.trim_check_interval and time.time() - \
+                    self.trim_check_time >= self.trim_check_interval:
+                self.trim_check_time = time.time()
+                try:
+                    await loop.run_in_executor(None, self.check_trimmed)
+                except Exception as err:
+                    log.exception(err)
+
+            try:
+                pending_data, cursor = await self.get_pending_async(cursor)
+            except Exception as err:
+                log.exception(err)
+                pending_data, cursor = [], '0-0'
+
+            if pending_data:
+                async with self.semaphore:
+                    ok = await self.send_pending_async(pending_data)
+                if not ok:
+                    # the sink is down, scan again after retry_interval
+                    await asyncio.sleep(self.retry_interval)
+                    cursor = '0-0'
+            elif cursor == '0-0':
+                # whole pending list scanned
+                await asyncio.sleep(min(5, self.retry_backoff))
+
+    async def send_pending_async(self, pending_data):
+        """
+        Async version of send_pending
+        :return: bool, False when the sink is down
+        """
+        entries, datas = self.pack_batch(pending_data)
+        if not datas:
+            return True
+
+        try:
+            await self.send_batch_async(datas)
+            await self.ack_async(*[raw_data["id"] for raw_data in entries])
+            return True
+        except DeadLetter as err:
+            log.warning(err)
+        except Exception as err:
+            if not self.sink_available():
+                log.error('{} is unavailable, {} pending data are left '
+                          'pending: {}'.format(self.to_where, len(datas), err))
+                return False
+            log.exception(err)
+
+        await self.send_each_async(entries, datas)
+        return True
+
+    async def get_pending_async(self, cursor):
+        """
+        Async version of getPendingData
+        :return: (list, str)
+        """
+        pending = await self.aredis.xpending_range(self.stream,
+                                                   self.group,
+                                                   cursor,
+                                                   '+',
+                                                   self.pending_count,
+                                                   consumername=self.consumer)
+        if not pending:
+            return [], '0-0'
+
+        delivered, cursor = self.due(pending)
+        if not delivered:
+            return [], cursor
+
+        res, trimmed = self.claimed(
+            await self.aredis.xclaim(self.stream, self.group, self.consumer, 0,
+                                     list(delivered)), delivered)
+        if trimmed:
+            await self.aredis.xack(self.stream, self.group, *trimmed)
+        return res, cursor
+
+
+class AsyncEngine:
+    """
+    Run the AsyncTransports of all redis addresses, shards and sinks in one
+    event loop, work is the target of the chitu_asyncio thread
+    """
+
+    def __init__(self, conf, targets=None):
+        """
+        :param conf: dict, conf.toml
+        :param targets: list, [(address, [shard...])], default all streams
+        """
+        self.conf = conf
+        self.targets = targets
+        self.name = 'chitu_asyncio'
+        self.transports = list()
+
+        for redis_address, shards in targets or stream_targets(conf):
+            # transports of the same redis address share the redis clients
+            redis_client = RedisWrapper(redis_address)
+            async_redis = async_client(redis_address)
+            for shard in shards:
+                for sink in sinks(conf):
+                    transport = AsyncTransport(conf, redis_address, shard,
+                                               sink, redis_client, async_redis)
+                    transport.name = transport_name(conf, redis_address,
+                                                    shard, sink)
+                    self.transports.append(transport)
+
+    def work(self, *args):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(
+            asyncio.gather(*[transport.run()
+                             for transport in self.transports]))
+
+    def re_load(self):
+        return AsyncEngine(get_conf(), self.targets)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import logging
+
+try:
+    from queue import Queue
+except Exception:
+    from Queue import Queue
+
+log = logging.getLogger(__name__)
+
+POLICIES = ('block', 'drop_oldest', 'drop_newest', 'coalesce')
+
+
+class BoundedQueue(Queue):
+    """
+    有界队列, 队列满时按照 policy 处理新数据:
+        block:        阻塞生产者, 直到队列有空位 (与 Queue 一致)
+        drop_oldest:  丢弃队首最旧的数据
+        drop_newest:  丢弃新数据
+        coalesce:     队列中已有同一个 table_name 的数据时用新数据替换它,
+                      否则丢弃队首最旧的数据
+
+    用法:
+    queue = BoundedQueue(maxsize=1000, policy='drop_oldest')
+    queue.put(data)
+    queue.stats()  # {'size': 1000, 'maxsize': 1000, 'policy': ..., 'dropped': 3}
+    """
+
+    def __init__(self, maxsize=0, policy='block'):
+        if policy not in POLICIES:
+            raise ValueError('Unknown queue policy {}, choose from {}'.format(
+                policy, POLICIES))
+        Queue.__init__(self, maxsize)
+        self.policy = policy
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        if self.policy == 'block' or self.maxsize <= 0:
+            return Queue.put(self, item, block, timeout)
+
+        with self.not_full:
+            if self._qsize() >= self.maxsize:
+                self.dropped += 1
+                if self.policy == 'drop_newest':
+                    return
+                if self.policy == 'coalesce' and self.__coalesce(item):
+                    return
+                self._get()
+                self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def __coalesce(self, item):
+        """
+        用 item 替换队列中同一个 table_name 的数据
+        :return: bool, 是否替换成功
+        """
+        key = item.get('table_name') if isinstance(item, dict) else None
+        if key is None:
+            return False
+        for index, queued in enumerate(self.queue):
+            if isinstance(queued, dict) and queued.get('table_name') == key:
+                self.queue[index] = item
+                return True
+        return False
+
+    def stats(self):
+        """
+        Return queue depth and dropped counter
+        :return: dict
+        """
+        return {
+            'size': self.qsize(),
+            'maxsize': self.maxsize,
+            'policy': self.policy,
+            'dropped': self.dropped
+        }
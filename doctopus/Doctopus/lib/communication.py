@@ -17,6 +17,9 @@ log = logging.getLogger(__name__)
 class Communication(object):
     INSTANCE = None
     Lock = threading.RLock()
+    # the worker processes of chitu's supervisor set it to False, only the
+    # supervisor owns the "status" key
+    FLUSH = True
 
     def __new__(cls, *args, **kwargs):
         """
@@ -42,18 +45,24 @@ class Communication(object):
         self.watchdog = WatchDog(conf)
         self.app = conf['application']
         self.data = dict()
+        # runtime metrics reported by workers, key is the worker name
+        self.metrics = dict()
+        # inter-thread queues of ziyan, passed in by work
+        self.queues = dict()
         self._name = 'communication'
         self.log = list()
         self.hash = None
 
         # 20-12-14 zhy: windows启动异常，communication中没有self.paths参数
-        self.__init_paths()
+        self.__init_paths(conf)
         # 重启刷新缓存
-        self.flush_data()
+        if self.FLUSH:
+            self.flush_data()
 
-    def __init_paths(self):
+    def __init_paths(self, conf):
         if self.app == "ziyan":
-            self.paths = ['./conf/conf.toml', './lua/enque_script.lua', './plugins/your_plugin.py']
+            lua_path = conf.get('sender', {}).get('lua_path', 'lua/enque_script.lua')
+            self.paths = ['./conf/conf.toml', os.path.join('.', lua_path), './plugins/your_plugin.py']
         elif self.app == "chitu":
             self.paths = ['./conf/conf.toml']
         else:
@@ -70,6 +79,8 @@ class Communication(object):
         :param args:
         :return:
         """
+        if args and isinstance(args[0], dict):
+            self.queues = args[0]
         loop = asyncio.SelectorEventLoop()
         asyncio.set_event_loop(loop)
         loop.call_soon_threadsafe(loop.create_task, self.handle())
@@ -120,6 +131,8 @@ class Communication(object):
             status = {
                 'data': self.data,
                 'log': self.log,
+                'metrics': self.metrics,
+                'queue': self.queue_stats(),
                 'check_restart_time': self.watchdog.check_restart_num,
                 'handle_restart_time': self.watchdog.handle_restart_num,
                 'real_time_thread_name': self.watchdog.thread_real_time_names
@@ -128,6 +141,7 @@ class Communication(object):
             status = {
                 'data': self.data,
                 'log': self.log,
+                'metrics': self.metrics,
                 'transport_restart_time': self.watchdog.transport_restart_num,
                 'real_time_thread_name': self.watchdog.thread_real_time_names
             }
@@ -137,6 +151,19 @@ class Communication(object):
         except Exception as err:
             log.exception(err)
 
+    def queue_stats(self):
+        """
+        Depth and dropped counter of each inter-thread queue
+        :return: dict
+        """
+        stats = dict()
+        for name, queue in self.queues.items():
+            if hasattr(queue, 'stats'):
+                stats[name] = queue.stats()
+            else:
+                stats[name] = {'size': queue.qsize()}
+        return stats
+
     def flush_data(self):
         """
         Delete the existing key "status"
@@ -1,16 +1,181 @@
 # -*- coding: utf-8 -*-
 import logging
+import threading
 import time
+import zlib
 
 import redis
 import requests
 #  from etcd import Client
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBServerError
 from redis import exceptions
 
+from Doctopus.lib.line_protocol import LineEncoder, gzip_body
+
 log = logging.getLogger(__name__)
 
 MAXLEN = 100000
+STREAM = "data_stream"
+# deadband conf hash of enque_script_v2.lua, named by Sender from preload
+DEADBAND_KEY = "deadband_conf"
+
+# move a data to the dead letter stream only when it is still pending, so a
+# data retried by two consumers at the same time is moved once
+# KEYS: stream, dead letter stream; ARGV: group, maxlen, id, fields...
+DEAD_LETTER_SCRIPT = """
+if redis.call('XACK', KEYS[1], ARGV[1], ARGV[3]) == 1 then
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*',
+               unpack(ARGV, 4))
+    return 1
+end
+return 0
+"""
+
+# count the entries after an id (exclusive) in redis, only the count and the
+# last id counted are returned, for the lag of a group before redis 7
+# KEYS: stream; ARGV: id, max entries counted
+COUNT_AFTER_SCRIPT = """
+local count, start, limit = 0, ARGV[1], tonumber(ARGV[2])
+while count < limit do
+    -- 手动加一代替 '(' 开区间, 兼容 redis 6.2 以前的版本
+    local ms, seq = string.match(start, '(%d+)-(%d+)')
+    local entries = redis.call('XRANGE', KEYS[1], ms .. '-' .. (seq + 1), '+',
+                               'COUNT', math.min(1000, limit - count))
+    if #entries == 0 then
+        break
+    end
+    count = count + #entries
+    start = entries[#entries][1]
+end
+return {count, start}
+"""
+
+
+# process-wide connection pools, shared by every RedisWrapper of the same
+# redis: (host, port, db, unix_socket_path) -> redis.BlockingConnectionPool
+POOLS = dict()
+POOLS_LOCK = threading.Lock()
+# default max_connections of a pool, raised to the connections held by the
+# blocking threads of chitu plus POOL_MARGIN for the other clients
+MAX_CONNECTIONS = 50
+POOL_MARGIN = 10
+
+
+def pool_key(conf):
+    """
+    Key of the connection pool of a redis conf
+    :param conf: dict, host, port, db and unix_socket_path of redis
+    :return: tuple
+    """
+    return (conf.get('host', 'localhost'), conf.get('port', 6379),
+            conf.get('db', 0), conf.get('unix_socket_path'))
+
+
+def connection_pool(conf, min_connections=0):
+    """
+    Get the shared connection pool of a redis, create it for the first time.
+    The pool is bounded by max_connections, a thread waits at most
+    pool_timeout seconds for a free connection
+    :param conf: dict, host, port, db of redis, or unix_socket_path when
+                 redis is on the same host
+    :param min_connections: int, connections held at the same time by the
+                            blocking threads of the caller
+    :return: redis.BlockingConnectionPool
+    """
+    key = pool_key(conf)
+    need = min_connections + POOL_MARGIN if min_connections else 0
+    with POOLS_LOCK:
+        pool = POOLS.get(key)
+        if pool is None:
+            host, port, db, path = key
+            kwargs = {
+                'db': db,
+                'max_connections': conf.get('max_connections',
+                                            max(MAX_CONNECTIONS, need)),
+                'timeout': conf.get('pool_timeout', 20)
+            }
+            if path:
+                kwargs['connection_class'] = redis.UnixDomainSocketConnection
+                kwargs['path'] = path
+            else:
+                kwargs['host'] = host
+                kwargs['port'] = port
+            pool = POOLS[key] = redis.BlockingConnectionPool(**kwargs)
+    if pool.max_connections < need:
+        host, port, db, path = key
+        log.error('The connection pool of redis {}/{} has {} connections, '
+                  'but {} threads block on it, set max_connections to at '
+                  'least {}.'.format(path or '{}:{}'.format(host, port), db,
+                                     pool.max_connections, min_connections,
+                                     need))
+    return pool
+
+
+def trim_args(conf):
+    """
+    Trimming ARGV of the enque scripts
+    :param conf: dict, [sender] of conf.toml
+    :return: tuple, (maxlen, '~' for approximate or '=' for exact trimming,
+             seconds of the time retention)
+    """
+    return (conf.get('maxlen', MAXLEN),
+            '~' if conf.get('approximate_trim', True) else '=',
+            conf.get('retention', 0))
+
+
+def id_tuple(id):
+    """
+    Comparable (ms, seq) of a stream id
+    :param id: bytes or str
+    :return: tuple
+    """
+    if isinstance(id, bytes):
+        id = id.decode()
+    ms, _, seq = id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def next_id(id):
+    """
+    The smallest stream id after id, XRANGE from it excludes id without the
+    '(' of redis 6.2+
+    :param id: bytes or str
+    :return: str
+    """
+    ms, seq = id_tuple(id)
+    return '{}-{}'.format(ms, seq + 1)
+
+
+def client_gzip(conf):
+    """
+    Whether the influxdb client compresses the bodies, only for the json
+    path, the line protocol bodies are compressed by InfluxdbWrapper
+    :param conf: dict, [influxdb] of conf.toml
+    :return: bool
+    """
+    return conf.get('gzip', False) and not conf.get('line_protocol', True)
+
+
+def stream_name(shard):
+    """
+    Name of the shard stream, shard 0 is data_stream
+    :param shard: int
+    :return: str
+    """
+    return STREAM if shard == 0 else "{}_{}".format(STREAM, shard)
+
+
+def shard_of(eqpt_no, table_name, shards):
+    """
+    Route a series to a shard, the same series always goes to the same
+    shard so its data is consumed in order
+    :return: int
+    """
+    if shards <= 1:
+        return 0
+    key = "{}_{}".format(eqpt_no, table_name).encode('utf-8')
+    return zlib.crc32(key) % shards
 
 
 class RedisWrapper:
@@ -23,14 +188,18 @@ class RedisWrapper:
     db.enqueue(**kwargs)  #入队
     """
 
-    def __init__(self, conf):
+    def __init__(self, conf, min_connections=0):
         """
-        :param conf: dict, 包含 Redis 的 host, port, db
+        :param conf: dict, 包含 Redis 的 host, port, db, 或本机 redis 的
+                     unix_socket_path; 同一 redis 的 RedisWrapper 共用
+                     一个连接池
+        :param min_connections: int, 调用方阻塞线程同时占用的连接数,
+                                见 connection_pool
         """
-        pool = redis.ConnectionPool(host=conf.get('host', 'localhost'),
-                                    port=conf.get('port', 6379),
-                                    db=conf.get('db', 0))
+        pool = connection_pool(conf, min_connections)
         self.__db = redis.StrictRedis(connection_pool=pool, socket_timeout=1)
+        self.__dead_letter = self.__db.register_script(DEAD_LETTER_SCRIPT)
+        self.__count_after = self.__db.register_script(COUNT_AFTER_SCRIPT)
 
         # 测试redis连通性
         self.test_connect()
@@ -49,6 +218,17 @@ class RedisWrapper:
                 time.sleep(2)
                 continue
 
+    def ping(self):
+        """
+        Test redis once, without waiting for it like test_connect
+        :return: bool
+        """
+        try:
+            return self.__db.ping()
+        except Exception as err:
+            log.debug('Redis unavailable: {}'.format(err))
+            return False
+
     def script_load(self, lua_script_file):
         """
         加载 Lua 脚本, 生成对应的 sha, 保存在类属性中
@@ -60,16 +240,18 @@ class RedisWrapper:
             script = fn.read()
             self.sha = self.__db.script_load(script)
 
-    def addGroup(self, group_name):
+    def addGroup(self, group_name, stream=STREAM):
         """
         add group for data stream
         args:
             group_name: string  ;group name
+            stream: string ;stream name
         """
         try:
             # if not exists data_stream, make a data_stream
-            self.__db.xgroup_create("data_stream", group_name, mkstream=True)
-            self.__db.xtrim("data_stream", MAXLEN)
+            # the stream is trimmed by the enque script with the maxlen and
+            # retention of [sender], not here
+            self.__db.xgroup_create(stream, group_name, mkstream=True)
         except exceptions.ResponseError as err:
             # 1. exist group , no need panic
             if "already exists" in str(err):
@@ -79,40 +261,44 @@ class RedisWrapper:
             log.exception(err)
             raise err
 
-    def readGroup(self, group_name, consumer):
+    def readGroup(self, group_name, consumer, count=1, block=1000,
+                  stream=STREAM):
         """
         Read data_stream by group
         args:
             group_name: string  ;group name
             consumer: string ;consumer name
+            count: int ;max entries returned by one XREADGROUP
+            block: int ;milliseconds to block when stream is empty
+            stream: string ;stream name
         return:
             result: List[List[byte, List[set(byte, dict{byte:byte})]]]
             [[
                 b'data_stream',
                 [(b'1571295570085-0', {
-                    b'MAXLEN': b'700000',
                     b'data': b'\x8a6...'
-                })..only 1]
+                })..count]
             ]]
         """
         streams = {
-            "data_stream": ">",
+            stream: ">",
         }
         result = self.__db.xreadgroup(group_name,
                                       consumer,
                                       streams,
-                                      count=1,
-                                      block=1000)
+                                      count=count,
+                                      block=block)
 
         return result
 
-    def readPending(self, group_name, consumer, id):
+    def readPending(self, group_name, consumer, id, stream=STREAM):
         """
         Read pending data_stream
         args:
             group_name: string ;group name
             consumer: string ;consumer name
             id: string ; pending data id
+            stream: string ;stream name
         return:
             result: [[
                         b'data_stream',
@@ -124,7 +310,7 @@ class RedisWrapper:
                     List[List[byte, List[set(byte, dict{byte:byte})]]]
         """
         streams = {
-            "data_stream": id,
+            stream: id,
         }
 
         result = self.__db.xreadgroup(group_name,
@@ -134,11 +320,12 @@ class RedisWrapper:
                                       block=1000)
         return result
 
-    def xPending(self, group_name):
+    def xPending(self, group_name, stream=STREAM):
         """
         Return the pending messages ID info
         args:
             group_name: string  ;group name
+            stream: string ;stream name
         return:
             result: {'pending': 3263,
                 'min': b'1571038514316-0',
@@ -148,17 +335,279 @@ class RedisWrapper:
                     {'name': b'kafka', 'pending': 3213}]
             }
         """
-        result = self.__db.xpending("data_stream", group_name)
+        result = self.__db.xpending(stream, group_name)
         return result
 
-    def ack(self, group_name, *ids):
+    def pendingRange(self, group_name, consumer, start, count=100,
+                     stream=STREAM):
+        """
+        Return pending messages info of the consumer from start id
+        args:
+            group_name: string ;group name
+            consumer: string ;consumer name
+            start: string ;min id, inclusive
+            count: int ;max messages returned
+            stream: string ;stream name
+        return:
+            result: [{'message_id': b'1571038514316-0',
+                      'consumer': b'chitu',
+                      'time_since_delivered': 1000,
+                      'times_delivered': 2}...]
+        """
+        return self.__db.xpending_range(stream, group_name, start, '+',
+                                        count, consumername=consumer)
+
+    def claimData(self, group_name, consumer, ids, stream=STREAM):
+        """
+        Deliver pending messages to consumer again, delivery count of the
+        messages is increased
+        args:
+            group_name: string ;group name
+            consumer: string ;consumer name
+            ids: list ;message ids
+            stream: string ;stream name
+        return:
+            result: [(b'id', {b'data': b''})...], fields is None when the
+                    message was trimmed
+        """
+        return self.__db.xclaim(stream, group_name, consumer, 0, ids)
+
+    def claim(self, group_name, consumer, min_idle_time, start='0-0',
+              count=100, stream=STREAM):
+        """
+        Claim pending messages idle for more than min_idle_time from other
+        consumers, use XAUTOCLAIM and fall back to XPENDING + XCLAIM before
+        redis 6.2
+        args:
+            group_name: string ;group name
+            consumer: string ;consumer name which claims messages
+            min_idle_time: int ;milliseconds
+            start: string ;XAUTOCLAIM cursor
+            count: int ;max messages claimed
+            stream: string ;stream name
+        return:
+            (next_start, [claimed id...]), next_start is '0-0' when the
+            whole pending list was scanned
+        """
+        try:
+            result = self.__db.xautoclaim(stream, group_name, consumer,
+                                          min_idle_time, start_id=start,
+                                          count=count, justid=True)
+            next_start = result[0]
+            if isinstance(next_start, bytes):
+                next_start = next_start.decode()
+            return next_start, result[1]
+        except exceptions.ResponseError as err:
+            if 'unknown command' not in str(err).lower():
+                raise err
+
+        pending = self.__db.xpending_range(stream, group_name, '-', '+',
+                                           count)
+        ids = [
+            p['message_id'] for p in pending
+            if p['time_since_delivered'] >= min_idle_time
+            and p['consumer'].decode() != consumer
+        ]
+        if not ids:
+            return '0-0', []
+        # XCLAIM checks idle time again, messages just delivered are skipped
+        claimed = self.__db.xclaim(stream, group_name, consumer,
+                                   min_idle_time, ids, justid=True)
+        return '0-0', claimed
+
+    def consumers(self, group_name, stream=STREAM):
+        """
+        Return consumers of the group
+        args:
+            group_name: string ;group name
+            stream: string ;stream name
+        return:
+            result: [{'name': b'chitu', 'pending': 0, 'idle': 1000}...]
+        """
+        return self.__db.xinfo_consumers(stream, group_name)
+
+    def delConsumer(self, group_name, consumer, stream=STREAM):
+        """
+        Delete consumer from the group
+        args:
+            group_name: string ;group name
+            consumer: string ;consumer name
+            stream: string ;stream name
+        """
+        return self.__db.xgroup_delconsumer(stream, group_name, consumer)
+
+    def ack(self, group_name, *ids, **kwargs):
         """
         ACK ids
         args:
             group_name: string ;group name
             *ids: data id
+            stream: string ;stream name, keyword only
+        """
+        self.__db.xack(kwargs.get('stream', STREAM), group_name, *ids)
+
+    def deadLetter(self, group_name, entries, dead_stream, maxlen=10000,
+                   stream=STREAM):
+        """
+        Ack data and move them to the dead letter stream, data acked
+        already is not moved again
+        args:
+            group_name: string ;group name
+            entries: list ;fields of dead letters, id is the data id
+            dead_stream: string ;dead letter stream name
+            maxlen: int ;max length of the dead letter stream
+            stream: string ;stream name
+        return:
+            result: int ;number of moved data
+        """
+        pipe = self.__db.pipeline(transaction=False)
+        for fields in entries:
+            args = [group_name, maxlen, fields['id']]
+            for item in fields.items():
+                args.extend(item)
+            self.__dead_letter(keys=[stream, dead_stream],
+                               args=args,
+                               client=pipe)
+        return sum(pipe.execute())
+
+    def replayDeadLetter(self, letters, dead_stream, stream=STREAM):
+        """
+        Add dead letters to the stream as new data and delete them from the
+        dead letter stream in one transaction, the stream is trimmed by the
+        next XADD of the enque script
+        args:
+            letters: list ;[(b'id', {b'v': b'2', b'data': b''...})...]
+            dead_stream: string ;dead letter stream name
+            stream: string ;stream name
+        """
+        pipe = self.__db.pipeline(transaction=True)
+        for _, raw in letters:
+            fields = {'data': raw[b'data']}
+            if b'v' in raw and int(raw[b'v']) != 1:
+                fields['v'] = raw[b'v']
+            pipe.xadd(stream, fields)
+        pipe.xdel(dead_stream, *[id for id, _ in letters])
+        return pipe.execute()
+
+    def trimmedUnread(self, group_name, stream=STREAM):
+        """
+        Number of entries trimmed from the stream before the group read
+        them, needs max-deleted-entry-id, entries-added and entries-read of
+        redis 7+
+        args:
+            group_name: string ;group name
+            stream: string ;stream name
+        return:
+            int, None when redis can not tell
+        """
+        info = self.__db.xinfo_stream(stream)
+        group = self.groupInfo(group_name, stream)
+        max_deleted = info.get('max-deleted-entry-id')
+        entries_added = info.get('entries-added')
+        if group is None or max_deleted is None or entries_added is None or \
+                group.get('entries-read') is None:
+            return None
+        if id_tuple(max_deleted) <= id_tuple(group['last-delivered-id']):
+            return 0
+        # every entry the group read was trimmed, the other trimmed entries
+        # were never read
+        return max(entries_added - info['length'] - group['entries-read'], 0)
+
+    def groupInfo(self, group_name, stream=STREAM):
+        """
+        XINFO GROUPS of a group
+        args:
+            group_name: string ;group name
+            stream: string ;stream name
+        return:
+            dict, None when the group does not exist
+        """
+        for group in self.__db.xinfo_groups(stream):
+            if group['name'] in (group_name, group_name.encode()):
+                return group
+        return None
+
+    def groupLag(self, group_name, stream=STREAM, limit=100000):
+        """
+        Number of entries the group has not read yet, lag of redis 7+, or
+        counted after last-delivered-id (at most limit) on older redis. The
+        ids are counted in redis, at most 10000 per call so redis is not
+        blocked long, the entries are not read back
+        args:
+            group_name: string ;group name
+            stream: string ;stream name
+            limit: int ;stop counting at limit
+        return:
+            int
+        """
+        group = self.groupInfo(group_name, stream)
+        if group is None:
+            return 0
+        if group.get('lag') is not None:
+            return group['lag']
+        info = self.__db.xinfo_stream(stream)
+        if not info['length']:
+            return 0
+        start = group['last-delivered-id']
+        if id_tuple(start) < id_tuple(info['first-entry'][0]):
+            # all entries are after last-delivered-id
+            return info['length']
+        lag = 0
+        while lag < limit:
+            step = min(10000, limit - lag)
+            count, start = self.__count_after(keys=[stream],
+                                              args=[start, step])
+            lag += count
+            if count < step:
+                break
+        return lag
+
+    def setGroupId(self, group_name, id, stream=STREAM, entries_read=None):
+        """
+        Move last-delivered-id of the group, the entries before it will not
+        be delivered to the group
+        args:
+            group_name: string ;group name
+            id: string ;new last-delivered-id
+            stream: string ;stream name
+            entries_read: int ;entries-read of redis 7+, keeps lag valid
+        """
+        args = ['XGROUP', 'SETID', stream, group_name, id]
+        if entries_read is not None:
+            args.extend(['ENTRIESREAD', entries_read])
+        return self.__db.execute_command(*args)
+
+    def reinject(self, entries, group_name, stream=STREAM):
         """
-        self.__db.xack("data_stream", group_name, *ids)
+        Add spilled entries back to the stream as new entries for the group,
+        the stream is not trimmed here but by the next XADD of the enque
+        script with the maxlen and retention of [sender]
+        args:
+            entries: list ;[(id, {field: value})] read from the spill file
+            group_name: string ;only this group sends them
+            stream: string ;stream name
+        return:
+            list, new ids
+        """
+        pipe = self.__db.pipeline(transaction=False)
+        for _, fields in entries:
+            fields = dict(fields)
+            fields[b'g'] = group_name
+            pipe.xadd(stream, fields)
+        return pipe.execute()
+
+    def xRange(self, stream, start='-', end='+', count=None):
+        """
+        Return data of the stream between start and end
+        args:
+            stream: string ;stream name
+            start: string ;min id, inclusive
+            end: string ;max id, inclusive
+            count: int ;max data returned
+        return:
+            result: [(b'id', {b'data': b''})...]
+        """
+        return self.__db.xrange(stream, start, end, count)
 
     def enqueue(self, **kwargs):
         """
@@ -169,8 +618,31 @@ class RedisWrapper:
         timestamp = kwargs.pop('timestamp')
         fields = kwargs.pop('fields')
         table_name = kwargs.pop('table_name')
-
-        return self.__db.evalsha(self.sha, 1, table_name, fields, timestamp)
+        stream_format = kwargs.pop('stream_format', 1)
+        stream = kwargs.pop('stream', STREAM)
+        trim = kwargs.pop('trim', trim_args(dict()))
+        deadband = kwargs.pop('deadband', DEADBAND_KEY)
+
+        return self.__db.evalsha(self.sha, 3, table_name, stream, deadband,
+                                 fields, timestamp, stream_format, *trim)
+
+    def enqueue_many(self, records, raise_on_error=True):
+        """
+        将多条数据通过 pipeline 一次性传入 Lua 脚本, 每条数据仍由脚本单独去重
+        :param records: list, 元素为包含 table_name, fields, timestamp 的 dict
+        :param raise_on_error: bool, False 时脚本报错的数据在返回值中对应
+                               ResponseError, 不影响其他数据
+        :return: list, 每条数据对应的 lua 脚本返回值
+        """
+        pipe = self.__db.pipeline(transaction=False)
+        for record in records:
+            pipe.evalsha(self.sha, 3, record['table_name'],
+                         record.get('stream', STREAM),
+                         record.get('deadband', DEADBAND_KEY),
+                         record['fields'],
+                         record['timestamp'], record.get('stream_format', 1),
+                         *record.get('trim', trim_args(dict())))
+        return pipe.execute(raise_on_error=raise_on_error)
 
     def dequeue(self, key):
         """
@@ -280,6 +752,14 @@ class InfluxdbWrapper:
         db = InfluxdbWrapper(conf)
 
         db.send(josn_data, retention_policy='specify')
+
+        conf 中的 pool_size 传给 InfluxDBClient, 所有请求复用 pool_size 个
+        keep-alive 连接; gzip = true 时 line protocol 请求体按 gzip_level 压缩
+        后发送, bytes 同时记录压缩前后的字节数.
+
+        send 不再每次写入前探测连通性, 而是根据写入结果维护一个熔断状态:
+        写入因网络或服务端错误失败时熔断打开, send 直接返回 False,
+        同时启动后台线程每隔 probe_interval 秒 ping 一次, 成功后熔断关闭.
         """
 
     def __init__(self, *args, **kwargs):
@@ -298,7 +778,9 @@ class InfluxdbWrapper:
                                        username=args[0]['username'],
                                        password=args[0]['password'],
                                        database=args[0]['db'],
-                                       timeout=args[0].get('timeout', 10))
+                                       timeout=args[0].get('timeout', 10),
+                                       pool_size=args[0].get('pool_size', 10),
+                                       gzip=client_gzip(args[0]))
             self.conf = args[0]
 
         elif kwargs:
@@ -307,14 +789,38 @@ class InfluxdbWrapper:
                                        username=kwargs['username'],
                                        password=kwargs['password'],
                                        database=kwargs['db'],
-                                       timeout=kwargs.get('timeout', 10))
+                                       timeout=kwargs.get('timeout', 10),
+                                       pool_size=kwargs.get('pool_size', 10),
+                                       gzip=client_gzip(kwargs))
             self.conf = kwargs
 
         else:
             pass
 
+        if isinstance(self.conf, dict):
+            self.probe_interval = self.conf.get('probe_interval', 5)
+            self.database = self.conf['db']
+            line_protocol = self.conf.get('line_protocol', True)
+            self.gzip = self.conf.get('gzip', False)
+            self.gzip_level = self.conf.get('gzip_level', 6)
+        else:
+            self.probe_interval = 5
+            self.database = self.conf[4]
+            line_protocol = True
+            self.gzip = False
+            self.gzip_level = 6
+        # encode points to line protocol with the cached encoder instead of
+        # the json path of the influxdb client
+        self.encoder = LineEncoder() if line_protocol else None
+        # bytes of the line protocol bodies before and after compression
+        self.bytes = {'raw': 0, 'wire': 0, 'requests': 0}
+        self.__probe_lock = threading.Lock()
+        self.__probing = False
+
         # 测试 influxdb 连通性
-        self.test_connect()
+        self.healthy = True
+        if not self.test_connect():
+            self.open_circuit()
 
     def test_connect(self):
         """初始化连接 Influxdb 数据库, 确保 Influxdb 连接成功
@@ -332,6 +838,35 @@ class InfluxdbWrapper:
                 log.error('Failed to connect to InfluxDB: {}'.format(err))
                 time.sleep(2)
 
+    def open_circuit(self):
+        """熔断打开, 启动后台探测线程直到 influxdb 恢复
+            :return: None
+        """
+        self.healthy = False
+        with self.__probe_lock:
+            if self.__probing:
+                return
+            self.__probing = True
+        probe = threading.Thread(target=self.__probe, name='influxdb_probe')
+        probe.setDaemon(True)
+        probe.start()
+
+    def __probe(self):
+        """后台探测 influxdb, 只在熔断打开期间运行
+            :return: None
+        """
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                self.__db.ping()
+                break
+            except Exception as err:
+                log.error('InfluxDB still unavailable: {}'.format(err))
+        log.info('InfluxDB recovered, close circuit.')
+        with self.__probe_lock:
+            self.__probing = False
+            self.healthy = True
+
     def send(self,
              json_body,
              time_precision='s',
@@ -346,16 +881,74 @@ class InfluxdbWrapper:
                             Defaults to the client’s current database
             :param retention_policy: str, the retention policy for the points.
                                     Defaults to None
-            :return: bool
+            :return: bool, False when the circuit is open
         """
-        if self.test_connect():
-            info = self.__db.write_points(json_body,
-                                          time_precision=time_precision,
-                                          database=database,
-                                          retention_policy=retention_policy)
-            return info
-        else:
+        if not self.healthy:
             return False
+        try:
+            if self.encoder and self.gzip:
+                body = self.encoder.encode(json_body, time_precision)
+                # compressed here instead of by the client to count the bytes
+                wire = gzip_body(body, self.gzip_level)
+                info = self.write_gzip(wire, time_precision, database,
+                                       retention_policy)
+                self.count_bytes(len(body), len(wire))
+            elif self.encoder:
+                body = self.encoder.encode(json_body, time_precision)
+                # the client appends the last newline
+                info = self.__db.write_points(
+                    [body[:-1].decode('utf-8')],
+                    time_precision=time_precision,
+                    database=database,
+                    retention_policy=retention_policy,
+                    protocol='line')
+                self.count_bytes(len(body), len(body))
+            else:
+                info = self.__db.write_points(
+                    json_body,
+                    time_precision=time_precision,
+                    database=database,
+                    retention_policy=retention_policy)
+        except (requests.exceptions.RequestException,
+                InfluxDBServerError) as err:
+            log.error('Failed to write InfluxDB, open circuit: {}'.format(err))
+            self.open_circuit()
+            raise err
+        return info
+
+    def write_gzip(self, body, time_precision, database, retention_policy):
+        """Write a gzipped line protocol body
+            :param body: bytes, gzipped line protocol
+            :param time_precision: database time precision
+            :param database: str, defaults to the database of the wrapper
+            :param retention_policy: str, defaults to None
+            :return: bool
+        """
+        params = {'db': database or self.database}
+        if time_precision is not None:
+            params['precision'] = time_precision
+        if retention_policy is not None:
+            params['rp'] = retention_policy
+        self.__db.request(url='write',
+                          method='POST',
+                          params=params,
+                          data=body,
+                          expected_response_code=204,
+                          headers={
+                              'Content-Type': 'application/octet-stream',
+                              'Content-Encoding': 'gzip'
+                          })
+        return True
+
+    def count_bytes(self, raw, wire):
+        """Count a request body written
+            :param raw: int, bytes of the line protocol body
+            :param wire: int, bytes sent after compression
+            :return: None
+        """
+        self.bytes['raw'] += raw
+        self.bytes['wire'] += wire
+        self.bytes['requests'] += 1
 
     def swith_database(self, database):
         """Change the client’s database.
@@ -363,6 +956,7 @@ class InfluxdbWrapper:
             :return: None
         """
         self.__db.switch_database(database)
+        self.database = database
 
     def query(self, query):
         """Send a query to Influxdb
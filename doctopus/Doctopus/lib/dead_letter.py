@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+死信stream: chitu无法发送的数据
+
+重试次数用完或sink明确拒绝(如超过保留策略, 格式错误)的数据会被移到
+<stream>_dead_letter, 同时从原group中ack, 不再阻塞后续数据。
+死信保留原始数据, 可通过web接口 /dead_letter/ 或
+python manage.py -t chitu -a dead_letter/replay 查看和重放。
+重放的数据作为新数据加入原stream, 多个sink时每个消费组都会再收到一次。
+
+死信的字段:
+    {b'id': 原数据id, b'stream': 原stream, b'group': 原group,
+     b'reason': 失败原因, b'delivered': 投递次数, b'time': 移入时间,
+     b'v': 格式版本, b'data': 原始数据}
+"""
+import logging
+import time
+
+from Doctopus.lib import stream_format
+from Doctopus.lib.database_wrapper import stream_name
+
+log = logging.getLogger(__name__)
+
+# max entries kept in a dead letter stream
+MAXLEN = 10000
+
+
+class DeadLetter(Exception):
+    """
+    Raised by a sink for data it will never accept, the data is moved to the
+    dead letter stream instead of being retried
+    """
+
+
+def dead_letter_name(stream):
+    """
+    Name of the dead letter stream of a data stream
+    :param stream: str
+    :return: str
+    """
+    return "{}_dead_letter".format(stream)
+
+
+def entry(raw_data, reason, group, stream):
+    """
+    Fields of the dead letter entry of a data
+    :param raw_data: dict, {"id": str, "raw": bytes, "v": int, "delivered": int}
+    :param reason: str
+    :return: dict
+    """
+    return {
+        'id': raw_data['id'],
+        'stream': stream,
+        'group': group,
+        'reason': str(reason)[:1000],
+        'delivered': raw_data.get('delivered', 1),
+        'time': int(time.time()),
+        'v': raw_data.get('v', stream_format.FORMAT_V1),
+        'data': raw_data['raw'],
+    }
+
+
+def streams(conf):
+    """
+    Redis addresses and data streams of a chitu conf
+    :param conf: dict, conf.toml
+    :return: list, [(address, stream)]
+    """
+    shards = conf.get('data_stream', dict()).get('shards', 1)
+    return [(address, stream_name(shard))
+            for address in conf['redis_instance']['address']
+            for shard in range(shards)]
+
+
+def stream_key(address, stream):
+    """
+    Name of a data stream of a redis address, i.e. 127.0.0.1:6379/0/data_stream
+    or /var/run/redis.sock/0/data_stream
+    :param address: dict, item of [redis_instance.address]
+    :param stream: str, data stream name
+    :return: str
+    """
+    location = address.get('unix_socket_path') or '{}:{}'.format(
+        address.get('host', 'localhost'), address.get('port', 6379))
+    return '{}/{}/{}'.format(location, address.get('db', 0), stream)
+
+
+def inspect(redis, stream, start='-', count=100):
+    """
+    Read dead letters of a data stream
+    :param redis: RedisWrapper
+    :param stream: str, data stream name
+    :param start: str, min dead letter id
+    :param count: int
+    :return: list, dead letters with the data decoded
+    """
+    letters = []
+    for id, raw in redis.xRange(dead_letter_name(stream), start, count=count):
+        letter = {
+            k.decode(): v.decode()
+            for k, v in raw.items() if k != b'data'
+        }
+        try:
+            letter['data'] = stream_format.decode(raw[b'data'],
+                                                  stream_format.version(raw))
+        except Exception as err:
+            letter['data'] = None
+            letter['decode_error'] = str(err)
+        letter['dead_letter_id'] = id.decode()
+        letters.append(letter)
+    return letters
+
+
+def replay(redis, stream, ids=None, count=100):
+    """
+    Move dead letters back to their data stream as new data
+    :param redis: RedisWrapper
+    :param stream: str, data stream name
+    :param ids: list, dead letter ids, None for the oldest count letters
+    :param count: int
+    :return: int, number of replayed dead letters
+    """
+    dead_stream = dead_letter_name(stream)
+    if ids:
+        letters = []
+        for id in ids:
+            letters.extend(redis.xRange(dead_stream, id, id))
+    else:
+        letters = redis.xRange(dead_stream, count=count)
+    if letters:
+        redis.replayDeadLetter(letters, dead_stream, stream)
+        log.info('Replayed {} dead letters to {}.'.format(
+            len(letters), stream))
+    return len(letters)
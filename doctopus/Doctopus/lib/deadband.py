@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import logging
+import numbers
+import zlib
+
+import msgpack
+
+log = logging.getLogger(__name__)
+
+# hash read by enque_script_v2.lua, field is table name, '*' is the default.
+# preload adds a checksum of the conf, so ziyan instances with different
+# [deadband] sharing one redis db do not overwrite each other
+CONF_KEY = 'deadband_conf'
+
+
+def table_conf(conf, table_name):
+    """
+    Resolve the deadband conf of a table, [deadband.tables.<table_name>]
+    overrides the defaults of [deadband]
+    :param conf: dict, [deadband] section of conf.toml
+    :param table_name: str, '*' for the defaults
+    :return: dict, i.e.
+        {
+            'time_range': 10,
+            'mark_range': 300,
+            'abs': 0,   # default absolute tolerance of numeric fields
+            'rel': 0,   # default relative tolerance of numeric fields
+            'fields': {'temp': {'abs': 0.5, 'rel': 0}}
+        }
+    """
+    table = conf.get('tables', dict()).get(table_name, dict())
+    resolved = {
+        'time_range': table.get('time_range', conf.get('time_range', 10)),
+        'mark_range': table.get('mark_range', conf.get('mark_range', 300)),
+        'abs': table.get('tolerance', conf.get('tolerance', 0)),
+        'rel': table.get('rel_tolerance', conf.get('rel_tolerance', 0)),
+        'fields': dict()
+    }
+    # field tolerance is a number (absolute) or {abs = ..., rel = ...}
+    for fields in (conf.get('fields', dict()), table.get('fields', dict())):
+        for name, tolerance in fields.items():
+            if isinstance(tolerance, dict):
+                resolved['fields'][name] = {
+                    'abs': tolerance.get('abs', 0),
+                    'rel': tolerance.get('rel', 0)
+                }
+            else:
+                resolved['fields'][name] = {'abs': tolerance, 'rel': 0}
+    return resolved
+
+
+def preload(db, conf):
+    """
+    Preload deadband conf of all tables into redis for enque_script_v2.lua,
+    the hash is named by the checksum of the conf and never changes once
+    written
+    :param db: RedisWrapper
+    :param conf: dict, [deadband] section of conf.toml
+    :return: str, name of the hash, KEYS[3] of the enque script
+    """
+    tables = [(table_name, msgpack.packb(table_conf(conf, table_name)))
+              for table_name in ['*'] + sorted(conf.get('tables', dict()))]
+    checksum = zlib.crc32(msgpack.packb(tables)) & 0xffffffff
+    key = '{}:{:08x}'.format(CONF_KEY, checksum)
+    for table_name, packed in tables:
+        db.hset(key, table_name, packed)
+    return key
+
+
+class Deadband(object):
+    """
+    Sender 进程内的去重过滤, 规则与 enque_script_v2.lua 一致, 在发往 redis 之前
+    丢掉没有变化的数据:
+    1. fields 和上一次发送的 fields 不同 (数值字段的变化超过阈值才算不同,
+       阈值为 max(abs, rel * |上一次的值|))
+    2. 与上一次发送的时间戳相差 time_range 秒以上
+    满足其一才发送. 以 (eqpt_no, table_name) 区分不同的数据序列.
+    只要 time_range 不大于 lua 脚本中的值, lua 的心跳(mark_range)不受影响.
+
+    用法:
+    deadband = Deadband(conf['deadband'])
+    if deadband.check(data):
+        sender.pack(data)
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        # table_name -> resolved conf
+        self.tables = dict()
+        # (eqpt_no, table_name) -> (fields, timestamp) last sent
+        self.last = dict()
+        self.suppressed = 0
+
+    def check(self, data):
+        """
+        Check data and remember it if it should be sent
+        :param data: dict, table_name, fields and timestamp
+        :return: bool, True means send it
+        """
+        table_name = data['table_name']
+        fields = data['fields']
+        timestamp = data['timestamp']
+        tags = fields.get('tags') or dict()
+        key = (tags.get('eqpt_no'), table_name)
+
+        conf = self.tables.get(table_name)
+        if conf is None:
+            conf = self.tables[table_name] = table_conf(self.conf, table_name)
+
+        time_range = conf['time_range']
+        # timestamp is microsecond when unit is 'u', same as lua
+        if fields.get('unit') == 'u':
+            time_range = time_range * 1000000
+
+        last = self.last.get(key)
+        if last is None or self.changed(conf, last[0], fields) or \
+                timestamp - last[1] >= time_range:
+            self.last[key] = (dict(fields), timestamp)
+            return True
+
+        self.suppressed += 1
+        return False
+
+    @staticmethod
+    def changed(conf, old, new):
+        """
+        Compare fields, numeric fields are changed only when the difference
+        is bigger than the tolerance
+        :param conf: dict, resolved conf of the table
+        :param old: dict, fields last sent
+        :param new: dict, fields
+        :return: bool
+        """
+        if old.keys() != new.keys():
+            return True
+        for name, value in new.items():
+            old_value = old[name]
+            if _is_number(value) and _is_number(old_value):
+                tolerance = conf['fields'].get(name, conf)
+                limit = max(tolerance['abs'],
+                            tolerance['rel'] * abs(old_value))
+                if abs(value - old_value) > limit:
+                    return True
+            elif value != old_value:
+                return True
+        return False
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
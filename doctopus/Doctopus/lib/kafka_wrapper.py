@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import threading
+from collections import OrderedDict
 
 from kafka import KafkaProducer
 
@@ -20,19 +22,35 @@ class KafkaWrapper:
     """
     Producer is thread safe,
     it will start a back thread automatically to send messages.
+
+    With ``async = true`` messages are sent by sendMessageAsync without
+    waiting for the broker, at most ``max_in_flight`` messages are
+    unacknowledged at the same time.
     """
     def __init__(self, conf):
         self.conf = conf
         self.topic = conf.get("topic", "default")
         self.bootstrap_servers = conf.get(
             "bootstrap_servers", "localhost:9092")
+        self.async_send = conf.get("async", False)
+        self.max_in_flight = conf.get("max_in_flight", 1000)
         try:
             self.producer = KafkaProducer(
                 bootstrap_servers=self.bootstrap_servers,
-                value_serializer=lambda v: json.dumps(v).encode('utf-8'))
+                value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+                acks=conf.get("acks", 1),
+                linger_ms=conf.get("linger_ms", 0),
+                batch_size=conf.get("batch_size", 16384),
+                compression_type=conf.get("compression_type") or None)
         except Exception as e:
             raise e
 
+        # stream id -> None (in flight), True (delivered), False (failed)
+        # kept in stream order so ids are acked in the order they were read
+        self.in_flight = OrderedDict()
+        self.in_flight_lock = threading.Lock()
+        self.window = threading.BoundedSemaphore(self.max_in_flight)
+
     def sendMessage(self, msg):
         """
         send msg to kafka brokers
@@ -47,6 +65,57 @@ class KafkaWrapper:
         except Exception as e:
             raise e
 
+    def sendMessageAsync(self, msg, id, ack):
+        """
+        send msg to kafka brokers without waiting for the broker response,
+        block when max_in_flight messages are not acknowledged yet
+        Args:
+            msg: kafka msg
+            id: redis stream id of the msg
+            ack: callable, called with the delivered stream ids in stream
+                 order from the producer delivery callbacks
+        """
+        self.window.acquire()
+        with self.in_flight_lock:
+            self.in_flight[id] = None
+        try:
+            future = self.producer.send(self.topic, msg)
+        except Exception as e:
+            self.__done(id, False, ack)
+            raise e
+        future.add_callback(self.__delivered, id, ack)
+        future.add_errback(self.__failed, id, ack)
+
+    def __delivered(self, id, ack, metadata):
+        self.__done(id, True, ack)
+
+    def __failed(self, id, ack, err):
+        log.error("Failed to send data {} to kafka: {}".format(id, err))
+        self.__done(id, False, ack)
+
+    def __done(self, id, delivered, ack):
+        """
+        Mark the msg as finished, then ack the delivered ids at the head of
+        in flight window. Failed ids are left unacked for the pending thread.
+        """
+        ids = []
+        with self.in_flight_lock:
+            self.in_flight[id] = delivered
+            while self.in_flight:
+                head, state = next(iter(self.in_flight.items()))
+                if state is None:
+                    break
+                self.in_flight.popitem(last=False)
+                self.window.release()
+                if state:
+                    ids.append(head)
+        if ids:
+            try:
+                ack(*ids)
+                log.debug("Ack {} data delivered to kafka.".format(len(ids)))
+            except Exception as e:
+                log.exception(e)
+
     def pack(self, data):
         """
         Pack redis data to kafka msg
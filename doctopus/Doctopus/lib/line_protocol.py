@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+InfluxDB line protocol 编码
+
+与 influxdb.line_protocol.make_lines 的输出一致(布尔值写为 true/false),
+但缓存每个 series 的 measurement 和 tag 转义结果: 同一 eqpt_no 的 tags
+几乎不变, 每个点只需要编码 fields 和时间戳.
+
+    encoder = LineEncoder()
+    body = encoder.encode(points)   # bytes, 可直接 POST 到 /write
+    body = gzip_body(body)          # Content-Encoding: gzip 时的请求体
+"""
+import sys
+import zlib
+
+from influxdb.line_protocol import make_line
+
+if sys.version_info[0] >= 3:
+    text_type = str
+    integer_types = (int, )
+else:
+    text_type = unicode  # noqa: F821
+    integer_types = (int, long)  # noqa: F821
+
+
+def escape_key(key):
+    """
+    Escape measurement, tag key, tag value and field key
+    :param key: str
+    :return: str, '' for None, so None tags are left out like make_lines
+    """
+    if key is None:
+        return ''
+    if isinstance(key, bytes):
+        key = key.decode('utf-8')
+    elif not isinstance(key, text_type):
+        key = text_type(key)
+    return key.replace('\\', '\\\\').replace(' ', '\\ ').replace(
+        ',', '\\,').replace('=', '\\=').replace('\n', '\\n')
+
+
+def escape_value(value):
+    """
+    Format a field value, typed the same as the influxdb client: int is
+    written as integer, str as string, bool as boolean, others as float
+    :param value: field value
+    :return: str, '' for None
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if isinstance(value, text_type):
+        return '"{}"'.format(
+            value.replace('\\', '\\\\').replace('"', '\\"').replace(
+                '\n', '\\n'))
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, integer_types):
+        return '{}i'.format(value)
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return text_type(value)
+
+
+class LineEncoder(object):
+    """
+    Encode influxdb json points to line protocol, the escaped
+    measurement,tags prefix of every series is cached
+    """
+
+    def __init__(self, max_series=100000):
+        """
+        :param max_series: int, the caches are cleared when they grow
+                           bigger, i.e. tags contain a changing value
+        """
+        self.max_series = max_series
+        self.prefixes = dict()
+        self.layouts = dict()
+
+    def prefix(self, measurement, tags):
+        """
+        Escaped 'measurement,tag=value...' of a series
+        :return: str
+        """
+        try:
+            series = (measurement, tuple(tags.items()))
+            prefix = self.prefixes.get(series)
+        except TypeError:
+            # unhashable tag value, do not cache
+            series, prefix = None, None
+        if prefix is not None:
+            return prefix
+
+        prefix = escape_key(measurement)
+        # tags are sorted client-side to take load off server
+        for key in sorted(tags):
+            k, v = escape_key(key), escape_key(tags[key])
+            if k and v:
+                prefix += ',{}={}'.format(k, v)
+
+        if series is not None:
+            if len(self.prefixes) >= self.max_series:
+                self.prefixes.clear()
+            self.prefixes[series] = prefix
+        return prefix
+
+    def layout(self, fields):
+        """
+        Sorted field names and escaped keys of a field set
+        :return: list, [(name, escaped key)]
+        """
+        names = tuple(fields)
+        layout = self.layouts.get(names)
+        if layout is None:
+            if len(self.layouts) >= self.max_series:
+                self.layouts.clear()
+            layout = self.layouts[names] = [
+                (name, escape_key(name)) for name in sorted(fields)
+            ]
+        return layout
+
+    def line(self, point, precision=None):
+        """
+        Encode one point
+        :param point: dict, {'measurement', 'tags', 'fields', 'time'}
+        :param precision: str, time precision, only used to convert the time
+                          which is not an int
+        :return: str
+        """
+        timestamp = point.get('time')
+        if timestamp is not None and (
+                isinstance(timestamp, bool)
+                or not isinstance(timestamp, integer_types)):
+            # datetime or time string, let the influxdb client convert it
+            return make_line(point.get('measurement'), point.get('tags'),
+                             point.get('fields'), timestamp, precision)
+
+        fields = point.get('fields') or {}
+        field_list = []
+        for name, key in self.layout(fields):
+            value = fields[name]
+            # fast path of the common types
+            if type(value) is float:
+                value = repr(value)
+            elif type(value) is int:
+                value = '{}i'.format(value)
+            else:
+                value = escape_value(value)
+            if key and value:
+                field_list.append(key + '=' + value)
+
+        line = self.prefix(point.get('measurement'), point.get('tags') or {})
+        if field_list:
+            line += ' ' + ','.join(field_list)
+        if timestamp is not None:
+            line += ' {}'.format(timestamp)
+        return line
+
+    def encode(self, points, precision=None):
+        """
+        Encode points to the body of a /write request
+        :param points: list, influxdb json points
+        :param precision: str, time precision
+        :return: bytes
+        """
+        return ('\n'.join([self.line(point, precision)
+                           for point in points]) + '\n').encode('utf-8')
+
+
+def gzip_body(body, level=6):
+    """
+    Gzip a request body, zlib is used since python 2 has no gzip.compress
+    :param body: bytes
+    :param level: int, 1-9
+    :return: bytes
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
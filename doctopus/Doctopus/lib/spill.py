@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+chitu 的溢出文件: group 积压过多时把最旧的数据存到本地磁盘
+
+group 的 lag (XINFO GROUPS, redis 7 以前按 last-delivered-id 之后的条数
+计算) 超过 spill_threshold 时, Transport 把 last-delivered-id 之后最旧的
+spill_batch 条数据追加到溢出文件, 再用 XGROUP SETID 让 group 跳过它们,
+这些数据之后即使被 MAXLEN 裁剪也不会丢失. lag 降到 spill_resume 以下后,
+溢出的数据按原来的顺序重新 XADD 到 stream, 带上字段 g = group, 其他
+group 读到后直接 ack, 不会重复发送.
+
+溢出文件是 <spill_path>/<redis db>_<stream>_<group>/ 下的分段文件:
+    00000000000000000001.seg, 00000000000000000002.seg ...
+每条记录为 4 字节大端长度 + msgpack [id, [field, value, ...]], 只追加;
+cursor 文件记录已重新注入的位置 (段号, 偏移), 读完的分段会被删除.
+"""
+import logging
+import os
+import struct
+
+import msgpack
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+SUFFIX = '.seg'
+
+
+class SpillFull(Exception):
+    """
+    Raised when the spill files reach max_bytes
+    """
+
+
+class SpillFile(object):
+    """
+    Append-only segment files of spilled stream entries, read back in order
+
+    用法:
+    spill = SpillFile(path)
+    spill.append([(b'1600000000000-0', {b'data': b'...'})])
+    entries, position = spill.read(100)
+    ... XADD entries ...
+    spill.commit(position)
+    """
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024,
+                 max_bytes=1024 * 1024 * 1024):
+        """
+        :param path: str, directory of the segment files
+        :param segment_size: int, bytes, a new segment is started when the
+                             current one is bigger
+        :param max_bytes: int, max bytes of all segments
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.cursor_file = os.path.join(path, 'cursor')
+        self.cursor = self.load_cursor()
+        # drop the segments left by a commit interrupted before deleting them
+        for seq in self.segments():
+            if seq < self.cursor[0]:
+                os.remove(self.segment_file(seq))
+
+    def segment_file(self, seq):
+        return os.path.join(self.path, '{:020d}{}'.format(seq, SUFFIX))
+
+    def segments(self):
+        """
+        Sequence numbers of the segment files
+        :return: list, sorted
+        """
+        return sorted(
+            int(name[:-len(SUFFIX)]) for name in os.listdir(self.path)
+            if name.endswith(SUFFIX))
+
+    def load_cursor(self):
+        """
+        :return: list, [segment, offset] of the next entry to read
+        """
+        try:
+            with open(self.cursor_file, 'r') as fn:
+                seq, offset = fn.read().split()
+                return [int(seq), int(offset)]
+        except (IOError, OSError, ValueError):
+            segments = self.segments()
+            return [segments[0] if segments else 1, 0]
+
+    def size(self):
+        """
+        Bytes of the segment files, including the read part of the first one
+        :return: int
+        """
+        return sum(
+            os.path.getsize(self.segment_file(seq))
+            for seq in self.segments())
+
+    def empty(self):
+        """
+        Whether all spilled entries were read and committed
+        :return: bool
+        """
+        for seq in self.segments():
+            if seq > self.cursor[0] or os.path.getsize(
+                    self.segment_file(seq)) > self.cursor[1]:
+                return False
+        return True
+
+    def append(self, entries):
+        """
+        Append entries to the last segment and fsync it
+        :param entries: list, [(id, {field: value})] of XRANGE
+        :return: int, bytes written
+        """
+        records = []
+        for id, fields in entries:
+            flat = []
+            for k, v in fields.items():
+                flat.extend((k, v))
+            record = msgpack.packb([id, flat], use_bin_type=False)
+            records.append(HEADER.pack(len(record)) + record)
+        body = b''.join(records)
+        if self.size() + len(body) > self.max_bytes:
+            raise SpillFull('Spill files of {} reach {} bytes.'.format(
+                self.path, self.max_bytes))
+
+        segments = self.segments()
+        seq = segments[-1] if segments else self.cursor[0]
+        if segments and os.path.getsize(
+                self.segment_file(seq)) >= self.segment_size:
+            seq += 1
+        with open(self.segment_file(seq), 'ab') as fn:
+            fn.write(body)
+            fn.flush()
+            os.fsync(fn.fileno())
+        return len(body)
+
+    def read(self, count):
+        """
+        Read at most count entries from the cursor, without moving it
+        :param count: int
+        :return: (list, list), [(id, {field: value})] and the position
+                 after them for commit
+        """
+        entries = []
+        seq, offset = self.cursor
+        for segment in self.segments():
+            if segment < seq:
+                continue
+            if segment > seq:
+                seq, offset = segment, 0
+            with open(self.segment_file(seq), 'rb') as fn:
+                fn.seek(offset)
+                while len(entries) < count:
+                    header = fn.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        # end of segment, or a record being appended
+                        break
+                    length, = HEADER.unpack(header)
+                    record = fn.read(length)
+                    if len(record) < length:
+                        break
+                    id, flat = msgpack.unpackb(record, raw=True)
+                    entries.append(
+                        (id, dict(zip(flat[0::2], flat[1::2]))))
+                    offset += HEADER.size + length
+            if len(entries) >= count:
+                break
+        return entries, [seq, offset]
+
+    def commit(self, position):
+        """
+        Move the cursor after the entries re-injected, delete the segments
+        read through
+        :param position: list, position returned by read
+        :return: None
+        """
+        seq, offset = position
+        segments = self.segments()
+        if segments and seq == segments[-1] and \
+                offset >= os.path.getsize(self.segment_file(seq)):
+            # all re-injected, drop the last segment too
+            position = [seq + 1, 0]
+        tmp = self.cursor_file + '.tmp'
+        with open(tmp, 'w') as fn:
+            fn.write('{} {}'.format(*position))
+            fn.flush()
+            os.fsync(fn.fileno())
+        # rename is atomic, the cursor is never half written
+        getattr(os, 'replace', os.rename)(tmp, self.cursor_file)
+        self.cursor = list(position)
+        for seq in self.segments():
+            if seq < self.cursor[0]:
+                os.remove(self.segment_file(seq))
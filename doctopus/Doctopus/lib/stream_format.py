@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+data_stream 中数据的编码格式
+
+v1: 字段 data 为 msgpack map, 其中 table_name, time, fields 的值又分别是
+    msgpack 编码的 bytes, 需要解码两次
+    {b'data': packb({'table_name': packb(str), 'time': packb(int),
+                     'fields': packb(dict)})}
+v2: 字段 v 为 2, 字段 data 为一次 msgpack 编码的 map
+    {b'v': b'2', b'data': packb({'table_name': str, 'time': int,
+                                 'fields': dict})}
+
+两种格式解码后都是 {'table_name': str, 'time': int, 'fields': dict}
+"""
+import logging
+
+import msgpack
+
+log = logging.getLogger(__name__)
+
+FORMAT_V1 = 1
+FORMAT_V2 = 2
+
+
+def version(raw):
+    """
+    Get format version of a stream entry
+    :param raw: dict, fields of the stream entry, {b'v': b'2', b'data': ...}
+    :return: int
+    """
+    v = raw.get(b'v')
+    return int(v) if v else FORMAT_V1
+
+
+def encode(table_name, fields, timestamp, fmt=FORMAT_V2):
+    """
+    Encode data to stream entry fields, the same as enque_script_v2.lua
+    :return: dict, fields of the stream entry
+    """
+    if fmt == FORMAT_V2:
+        data = msgpack.packb({
+            'table_name': table_name,
+            'time': timestamp,
+            'fields': fields
+        })
+        return {'v': FORMAT_V2, 'data': data}
+
+    data = msgpack.packb({
+        'table_name': msgpack.packb(table_name),
+        'time': msgpack.packb(timestamp),
+        'fields': msgpack.packb(fields)
+    })
+    return {'data': data}
+
+
+def decode(payload, fmt=FORMAT_V1):
+    """
+    Decode data of one stream entry
+    :param payload: bytes, value of field data
+    :param fmt: int, format version
+    :return: dict
+    """
+    if fmt == FORMAT_V2:
+        return msgpack.unpackb(payload, raw=False)
+
+    # values are msgpack blobs, they are not utf-8 strings
+    raw_data = msgpack.unpackb(payload, raw=True)
+    return {
+        k.decode('utf-8'): msgpack.unpackb(v, raw=False)
+        for k, v in raw_data.items()
+    }
+
+
+def decode_batch(entries):
+    """
+    Decode a batch of stream entries, v2 entries are decoded in one pass
+    :param entries: list, [(fmt, payload)]
+    :return: list, decoded data, None for the entry can not be decoded
+    """
+    result = [None] * len(entries)
+    v2 = [i for i, (fmt, _) in enumerate(entries) if fmt == FORMAT_V2]
+
+    if v2:
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(b''.join(entries[i][1] for i in v2))
+        try:
+            decoded = list(unpacker)
+        except Exception as err:
+            log.error('Failed to decode batch: {}'.format(err))
+            decoded = []
+        # a broken entry shifts the others, decode them one by one instead
+        if len(decoded) == len(v2):
+            for i, data in zip(v2, decoded):
+                result[i] = data
+            v2 = []
+
+    for i, (fmt, payload) in enumerate(entries):
+        if result[i] is not None:
+            continue
+        try:
+            result[i] = decode(payload, fmt)
+        except Exception as err:
+            log.error('Failed to decode data: {}'.format(err))
+    return result
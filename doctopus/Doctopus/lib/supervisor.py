@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+启动 chitu 的 transport
+
+默认所有 transport 都是当前进程内的线程(或 asyncio 引擎的一个线程).
+[data_stream] process_mode 为 address 或 shard 时, 由 Supervisor 为每个
+redis 地址或每个分片启动一个 worker 进程, 避免多个 redis 实例的解码和
+打包争抢 GIL. worker 定期把 metrics, data 和 log 发回主进程, 汇总到主进程
+的 Communication 中上报; worker 进程退出后会被重新启动.
+"""
+import copy
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from threading import Thread
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+if sys.version_info[0] == 3 and sys.version_info[1] >= 5:
+    from Doctopus.lib.communication import Communication
+else:
+    from Doctopus.lib.communication_2 import Communication
+
+from Doctopus.lib.database_wrapper import RedisWrapper
+from Doctopus.lib.logging_init import setup_logging
+from Doctopus.lib.transport import (Transport, address_name, sinks,
+                                    stream_targets, transport_name)
+from Doctopus.lib.watchdog import WatchDog
+from Doctopus.utils.util import get_conf
+
+log = logging.getLogger(__name__)
+
+
+def start_transports(all_conf, thread_set, workers, targets=None):
+    """
+    Start threaded transports of chitu
+    :param all_conf: dict, conf.toml
+    :param thread_set: dict, threads watched by watchdog
+    :param workers: list, instances of the threads
+    :param targets: list, [(address, [shard...])], default all streams
+    :return: None
+    """
+    for redis_address, shards in targets or stream_targets(all_conf):
+        # transports of the same redis address share the redis client, the
+        # work and pending threads of every shard and sink hold a connection
+        # while they block
+        redis_client = RedisWrapper(redis_address,
+                                    2 * len(shards) * len(sinks(all_conf)))
+        # one work and one pending thread for every shard stream and sink,
+        # every sink has its own consumer group
+        for shard in shards:
+            for sink in sinks(all_conf):
+                name = transport_name(all_conf, redis_address, shard, sink)
+
+                work = Transport(all_conf, redis_address, shard, sink,
+                                 redis_client)
+                work.name = name
+                thread = Thread(target=work.work,
+                                args=(),
+                                name='%s' % work.name)
+                thread.setDaemon(True)
+                thread.start()
+                workers.append(work)
+                thread_set[work.name] = thread
+
+                # start pending data process, it shares the in-flight ids
+                # and the sink client with the work transport
+                pending = Transport(all_conf, redis_address, shard, sink,
+                                    redis_client, peer=work)
+                pending.name = name.replace('redis_', 'redis_pending_', 1)
+                thread = Thread(target=pending.pending,
+                                args=(),
+                                name='%s' % pending.name)
+                thread.start()
+                workers.append(pending)
+                thread_set[pending.name] = thread
+
+
+def start_async_engine(all_conf, thread_set, workers, targets=None):
+    """
+    Start the asyncio engine of chitu in one thread
+    :param all_conf: dict, conf.toml
+    :param thread_set: dict, threads watched by watchdog
+    :param workers: list, instances of the threads
+    :param targets: list, [(address, [shard...])], default all streams
+    :return: None
+    """
+    from Doctopus.lib.async_transport import AsyncEngine
+
+    engine = AsyncEngine(all_conf, targets)
+    thread = Thread(target=engine.work, args=(), name=engine.name)
+    thread.setDaemon(True)
+    thread.start()
+    workers.append(engine)
+    thread_set[engine.name] = thread
+
+
+def start_engine(all_conf, thread_set, workers, targets=None):
+    """
+    Start the transports with the engine selected in conf
+    :return: None
+    """
+    if all_conf['data_stream'].get('engine', 'thread') == 'asyncio':
+        start_async_engine(all_conf, thread_set, workers, targets)
+    else:
+        start_transports(all_conf, thread_set, workers, targets)
+
+
+def partition(conf):
+    """
+    Split the streams of chitu into worker processes
+    :param conf: dict, conf.toml
+    :return: list, [(worker name, [(address, [shard...])])]
+    """
+    mode = conf['data_stream'].get('process_mode', '')
+    result = list()
+    for redis_address, shards in stream_targets(conf):
+        name = 'worker_{}'.format(address_name(redis_address))
+        if mode == 'shard' and len(shards) > 1:
+            for shard in shards:
+                result.append(('{}_{}'.format(name, shard),
+                               [(redis_address, [shard])]))
+        else:
+            result.append((name, [(redis_address, shards)]))
+    return result
+
+
+def worker_main(conf, name, targets, queue, report_interval):
+    """
+    Entry of a worker process: start the transports of targets and report
+    their status to the supervisor every report_interval seconds
+    :param conf: dict, conf.toml
+    :param name: str, worker name
+    :param targets: list, [(address, [shard...])]
+    :param queue: multiprocessing.Queue, reports to the supervisor
+    :param report_interval: int, seconds
+    :return: None
+    """
+    # do not delete the status reported by the supervisor and other workers,
+    # set before the log handler of Communication is created
+    Communication.FLUSH = False
+    # every worker logs to its own file, rotating is not process safe
+    log_conf = copy.deepcopy(conf['log_configuration'])
+    root, ext = os.path.splitext(log_conf['log_file'])
+    log_conf['log_file'] = '{}_{}{}'.format(root, name, ext)
+    setup_logging(log_conf)
+
+    thread_set = dict()
+    workers = list()
+    start_engine(conf, thread_set, workers, targets)
+
+    communication = Communication(conf)
+    watchdog = WatchDog(conf)
+    watch = Thread(target=watchdog.work,
+                   name='watchdog',
+                   args=(thread_set, None, workers))
+    watch.setDaemon(True)
+    watch.start()
+
+    while True:
+        time.sleep(report_interval)
+        try:
+            queue.put((name, {
+                'pid': os.getpid(),
+                'metrics': communication.metrics,
+                'data': communication.data,
+                'log': communication.log,
+                'threads': sorted(watchdog.thread_real_time_names),
+                'transport_restart_time': watchdog.transport_restart_num
+            }))
+        except Exception as err:
+            log.exception(err)
+
+
+class Supervisor:
+    """
+    Run the transports of chitu in worker processes, restart the workers
+    which exit, and merge their reports into Communication.
+    work is the target of the chitu_supervisor thread
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.name = 'chitu_supervisor'
+        self.report_interval = conf['data_stream'].get('report_interval', 5)
+        self.restart_interval = conf['data_stream'].get('restart_interval', 5)
+        self.workers = partition(conf)
+        self.communication = Communication(conf)
+        # spawn, the supervisor runs in a process with other threads
+        if hasattr(multiprocessing, 'get_context'):
+            self.context = multiprocessing.get_context('spawn')
+        else:
+            self.context = multiprocessing
+        self.queue = None
+        self.processes = dict()
+        self.status = {
+            name: {
+                'pid': None,
+                'alive': False,
+                'restarts': -1,
+                'exitcode': None,
+                'last_report': 0
+            }
+            for name, _ in self.workers
+        }
+
+    def work(self, *args):
+        self.queue = self.context.Queue()
+        try:
+            while True:
+                self.check()
+                self.collect()
+        finally:
+            self.stop()
+
+    def start(self, name, targets):
+        """
+        Start or restart a worker process
+        :return: None
+        """
+        process = self.context.Process(target=worker_main,
+                                       args=(self.conf, name, targets,
+                                             self.queue,
+                                             self.report_interval),
+                                       name=name)
+        process.daemon = True
+        process.start()
+        self.processes[name] = process
+        status = self.status[name]
+        status['pid'] = process.pid
+        status['restarts'] += 1
+        status['started'] = time.time()
+        log.info('Start worker process {}, pid {}.'.format(name, process.pid))
+
+    def check(self):
+        """
+        Restart the worker processes which exit
+        :return: None
+        """
+        for name, targets in self.workers:
+            process = self.processes.get(name)
+            status = self.status[name]
+            if process is None:
+                self.start(name, targets)
+            elif not process.is_alive():
+                status['alive'] = False
+                status['exitcode'] = process.exitcode
+                # do not restart a crashing worker in a tight loop
+                if time.time() - status['started'] >= self.restart_interval:
+                    log.error('Worker process {} exit with {}, '
+                              'restart it.'.format(name, process.exitcode))
+                    self.start(name, targets)
+        self.communication.metrics['processes'] = self.status
+
+    def collect(self):
+        """
+        Merge reports of the workers into Communication
+        :return: None
+        """
+        try:
+            name, report = self.queue.get(timeout=1)
+        except Empty:
+            return
+
+        status = self.status[name]
+        status['alive'] = True
+        status['pid'] = report['pid']
+        status['last_report'] = time.time()
+        status['threads'] = report['threads']
+        status['transport_restart_time'] = report['transport_restart_time']
+        self.communication.metrics.update(report['metrics'])
+        self.communication.data.update(report['data'])
+        for msg in report['log']:
+            if msg not in self.communication.log:
+                self.communication.enqueue_log(msg)
+
+    def stop(self):
+        """
+        Terminate the worker processes
+        :return: None
+        """
+        for name, process in self.processes.items():
+            if process.is_alive():
+                log.info('Stop worker process {}.'.format(name))
+                process.terminate()
+                process.join(5)
+        self.processes = dict()
+
+    def re_load(self):
+        return Supervisor(get_conf())
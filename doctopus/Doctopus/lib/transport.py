@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
+import re
+import socket
 import sys
 import time
 import traceback
 from datetime import datetime
 from queue import Queue
 from influxdb.exceptions import InfluxDBClientError
-import msgpack
 from redis import exceptions
 
 if sys.version_info[0] == 3 and sys.version_info[1] >= 5:
@@ -15,30 +17,208 @@ if sys.version_info[0] == 3 and sys.version_info[1] >= 5:
 else:
     from Doctopus.lib.communication_2 import Communication
 
-from Doctopus.lib.database_wrapper import InfluxdbWrapper, RedisWrapper
+from Doctopus.lib.adaptive_batch import AdaptiveBatcher
+from Doctopus.lib.database_wrapper import (InfluxdbWrapper, RedisWrapper,
+                                           next_id, stream_name)
+from Doctopus.lib.dead_letter import DeadLetter
+from Doctopus.lib import dead_letter
 from Doctopus.lib.kafka_wrapper import KafkaWrapper
 from Doctopus.lib.mqtt_wrapper import MqttWrapper
+from Doctopus.lib.spill import SpillFile, SpillFull
+from Doctopus.lib import stream_format
 from Doctopus.utils.util import get_conf
 
 log = logging.getLogger(__name__)
 
 
+def consumer_name(stream_conf):
+    """
+    Consumer name of this process, a unique name (consumer-hostname-pid)
+    lets several chitu processes consume the same group
+    :param stream_conf: dict, [data_stream] of conf
+    :return: str
+    """
+    consumer = stream_conf['consumer']
+    if stream_conf.get('unique_consumer', False):
+        consumer = '{}-{}-{}'.format(consumer, socket.gethostname(),
+                                     os.getpid())
+    return consumer
+
+
+def sinks(conf):
+    """
+    Sinks chitu sends data to, send_to_where is a sink or a list of sinks
+    :param conf: dict, conf.toml
+    :return: list
+    """
+    to_where = conf['send_to_where']
+    return list(to_where) if isinstance(to_where, (list, tuple)) \
+        else [to_where]
+
+
+def sink_conf(conf, sink):
+    """
+    [data_stream] conf of a sink, [data_stream.<sink>] overrides
+    [data_stream]. Every sink reads with its own consumer group: the first
+    sink keeps <group>, so its unread and pending data are not lost when
+    send_to_where becomes a list, the others use <group>_<sink> by default
+    :param conf: dict, conf.toml
+    :param sink: str, influxdb, kafka or mqtt
+    :return: dict
+    """
+    stream_conf = {
+        k: v
+        for k, v in conf['data_stream'].items() if not isinstance(v, dict)
+    }
+    if sinks(conf).index(sink) > 0:
+        stream_conf['group'] = '{}_{}'.format(stream_conf['group'], sink)
+    stream_conf.update(conf['data_stream'].get(sink, dict()))
+    return stream_conf
+
+
+def stream_targets(conf):
+    """
+    Redis addresses and the shards consumed from each of them
+    :param conf: dict, conf.toml
+    :return: list, [(address, [shard...])]
+    """
+    shards = list(range(conf['data_stream'].get('shards', 1)))
+    return [(address, shards)
+            for address in conf['redis_instance']['address']]
+
+
+def address_name(redis_address):
+    """
+    Name of a redis address usable in file names,
+    i.e. 127.0.0.1_6379_1 or var_run_redis.sock_1
+    :param redis_address: dict, item of [redis_instance.address]
+    :return: str
+    """
+    location = redis_address.get('unix_socket_path') or '{}_{}'.format(
+        redis_address.get('host', 'localhost'),
+        redis_address.get('port', 6379))
+    name = '{}_{}'.format(location, redis_address.get('db', 0))
+    return re.sub(r'[^\w.-]+', '_', name).strip('_')
+
+
+def transport_name(conf, redis_address, shard, sink):
+    """
+    Name of the transport of a redis address, shard and sink,
+    i.e. redis_1, redis_1_0, redis_1_0_kafka
+    :return: str
+    """
+    suffix = str(redis_address['db'])
+    if conf['data_stream'].get('shards', 1) > 1:
+        suffix += '_' + str(shard)
+    if len(sinks(conf)) > 1:
+        suffix += '_' + sink
+    return 'redis_' + suffix
+
+
 class Transport:
-    def __init__(self, conf, redis_address=None):
-        self.to_where = conf['send_to_where']
+    def __init__(self, conf, redis_address=None, shard=0, sink=None,
+                 redis_client=None, peer=None):
+        """
+        :param conf: dict, conf.toml
+        :param redis_address: dict, item of [redis_instance.address]
+        :param shard: int, shard stream consumed by this transport
+        :param sink: str, sink of this transport, default the first one
+        :param redis_client: RedisWrapper, shared by the transports of the
+                             same redis address
+        :param peer: Transport, the work transport of the same stream and
+                     sink, the pending transport shares its in-flight ids
+                     and sink client
+        """
+        self.peer = peer
+        self.to_where = sink or sinks(conf)[0]
+        stream_conf = sink_conf(conf, self.to_where)
 
         self.data_original = None
         self.name = None
         self.communication = Communication(conf)
 
         # Redis conf
-        self.redis = RedisWrapper(redis_address)
-        self.group = conf['data_stream']['group']
-        self.consumer = conf['data_stream']['consumer']
+        self.redis = redis_client or RedisWrapper(redis_address)
+        self.group = stream_conf['group']
+        self.consumer = consumer_name(stream_conf)
+        # claim messages idle for claim_idle ms from dead consumers
+        self.claim_idle = stream_conf.get('claim_idle', 0)
+        self.claim_interval = stream_conf.get('claim_interval', 30)
+        self.consumer_expire = stream_conf.get('consumer_expire',
+                                               24 * 60 * 60)
+        self.claim_start = '0-0'
+        self.claim_time = 0
+        # pending data is retried with backoff based on its delivery count
+        self.pending_count = stream_conf.get('pending_count', 100)
+        self.retry_backoff = stream_conf.get('retry_backoff', 1)
+        self.retry_backoff_max = stream_conf.get('retry_backoff_max', 60)
+        # ids of new data read by the work thread and not finished yet, the
+        # pending thread leaves them alone however long they are idle
+        self.in_flight = peer.in_flight if peer is not None else set()
+        # data delivered max_retries times is moved to the dead letter
+        # stream, 0 means retry forever
+        self.max_retries = stream_conf.get('max_retries', 10)
+        self.use_dead_letter = stream_conf.get('dead_letter', True)
+        self.dead_letter_maxlen = stream_conf.get('dead_letter_maxlen',
+                                                  dead_letter.MAXLEN)
+        # shard stream consumed by this transport
+        self.stream = stream_name(shard)
+        # batch mode: read batch_size entries per XREADGROUP, wait at most
+        # linger milliseconds to fill a batch
+        self.batch_size = stream_conf.get('batch_size', 1)
+        self.linger = stream_conf.get('linger', 0)
+        # adaptive batch: batch_size and linger follow the write latency and
+        # error rate of the sink
+        self.batcher = AdaptiveBatcher(stream_conf) if stream_conf.get(
+            'adaptive_batch', False) else None
+        # latency mode: rely on the blocking read only, no extra sleeps
+        self.latency_mode = stream_conf.get('latency_mode', False)
+        self.block = stream_conf.get('block', 1000)
+        self.latency_target = stream_conf.get('latency_target', 0)
+        self.retry_interval = stream_conf.get('retry_interval', 3)
+        self.latency = {'last': 0, 'avg': 0, 'max': 0, 'over_target': 0}
+        # data trimmed from the stream before this group acked them:
+        # pending data found trimmed when claimed, and data trimmed before
+        # the group read them (checked every trim_check_interval seconds,
+        # needs redis 7+)
+        self.trim_check_interval = stream_conf.get('trim_check_interval', 60)
+        self.trim_check_time = 0
+        self.trimmed = {'pending': 0, 'unread': None}
+        self.trimmed_base = 0
+        # spill the oldest backlog to local files when the lag of the group
+        # is over spill_threshold, re-inject it when the lag is below
+        # spill_resume, see Doctopus/lib/spill.py
+        self.spill_conf = stream_conf if stream_conf.get('spill',
+                                                         False) else None
+        self.spill_threshold = stream_conf.get('spill_threshold', 50000)
+        self.spill_resume = stream_conf.get('spill_resume', 10000)
+        self.spill_batch = stream_conf.get('spill_batch', 10000)
+        self.spill_check_interval = stream_conf.get('spill_check_interval', 10)
+        self.spill_check_time = 0
+        self.spill_path = os.path.join(
+            stream_conf.get('spill_path', 'spill'), '{}_{}_{}'.format(
+                address_name(redis_address or dict()), self.stream,
+                self.group))
+        self.spill = None
+        self.spilled = {'spilled': 0, 'reinjected': 0, 'lag': 0, 'bytes': 0,
+                        'full': False}
         # create group for data_stream
-        self.redis.addGroup(self.group)
+        self.redis.addGroup(self.group, self.stream)
 
-        if self.to_where == 'influxdb':
+        self.init_sink(conf)
+
+    def init_sink(self, conf):
+        """
+        Create the client of the sink
+        :param conf: dict, conf.toml
+        :return: None
+        """
+        if self.peer is not None:
+            # the pending transport sends with the client of its peer
+            for attr in ('db', 'mqtt_conf', 'mqtt_put_queue', 'mqtt'):
+                if hasattr(self.peer, attr):
+                    setattr(self, attr, getattr(self.peer, attr))
+        elif self.to_where == 'influxdb':
             self.db = InfluxdbWrapper(conf['influxdb'])
         elif self.to_where == 'kafka':
             self.db = self.initKafka(conf['kafka'])
@@ -46,6 +226,7 @@ class Transport:
             self.mqtt_conf = conf.get('mqtt', dict())
             self.mqtt_put_queue = Queue()
             self.mqtt = MqttWrapper(self.mqtt_conf)
+        self.async_kafka = self.to_where == 'kafka' and self.db.async_send
 
     def initKafka(self, conf):
         while True:
@@ -59,7 +240,11 @@ class Transport:
                 time.sleep(1)
 
     def work(self, *args):
+        if self.batch_size > 1 or self.batcher:
+            return self.work_batch()
+
         while True:
+            self.check_spill()
             # get and decompress data
             try:
                 bin_data = self.getData()
@@ -70,7 +255,7 @@ class Transport:
                 if "NOGROUP" in str(e):
                     log.error('{}, recreate group: {}'.format(
                         str(e), self.group))
-                    self.redis.addGroup(self.group)
+                    self.redis.addGroup(self.group, self.stream)
                 raw_data = None
             except Exception as err:
                 log.exception(err)
@@ -78,52 +263,319 @@ class Transport:
 
             # compress and send data
             if raw_data:
-                data = self.pack(raw_data["data"])
                 try:
-                    # send data and ack data id
-                    log.debug("Send data to {}.".format(self.to_where))
-                    self.send(data)
-                    log.debug("Redis ack data.")
-                    self.redis.ack(self.group, raw_data["id"])
-                except Exception as err:
-                    log.exception(err)
-                    time.sleep(3)
+                    self.send_one(raw_data)
+                finally:
+                    self.in_flight.discard(raw_data["id"])
+
+    def send_one(self, raw_data):
+        """
+        Send a new data and ack it, failed data stays pending
+        :param raw_data: dict, {"id":string, "data":dict, "raw":bytes, "v":int}
+        :return: None
+        """
+        try:
+            data = self.pack(raw_data["data"])
+        except Exception as err:
+            log.exception(err)
+            data = None
+        if not data:
+            self.move_to_dead_letter([raw_data],
+                                     'Can not unpack or pack data.')
+            return
+        try:
+            # send data and ack data id
+            log.debug("Send data to {}.".format(self.to_where))
+            if self.async_kafka:
+                # acked from kafka delivery callbacks
+                self.db.sendMessageAsync(data, raw_data["id"], self.ack)
+                return
+            self.send(data)
+            log.debug("Redis ack data.")
+            self.ack(raw_data["id"])
+        except DeadLetter as err:
+            self.move_to_dead_letter([raw_data], err)
+        except Exception as err:
+            log.exception(err)
+            time.sleep(self.retry_interval)
+
+    def work_batch(self):
+        """
+        Batched version of work: read a batch of entries, send them with one
+        request to the database and ack them with one XACK
+        :return: None
+        """
+        while True:
+            self.check_spill()
+            if self.batcher:
+                self.batch_size = self.batcher.batch_size
+                self.linger = self.batcher.linger
+            try:
+                entries = self.getBatchData()
+            except exceptions.ResponseError as e:
+                # NOGROUP for data_stream, recreate it.
+                if "NOGROUP" in str(e):
+                    log.error('{}, recreate group: {}'.format(
+                        str(e), self.group))
+                    self.redis.addGroup(self.group, self.stream)
+                entries = []
+            except Exception as err:
+                log.exception(err)
+                entries = []
+
+            if not entries:
+                log.debug('Redis have no new data.')
+                continue
+
+            try:
+                self.send_new(entries)
+            finally:
+                self.in_flight.difference_update(
+                    raw_data["id"] for raw_data in entries)
+
+    def send_new(self, entries):
+        """
+        Send a batch of new data and ack them, failed data stays pending
+        :param entries: list, [{"id":string, "data":bytes, "v":int}]
+        :return: None
+        """
+        entries, datas = self.pack_batch(entries)
+        ids = [raw_data["id"] for raw_data in entries]
+
+        if datas:
+            start, sent = time.time(), False
+            try:
+                log.debug("Send {} data to {}.".format(
+                    len(datas), self.to_where))
+                if self.async_kafka:
+                    # acked from kafka delivery callbacks
+                    for id, data in zip(ids, datas):
+                        self.db.sendMessageAsync(data, id, self.ack)
+                    return
+                self.send_batch(datas)
+                sent = True
+                self.record_batch(start)
+                log.debug("Redis ack {} data.".format(len(ids)))
+                self.ack(*ids)
+            except DeadLetter as err:
+                # find out the data the sink refused
+                log.warning(err)
+                self.send_each(entries, datas)
+            except Exception as err:
+                log.exception(err)
+                if not sent:
+                    self.record_batch(start, False)
+                time.sleep(self.retry_interval)
+
+    def record_batch(self, start, ok=True):
+        """
+        Feed a batch write to the adaptive batcher and export its setpoint
+        :param start: float, time the write started
+        :param ok: bool, whether the write succeeded
+        :return: None
+        """
+        if not self.batcher:
+            return
+        self.batcher.record(time.time() - start, ok)
+        metrics = self.communication.metrics.setdefault(self.name, dict())
+        metrics['batch'] = self.batcher.setpoint()
 
     def pending(self, *args):
+        # scan the pending list from cursor instead of rereading from id 0
+        cursor = '0-0'
         while True:
+            if self.claim_idle and \
+                    time.time() - self.claim_time >= self.claim_interval:
+                self.claim_time = time.time()
+                try:
+                    self.reclaim()
+                except Exception as err:
+                    log.exception(err)
+
+            if self.trim_check_interval and time.time() - \
+                    self.trim_check_time >= self.trim_check_interval:
+                self.trim_check_time = time.time()
+                try:
+                    self.check_trimmed()
+                except Exception as err:
+                    log.exception(err)
+
             try:
-                pending_data = self.getPendingData()
+                pending_data, cursor = self.getPendingData(cursor)
 
             except exceptions.ResponseError as err:
                 # NOGROUP for data_stream, recreate it.
                 if "NOGROUP" in str(err):
                     log.exception(err)
-                    self.redis.addGroup(self.group)
-                pending_data = []
+                    self.redis.addGroup(self.group, self.stream)
+                pending_data, cursor = [], '0-0'
             except Exception as err:
                 log.exception(err)
-                pending_data = []
+                pending_data, cursor = [], '0-0'
 
             if pending_data:
-                for d in pending_data:
-                    raw_data = self.unpack(d)
-                    if raw_data:
-                        data = self.pack(raw_data["data"])
-                        try:
-                            # send data and ack data id
-                            log.debug("Send pending data to {}".format(
-                                self.to_where))
-                            self.send(data)
-                            log.debug("Redis ack pending data.")
-                            self.redis.ack(self.group, raw_data["id"])
-                        except Exception as err:
-                            log.exception(err)
-                            log.debug(f'Err data is: {data}')
-                            time.sleep(3)
-            else:
-                time.sleep(5)
+                if not self.send_pending(pending_data):
+                    # the sink is down, scan again after retry_interval
+                    time.sleep(self.retry_interval)
+                    cursor = '0-0'
+            elif cursor == '0-0':
+                # whole pending list scanned
+                time.sleep(min(5, self.retry_backoff))
                 log.debug("No pending data.")
 
+    def send_pending(self, pending_data):
+        """
+        Send pending data as a batch, send them one by one when the batch
+        fails so one bad data does not block the others. The data stay
+        pending when the sink is down
+        :param pending_data: list, [{"id":string, "data":bytes, "v":int}]
+        :return: bool, False when the sink is down
+        """
+        entries, datas = self.pack_batch(pending_data)
+        if not datas:
+            return True
+
+        try:
+            log.debug("Send {} pending data to {}".format(
+                len(datas), self.to_where))
+            self.send_batch(datas)
+            log.debug("Redis ack pending data.")
+            self.ack(*[raw_data["id"] for raw_data in entries])
+            return True
+        except DeadLetter as err:
+            log.warning(err)
+        except Exception as err:
+            if not self.sink_available():
+                log.error('{} is unavailable, {} pending data are left '
+                          'pending: {}'.format(self.to_where, len(datas), err))
+                return False
+            log.exception(err)
+
+        self.send_each(entries, datas)
+        return True
+
+    def pack_batch(self, entries):
+        """
+        Unpack and pack a batch of data, the data can not be unpacked or
+        packed is moved to the dead letter stream
+        :param entries: list, [{"id":string, "data":bytes, "v":int}]
+        :return: (list, list), entries and packed data of them
+        """
+        packed, datas, bad = [], [], []
+        for raw_data in self.unpack_batch(entries):
+            try:
+                data = self.pack(raw_data["data"])
+            except Exception as err:
+                log.exception(err)
+                data = None
+            if not data:
+                bad.append(raw_data)
+                continue
+            packed.append(raw_data)
+            datas.append(data)
+        if bad:
+            self.move_to_dead_letter(bad, 'Can not unpack or pack data.')
+        return packed, datas
+
+    def send_each(self, entries, datas):
+        """
+        Send data one by one, data refused by the sink or out of retries is
+        moved to the dead letter stream, the others stay pending
+        :param entries: list, [{"id":string, "raw":bytes, "v":int}]
+        :param datas: list, packed data of entries
+        :return: None
+        """
+        for raw_data, data in zip(entries, datas):
+            try:
+                self.send_batch([data])
+                self.ack(raw_data["id"])
+            except DeadLetter as err:
+                self.move_to_dead_letter([raw_data], err)
+            except Exception as err:
+                log.exception(err)
+                log.debug('Err data is: {}'.format(data))
+                if self.out_of_retries(raw_data):
+                    self.move_to_dead_letter([raw_data], err)
+
+    def out_of_retries(self, raw_data):
+        """
+        Whether a failed data used up its retries
+        :param raw_data: dict, {"id":string, "delivered":int...}
+        :return: bool
+        """
+        # do not use up retries while the sink is down
+        return bool(self.max_retries) and self.sink_available() and \
+            raw_data.get('delivered', 1) >= self.max_retries
+
+    def sink_available(self):
+        """
+        Whether the sink is reachable, failures while it is down are not
+        counted as retries of the data
+        :return: bool
+        """
+        if self.to_where == 'influxdb':
+            return self.db.healthy
+        elif self.to_where == 'kafka':
+            return self.db.producer.bootstrap_connected()
+        return True
+
+    def move_to_dead_letter(self, entries, reason):
+        """
+        Move data to the dead letter stream and ack them
+        :param entries: list, [{"id":string, "raw":bytes, "v":int}]
+        :param reason: str or Exception, why the data can not be sent
+        :return: None
+        """
+        ids = [raw_data["id"] for raw_data in entries]
+        if not self.use_dead_letter:
+            log.warning('Drop {} data: {}, {}'.format(len(ids), ids, reason))
+            self.redis.ack(self.group, *ids, stream=self.stream)
+            return
+
+        log.warning('Move {} data to dead letter: {}, {}'.format(
+            len(ids), ids, reason))
+        moved = self.redis.deadLetter(self.group, [
+            dead_letter.entry(raw_data, reason, self.group, self.stream)
+            for raw_data in entries
+        ], dead_letter.dead_letter_name(self.stream), self.dead_letter_maxlen,
+                                      self.stream)
+        metrics = self.communication.metrics.setdefault(self.name, dict())
+        metrics['dead_letter'] = metrics.get('dead_letter', 0) + moved
+
+    def backoff(self, times_delivered):
+        """
+        Seconds to wait before delivering a pending data again
+        :param times_delivered: int, delivery count of the data
+        :return: float
+        """
+        return min(self.retry_backoff * 2 ** (times_delivered - 1),
+                   self.retry_backoff_max)
+
+    def reclaim(self):
+        """
+        Claim messages stuck with dead consumers into the pending list of
+        this consumer, then delete the dead consumers which have nothing
+        pending
+        :return: None
+        """
+        self.claim_start, claimed = self.redis.claim(self.group,
+                                                     self.consumer,
+                                                     self.claim_idle,
+                                                     self.claim_start,
+                                                     stream=self.stream)
+        if claimed:
+            log.info('Claimed {} pending data from other consumers.'.format(
+                len(claimed)))
+
+        for consumer in self.redis.consumers(self.group, self.stream):
+            name = consumer['name']
+            if isinstance(name, bytes):
+                name = name.decode()
+            if name != self.consumer and consumer['pending'] == 0 and \
+                    consumer['idle'] >= self.consumer_expire * 1000:
+                log.info('Delete idle consumer {}.'.format(name))
+                self.redis.delConsumer(self.group, name, self.stream)
+
     def unpack(self, data):
         """
         Get data from redis and unpack it
@@ -131,23 +583,34 @@ class Transport:
         """
         # data_len = self.redis.get_len("data_queue")
         if data:
+            data["raw"] = data["data"]
             try:
-                data["data"] = msgpack.unpackb(data["data"])
-                raw_data = data["data"]
-                for k in list(raw_data.keys()):
-                    v = raw_data[k]
-                    raw_data.pop(k)
-                    raw_data[k.decode('utf-8')] = msgpack.unpackb(
-                        v, encoding='utf-8')
-                data["data"] = raw_data
+                data["data"] = stream_format.decode(data["data"], data["v"])
             except Exception as err:
                 traceback.print_exc()
                 log.exception(err)
+                data["data"] = None
         else:
             log.info('Redis have no new data.')
-            time.sleep(5)
+            # XREADGROUP already blocked, do not delay the next read
+            if not self.latency_mode:
+                time.sleep(5)
         return data
 
+    def unpack_batch(self, entries):
+        """
+        Unpack a batch of data from redis in one pass
+        :param entries: list, [{"id":string, "data":bytes, "v":int}]
+        :return: list, the entries with data unpacked, data is None when it
+                 can not be unpacked
+        """
+        decoded = stream_format.decode_batch(
+            [(entry["v"], entry["data"]) for entry in entries])
+        for entry, data in zip(entries, decoded):
+            entry["raw"] = entry["data"]
+            entry["data"] = data
+        return entries
+
     def pack(self, data):
         """
         Converts the data to the format required for the corresponding database
@@ -216,36 +679,7 @@ class Transport:
         """
         if self.to_where == 'influxdb':
             time_precision = data[0].pop('unit')
-            try:
-                info = self.db.send(data, time_precision)
-            except InfluxDBClientError as e:
-                timestamp = data[0]['time'] / 1000000
-                t_string = datetime.utcfromtimestamp(
-                    timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                # 2021-07-19 zhy: 为防止超过保留策略的数据导致 chitu 传数据卡死.
-                if 'points beyond retention policy dropped' in str(e):
-                    log.warning('Data beyond influx retention policy, timestamp is: {}, means {}'.format(
-                        timestamp, t_string))
-                    log.warning('Data is: {}'.format(data))
-                    log.warning('Drop it.')
-                    info = 'Drop data because data beyond influx retention policy.'
-                # https://10.7.0.117:9091/mabo_group/base_application/doctopus/issues/3
-                # 2021-07-19 zhy: 为防止数据因未知原因导致parse错误, drop掉. 防止卡死.
-                elif 'invalid field format' in str(e):
-                    log.warning('Data parse error, influx can`t receive it, timestamp is: {}, means {}'.format(
-                        timestamp, t_string))
-                    log.warning('Data is: {}'.format(data))
-                    log.warning('Drop it.')
-                    info = 'Drop data because parse error, influx can`t receive it.'
-                else:
-                    raise e
-
-            self.communication.data[data[0]["measurement"]] = data
-            if info:
-                log.info('Send data to inflxudb.{}, {}'.format(
-                    data[0]['measurement'], info))
-            else:
-                raise Exception("\nCan't connect influxdb")
+            self.write_influxdb(data, time_precision)
 
         elif self.to_where == 'kafka':
             try:
@@ -264,37 +698,384 @@ class Transport:
             except Exception as err:
                 log.exception(err)
 
+    def send_batch(self, datas):
+        """
+        Send a batch of packed data, influxdb points are written with one
+        request per time precision
+        :param datas: list, items are what self.pack returns
+        :return: None
+        """
+        if self.to_where == 'influxdb':
+            points = dict()
+            for data in datas:
+                # keep unit in data, influxdb ignores it
+                time_precision = data[0]['unit']
+                points.setdefault(time_precision, []).extend(data)
+            for time_precision, json_body in points.items():
+                self.write_influxdb(json_body, time_precision)
+        else:
+            for data in datas:
+                self.send(data)
+
+    def write_influxdb(self, data, time_precision):
+        """
+        Write points to influxdb, drop the data influxdb will never accept
+        :param data: list, influxdb json points
+        :param time_precision: str, 's', 'ms' or 'u'
+        :return: None
+        """
+        try:
+            info = self.db.send(data, time_precision)
+        except InfluxDBClientError as e:
+            self.influxdb_refused(e, data)
+        self.influxdb_written(data, info)
+
+    def influxdb_refused(self, e, data):
+        """
+        Handle a client error of influxdb, raise DeadLetter for the data
+        influxdb will never accept
+        :param e: InfluxDBClientError
+        :param data: list, influxdb json points
+        :return: None
+        """
+        timestamp = data[0]['time'] / 1000000
+        t_string = datetime.utcfromtimestamp(
+            timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        # 2021-07-19 zhy: 为防止超过保留策略的数据导致 chitu 传数据卡死.
+        if 'points beyond retention policy dropped' in str(e):
+            log.warning('Data beyond influx retention policy, timestamp is: {}, means {}'.format(
+                timestamp, t_string))
+            raise DeadLetter('Data beyond influx retention policy: {}'.format(e))
+        # https://10.7.0.117:9091/mabo_group/base_application/doctopus/issues/3
+        # 2021-07-19 zhy: 为防止数据因未知原因导致parse错误, 移到死信. 防止卡死.
+        elif 'invalid field format' in str(e):
+            log.warning('Data parse error, influx can`t receive it, timestamp is: {}, means {}'.format(
+                timestamp, t_string))
+            raise DeadLetter('Influx can`t parse data: {}'.format(e))
+        # 其他4xx错误(如字段类型冲突)重试也不会成功
+        elif e.code == 400:
+            raise DeadLetter('Influx refused data: {}'.format(e))
+        else:
+            raise e
+
+    def influxdb_written(self, data, info):
+        """
+        Record points written to influxdb
+        :param data: list, influxdb json points
+        :param info: result of the write, falsy when influxdb is unavailable
+        :return: None
+        """
+        for point in data:
+            self.communication.data[point["measurement"]] = [point]
+        if info:
+            log.info('Send {} data to inflxudb.{}, {}'.format(
+                len(data), data[-1]['measurement'], info))
+            self.record_bytes()
+        else:
+            raise Exception("\nCan't connect influxdb")
+
+    def record_bytes(self):
+        """
+        Export bytes of the influxdb request bodies before and after
+        compression
+        :return: None
+        """
+        written = dict(self.db.bytes)
+        written['ratio'] = round(float(written['wire']) / written['raw'], 3) \
+            if written['raw'] else None
+        metrics = self.communication.metrics.setdefault(self.name, dict())
+        metrics['influxdb_bytes'] = written
+
+    def ack(self, *ids):
+        """
+        Ack data ids of data_stream
+        :param ids: data ids
+        :return: None
+        """
+        self.redis.ack(self.group, *ids, stream=self.stream)
+        self.record_latency(ids)
+
+    def record_latency(self, ids):
+        """
+        Measure end-to-end latency of acked data: ack time minus the
+        millisecond part of the stream id (time of XADD in redis, so the
+        clocks of chitu and redis should be synchronized)
+        :param ids: acked data ids
+        :return: None
+        """
+        now = time.time() * 1000
+        latency = now - min(int(id.split('-')[0]) for id in ids)
+        self.latency['last'] = latency
+        self.latency['avg'] = latency if not self.latency['avg'] else \
+            0.9 * self.latency['avg'] + 0.1 * latency
+        self.latency['max'] = max(self.latency['max'], latency)
+        if self.latency_target and latency > self.latency_target:
+            self.latency['over_target'] += 1
+            log.debug('End-to-end latency {:.0f}ms over target {}ms.'.format(
+                latency, self.latency_target))
+        metrics = self.communication.metrics.setdefault(self.name, dict())
+        metrics['latency'] = dict(self.latency)
+
     def getData(self):
         """Get data from data_stream
         return:
             data: dict; {id:string, data:bytes}
         """
-        data = self.redis.readGroup(self.group, self.consumer)
-        if not data:
-            return None
-        else:
+        while True:
+            data = self.redis.readGroup(self.group, self.consumer,
+                                        block=self.block, stream=self.stream)
+            if not data:
+                return None
             id, raw = data[0][1][0]
+            if self.foreign(raw):
+                # re-injected for another group
+                self.redis.ack(self.group, id, stream=self.stream)
+                continue
+            self.in_flight.add(id.decode())
             return {
                 "id": id.decode(),
                 "data": raw[b'data'],
+                "v": stream_format.version(raw),
             }
 
-    def getPendingData(self):
-        """Get pending data from data_stream
+    def getBatchData(self):
+        """Get at most batch_size data from data_stream, keep reading until
+        the batch is full or linger milliseconds passed
 
         return:
             data: [dict{"id":string, "data":bytes}]
-                  dict{id:string, data:bytes}
         """
-        data = self.redis.readPending(self.group, self.consumer, 0)
         res = []
-        if not data:
-            return res
-        else:
-            for v in data[0][1]:
-                id, raw = v
-                res.append({"id": id.decode(), "data": raw[b'data']})
-            return res
+        try:
+            self.read_batch(res)
+        except Exception:
+            self.in_flight.difference_update(
+                raw_data["id"] for raw_data in res)
+            raise
+        return res
+
+    def read_batch(self, res):
+        """
+        Read new data into res until the batch is full or linger
+        milliseconds passed
+        :param res: list, data read
+        :return: None
+        """
+        block = self.block
+        deadline = time.time() + self.linger / 1000.0
+        while len(res) < self.batch_size:
+            data = self.redis.readGroup(self.group, self.consumer,
+                                        count=self.batch_size - len(res),
+                                        block=block, stream=self.stream)
+            if data:
+                foreign = []
+                for id, raw in data[0][1]:
+                    if self.foreign(raw):
+                        foreign.append(id)
+                        continue
+                    self.in_flight.add(id.decode())
+                    res.append({
+                        "id": id.decode(),
+                        "data": raw[b'data'],
+                        "v": stream_format.version(raw)
+                    })
+                if foreign:
+                    # re-injected for another group
+                    self.redis.ack(self.group, *foreign, stream=self.stream)
+            # block=0 means block forever, so stop when linger ran out
+            block = int((deadline - time.time()) * 1000)
+            if not res or block <= 0:
+                break
+
+    def getPendingData(self, cursor='0-0'):
+        """Get pending data from data_stream, scan the pending list from
+        cursor and deliver the data whose backoff is over
+
+        args:
+            cursor: string ; scan the pending list from this id
+        return:
+            data: [dict{"id":string, "data":bytes, "v":int}]
+            cursor: string ; '0-0' when the whole pending list was scanned
+        """
+        pending = self.redis.pendingRange(self.group, self.consumer, cursor,
+                                          self.pending_count, self.stream)
+        if not pending:
+            return [], '0-0'
+
+        delivered, cursor = self.due(pending)
+        if not delivered:
+            return [], cursor
+
+        res, trimmed = self.claimed(
+            self.redis.claimData(self.group, self.consumer, list(delivered),
+                                 self.stream), delivered)
+        if trimmed:
+            self.redis.ack(self.group, *trimmed, stream=self.stream)
+        return res, cursor
+
+    def due(self, pending):
+        """
+        Pick the pending data whose backoff is over
+        :param pending: list, a page of XPENDING
+        :return: (dict, str), delivery count after this claim of the due
+                 data ids, and the cursor of the next page
+        """
+        cursor = next_id(pending[-1]['message_id'])
+
+        in_flight = self.in_flight_ids()
+        delivered = {
+            p['message_id']: p['times_delivered'] + 1
+            for p in pending
+            if p['time_since_delivered'] >= self.backoff(
+                p['times_delivered']) * 1000 and
+            p['message_id'].decode() not in in_flight
+        }
+        return delivered, cursor
+
+    def in_flight_ids(self):
+        """
+        Ids of the data being sent by the work thread, or waiting for the
+        delivery callbacks of async kafka
+        :return: set
+        """
+        ids = set(self.in_flight)
+        if self.async_kafka:
+            with self.db.in_flight_lock:
+                ids.update(self.db.in_flight)
+        return ids
+
+    def claimed(self, claimed, delivered):
+        """
+        Convert the result of XCLAIM to data
+        :param claimed: list, [(b'id', {b'data': b''})...]
+        :param delivered: dict, delivery count of the data ids
+        :return: (list, list), data and ids of the data trimmed from
+                 data_stream, which should be acked
+        """
+        res = []
+        for id, raw in claimed:
+            # redis 6 returns nil for trimmed data, redis 7 leaves them out
+            if not raw:
+                continue
+            res.append({
+                "id": id.decode(),
+                "data": raw[b'data'],
+                "v": stream_format.version(raw),
+                "delivered": delivered.get(id, 1)
+            })
+        found = set(raw_data["id"] for raw_data in res)
+        trimmed = [id for id in delivered if id.decode() not in found]
+        if trimmed:
+            # data was trimmed from data_stream, nothing to send
+            log.warning('{} pending data were trimmed before acked, '
+                        'ack them.'.format(len(trimmed)))
+            self.trimmed['pending'] += len(trimmed)
+            self.record_trimmed()
+        return res, trimmed
+
+    def check_spill(self):
+        """
+        Every spill_check_interval seconds, spill the oldest backlog when
+        the group lags behind, or re-inject the spilled data when the lag
+        recovered. Called by the thread reading new data, so moving
+        last-delivered-id of the group does not race with XREADGROUP
+        :return: None
+        """
+        if not self.spill_conf or \
+                time.time() - self.spill_check_time < self.spill_check_interval:
+            return
+        self.spill_check_time = time.time()
+        try:
+            if self.spill is None:
+                self.spill = SpillFile(
+                    self.spill_path,
+                    self.spill_conf.get('spill_segment_size', 64 * 1024 * 1024),
+                    self.spill_conf.get('spill_max_bytes', 1024 * 1024 * 1024))
+            lag = self.redis.groupLag(self.group, self.stream,
+                                      self.spill_threshold + 1)
+            if lag > self.spill_threshold:
+                lag = self.spill_backlog(lag)
+            elif lag <= self.spill_resume and not self.spill.empty():
+                entries, position = self.spill.read(self.spill_batch)
+                if entries:
+                    self.redis.reinject(entries, self.group, self.stream)
+                    self.spill.commit(position)
+                    self.spilled['reinjected'] += len(entries)
+                    log.info('Re-inject {} spilled data to {}.'.format(
+                        len(entries), self.stream))
+            self.spilled['lag'] = lag
+            self.spilled['bytes'] = self.spill.size()
+        except SpillFull as err:
+            log.error('{} Stop spilling.'.format(err))
+            self.spilled['full'] = True
+        except Exception as err:
+            log.exception(err)
+        metrics = self.communication.metrics.setdefault(self.name, dict())
+        metrics['spill'] = dict(self.spilled)
+
+    def spill_backlog(self, lag):
+        """
+        Append the oldest unread data of the group to the spill files until
+        the lag is not over spill_threshold, and let the group skip them
+        :param lag: int, current lag of the group
+        :return: int, lag after spilling
+        """
+        self.spilled['full'] = False
+        while lag > self.spill_threshold:
+            group = self.redis.groupInfo(self.group, self.stream)
+            entries = self.redis.xRange(
+                self.stream, next_id(group['last-delivered-id']),
+                count=self.spill_batch)
+            if not entries:
+                break
+            # data re-injected for other groups is skipped, not spilled
+            own = [(id, fields) for id, fields in entries
+                   if not self.foreign(fields)]
+            if own:
+                self.spill.append(own)
+            entries_read = group.get('entries-read')
+            self.redis.setGroupId(
+                self.group, entries[-1][0], self.stream,
+                None if entries_read is None else entries_read + len(entries))
+            self.spilled['spilled'] += len(own)
+            # lag of redis < 7 is only counted up to spill_threshold + 1
+            lag = self.redis.groupLag(self.group, self.stream,
+                                      self.spill_threshold + 1)
+            log.warning('Group {} lags behind, spill {} data of {} to '
+                        '{}.'.format(self.group, len(own), self.stream,
+                                     self.spill_path))
+        return lag
+
+    def foreign(self, raw):
+        """
+        Whether a data was re-injected from the spill files of another group
+        :param raw: dict, fields of the stream entry
+        :return: bool
+        """
+        group = raw.get(b'g')
+        return group is not None and group.decode() != self.group
+
+    def check_trimmed(self):
+        """
+        Count the data trimmed from the stream before this group read them.
+        The count of a gap grows until the group reads past it, then it is
+        added to the total
+        :return: None
+        """
+        unread = self.redis.trimmedUnread(self.group, self.stream)
+        if unread is None:
+            return
+        if unread:
+            log.warning('{} data of {} were trimmed before group {} read '
+                        'them.'.format(unread, self.stream, self.group))
+        elif self.trimmed['unread']:
+            self.trimmed_base = self.trimmed['unread']
+        self.trimmed['unread'] = self.trimmed_base + unread
+        self.record_trimmed()
+
+    def record_trimmed(self):
+        metrics = self.communication.metrics.setdefault(self.name, dict())
+        metrics['trimmed'] = dict(self.trimmed)
 
     def reque_data(self):
         """
@@ -305,16 +1086,19 @@ class Transport:
 
     def re_load(self):
         conf = get_conf()
-        self.to_where = conf['send_to_where']
+        stream_conf = sink_conf(conf, self.to_where)
+        self.batch_size = stream_conf.get('batch_size', 1)
+        self.linger = stream_conf.get('linger', 0)
+        # adaptive batch: batch_size and linger follow the write latency and
+        # error rate of the sink
+        self.batcher = AdaptiveBatcher(stream_conf) if stream_conf.get(
+            'adaptive_batch', False) else None
+        self.latency_mode = stream_conf.get('latency_mode', False)
+        self.block = stream_conf.get('block', 1000)
+        self.latency_target = stream_conf.get('latency_target', 0)
+        self.retry_interval = stream_conf.get('retry_interval', 3)
         self.data_original = None
         self.name = None
 
-        if self.to_where == 'influxdb':
-            self.db = InfluxdbWrapper(conf['influxdb'])
-        elif self.to_where == 'kafka':
-            self.db = KafkaWrapper(conf['kafka'])
-        elif self.to_where == 'mqtt':
-            self.mqtt_conf = conf.get('mqtt', dict())
-            self.mqtt = MqttWrapper(self.mqtt_conf)
-            self.mqtt_put_queue = Queue()
+        self.init_sink(conf)
         return self
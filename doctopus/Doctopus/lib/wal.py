@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Sender 的预写日志 (WAL): redis 不可用时数据先存到本地, 恢复后按顺序重放
+
+WAL 由 <wal_path> 下固定大小的分段文件组成:
+    00000000000000000001.wal, 00000000000000000002.wal ...
+分段文件创建时预分配为 segment_size 字节 (全 0), 通过 mmap 写入. 每条
+记录为 8 字节头 (大端的长度和 payload 的 CRC32) + payload, 长度为 0 表示
+分段结束; CRC 不一致的记录 (如写入时断电) 及其后的数据被跳过并计数.
+cursor 文件记录已经重放到的位置 (段号, 偏移), 重放完的分段会被删除.
+所有分段的总大小超过 max_bytes 时丢弃最旧的分段, 并计数丢弃的条数.
+
+    wal = WriteAheadLog('wal')
+    wal.append([payload, ...])          # bytes
+    records, position = wal.read(500)
+    ... 发送 records ...
+    wal.commit(position)
+"""
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>II')
+SUFFIX = '.wal'
+
+
+def crc32(payload):
+    # signed on python 2
+    return zlib.crc32(payload) & 0xffffffff
+
+
+class WriteAheadLog(object):
+    """
+    Fixed-size, mmap-backed and CRC-checked segment files of records,
+    appended and read back in order
+    """
+
+    def __init__(self, path, segment_size=4 * 1024 * 1024,
+                 max_bytes=256 * 1024 * 1024):
+        """
+        :param path: str, directory of the segment files
+        :param segment_size: int, bytes of every segment file
+        :param max_bytes: int, max bytes of all segment files
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.max_bytes = max(max_bytes, segment_size)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.cursor_file = os.path.join(path, 'cursor')
+        self.cursor = self.load_cursor()
+        # records dropped by the size cap, and skipped as corrupt
+        self.dropped = 0
+        self.corrupt = 0
+
+        segments = self.segments()
+        for seq in segments:
+            if seq < self.cursor[0]:
+                os.remove(self.segment_file(seq))
+        # the last segment is kept mapped for appending
+        self.seq = segments[-1] if segments and \
+            segments[-1] >= self.cursor[0] else self.cursor[0]
+        self.file = None
+        self.mm = None
+        self.offset = 0
+        self.open(self.seq)
+
+    def segment_file(self, seq):
+        return os.path.join(self.path, '{:020d}{}'.format(seq, SUFFIX))
+
+    def segments(self):
+        """
+        Sequence numbers of the segment files
+        :return: list, sorted
+        """
+        return sorted(
+            int(name[:-len(SUFFIX)]) for name in os.listdir(self.path)
+            if name.endswith(SUFFIX))
+
+    def load_cursor(self):
+        """
+        :return: list, [segment, offset] of the next record to read
+        """
+        try:
+            with open(self.cursor_file, 'r') as fn:
+                seq, offset = fn.read().split()
+                return [int(seq), int(offset)]
+        except (IOError, OSError, ValueError):
+            segments = self.segments()
+            return [segments[0] if segments else 1, 0]
+
+    def open(self, seq):
+        """
+        Map a segment for appending, create it when it does not exist, and
+        find the end of its valid records
+        :param seq: int
+        :return: None
+        """
+        name = self.segment_file(seq)
+        if not os.path.exists(name):
+            with open(name, 'wb') as fn:
+                fn.truncate(self.segment_size)
+        self.file = open(name, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), self.segment_size)
+        self.seq = seq
+        offset = 0
+        while True:
+            payload, end = self.record(self.mm, offset)
+            if payload is None:
+                break
+            offset = end
+        self.offset = offset
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+            self.file.close()
+            self.mm = None
+
+    def record(self, mm, offset):
+        """
+        Read the record at offset of a mapped segment
+        :return: (bytes, int), payload and the offset of the next record,
+                 payload is None at the end of the segment or a corrupt
+                 record
+        """
+        if offset + HEADER.size > len(mm):
+            return None, offset
+        length, crc = HEADER.unpack(mm[offset:offset + HEADER.size])
+        if length == 0:
+            return None, offset
+        end = offset + HEADER.size + length
+        payload = mm[offset + HEADER.size:end]
+        if end > len(mm) or crc32(payload) != crc:
+            return None, offset
+        return payload, end
+
+    def append(self, payloads):
+        """
+        Append records and flush them to disk
+        :param payloads: list, bytes
+        :return: None
+        """
+        for payload in payloads:
+            size = HEADER.size + len(payload)
+            if size > self.segment_size:
+                log.error('Record of {} bytes is bigger than a WAL segment, '
+                          'drop it.'.format(len(payload)))
+                self.dropped += 1
+                continue
+            if self.offset + size > self.segment_size:
+                self.rotate()
+            self.mm[self.offset:self.offset + size] = HEADER.pack(
+                len(payload), crc32(payload)) + payload
+            self.offset += size
+        self.mm.flush()
+
+    def rotate(self):
+        """
+        Start a new segment, drop the oldest ones over max_bytes
+        :return: None
+        """
+        self.close()
+        segments = self.segments()
+        while segments and \
+                (len(segments) + 1) * self.segment_size > self.max_bytes:
+            seq = segments.pop(0)
+            if seq >= self.cursor[0]:
+                dropped = self.count(seq, self.cursor[1]
+                                     if seq == self.cursor[0] else 0)
+                self.dropped += dropped
+                log.warning('WAL reaches {} bytes, drop {} oldest records.'.
+                            format(self.max_bytes, dropped))
+                self.save_cursor([seq + 1, 0])
+            os.remove(self.segment_file(seq))
+        self.open(self.seq + 1)
+
+    def count(self, seq, offset=0):
+        """
+        Number of records of a closed segment from offset
+        :return: int
+        """
+        n = 0
+        with open(self.segment_file(seq), 'rb') as fn:
+            mm = mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                while True:
+                    payload, offset = self.record(mm, offset)
+                    if payload is None:
+                        return n
+                    n += 1
+            finally:
+                mm.close()
+
+    def read(self, count):
+        """
+        Read at most count records from the cursor, without moving it
+        :param count: int
+        :return: (list, list), payloads and the position after them for
+                 commit
+        """
+        payloads = []
+        seq, offset = self.cursor
+        for segment in self.segments():
+            if segment < seq:
+                continue
+            if segment > seq:
+                seq, offset = segment, 0
+            if segment == self.seq:
+                mm, fn = self.mm, None
+            else:
+                fn = open(self.segment_file(segment), 'rb')
+                mm = mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                while len(payloads) < count:
+                    payload, end = self.record(mm, offset)
+                    if payload is None:
+                        break
+                    payloads.append(payload)
+                    offset = end
+                if segment != self.seq and len(payloads) < count and \
+                        offset + HEADER.size <= len(mm) and \
+                        mm[offset:offset + 4] != b'\x00' * 4:
+                    # the rest of a closed segment is corrupt, skip it
+                    log.error('Corrupt WAL record in {} at {}, skip the '
+                              'rest of the segment.'.format(
+                                  self.segment_file(segment), offset))
+                    self.corrupt += 1
+            finally:
+                if fn is not None:
+                    mm.close()
+                    fn.close()
+            if len(payloads) >= count:
+                break
+        return payloads, [seq, offset]
+
+    def commit(self, position):
+        """
+        Move the cursor after the records replayed, delete the segments
+        replayed through
+        :param position: list, position returned by read
+        :return: None
+        """
+        self.save_cursor(position)
+        for seq in self.segments():
+            if seq < self.cursor[0]:
+                os.remove(self.segment_file(seq))
+
+    def save_cursor(self, position):
+        tmp = self.cursor_file + '.tmp'
+        with open(tmp, 'w') as fn:
+            fn.write('{} {}'.format(*position))
+            fn.flush()
+            os.fsync(fn.fileno())
+        # rename is atomic, the cursor is never half written
+        getattr(os, 'replace', os.rename)(tmp, self.cursor_file)
+        self.cursor = list(position)
+
+    def empty(self):
+        """
+        Whether all records were replayed
+        :return: bool
+        """
+        return self.cursor[0] > self.seq or (
+            self.cursor[0] == self.seq and self.cursor[1] >= self.offset)
+
+    def size(self):
+        """
+        Bytes of the segment files on disk
+        :return: int
+        """
+        return len(self.segments()) * self.segment_size
@@ -62,6 +62,13 @@ class MyHandler(Handler):
         'table_name',[str]   optional
         'timestamp',int}      optional
 
+        batch（波形、振动等一次扫描得到成千上万个采样点时使用）:
+        {'data_value': 2-D numpy array or list,  每行一个采样点，列对应 field_name_list
+                       或 {'fieldname': array}，按列给出, required
+        'tags':[dict],        optional
+        'table_name',[str]   optional
+        'timestamp', 1-D numpy array or list}  每个采样点一个时间戳, optional
+
         :param raw_data:
         :return:
         """
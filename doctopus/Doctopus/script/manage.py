@@ -1,23 +1,22 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import json
 import sys
 
 import waitress
 from Doctopus.version import version_
 from Doctopus.web.app import get_app
 
-try:
-    from queue import Queue
-except Exception:
-    from Queue import Queue
-
 from logging import getLogger
 from threading import Thread
 
+from Doctopus.lib import dead_letter
+from Doctopus.lib.bounded_queue import BoundedQueue
+from Doctopus.lib.database_wrapper import RedisWrapper
 from Doctopus.lib.logging_init import setup_logging
 from Doctopus.lib.Sender import Sender
-from Doctopus.lib.transport import Transport
+from Doctopus.lib.supervisor import Supervisor, start_engine
 from Doctopus.lib.watchdog import WatchDog
 from Doctopus.utils.util import get_conf
 
@@ -32,12 +31,16 @@ log = getLogger("Doctopus.start")
 def start_ziyan():
     from plugins.your_plugin import MyCheck, MyHandler
 
-    # init queues
-    queue = {'data_queue': Queue(), 'sender': Queue()}
-
     # load all configs
     all_conf = get_conf('conf/conf.toml')
 
+    # init queues, maxsize = 0 means unbounded
+    queue_conf = all_conf.get('queue', dict())
+    queue = {
+        name: BoundedQueue(**queue_conf.get(name, dict()))
+        for name in ('data_queue', 'sender')
+    }
+
     # init log config
     setup_logging(all_conf['log_configuration'])
 
@@ -95,24 +98,19 @@ def start_chitu():
     queue = None
     workers = list()
 
-    for redis_address in all_conf['redis_instance']['address']:
-        work = Transport(all_conf, redis_address)
-        work.name = 'redis_' + str(redis_address['db'])
-        thread = Thread(target=work.work, args=(), name='%s' % work.name)
-        thread.setDaemon(True)
-        thread.start()
-        workers.append(work)
-        thread_set[work.name] = thread
-
-        # start pending data process
-        pending = Transport(all_conf, redis_address)
-        pending.name = 'redis_pending_' + str(redis_address['db'])
-        thread = Thread(target=pending.pending,
+    if all_conf['data_stream'].get('process_mode', ''):
+        # worker processes supervised by one thread
+        supervisor = Supervisor(all_conf)
+        thread = Thread(target=supervisor.work,
                         args=(),
-                        name='%s' % pending.name)
+                        name=supervisor.name)
+        thread.setDaemon(True)
         thread.start()
-        workers.append(pending)
-        thread_set[pending.name] = thread
+        workers.append(supervisor)
+        thread_set[supervisor.name] = thread
+    else:
+        # threaded transports or the asyncio engine
+        start_engine(all_conf, thread_set, workers)
 
     # start communication instance
     communication = Communication(all_conf)
@@ -131,17 +129,41 @@ def start_chitu():
     watch.start()
 
 
+def manage_dead_letter(action, ids=None, count=100):
+    """
+    Print or replay dead letters of chitu
+    :param action: 'dead_letter' to print, 'replay' to replay
+    :param ids: list, dead letter ids to replay, None for the oldest count
+    :param count: int
+    :return: None
+    """
+    all_conf = get_conf('conf/conf.toml')
+    for address, stream in dead_letter.streams(all_conf):
+        redis = RedisWrapper(address)
+        key = dead_letter.stream_key(address, stream)
+        if action == 'replay':
+            print('{}: replayed {} dead letters'.format(
+                key, dead_letter.replay(redis, stream, ids, count)))
+        else:
+            letters = dead_letter.inspect(redis, stream, count=count)
+            print('{}: {} dead letters'.format(key, len(letters)))
+            for letter in letters:
+                print(json.dumps(letter, default=str, ensure_ascii=False))
+
+
 if __name__ == '__main__':
     parse = argparse.ArgumentParser(
         prog='Doctopus',
         description='A distributed data collector.',
         usage=("\npython manage.py [-h] [-a ACTION] [-v] "
-               "[-t {ziyan,chitu}] [-i IP] [-p PORT]"))
+               "[-t {ziyan,chitu}] [-i IP] [-p PORT] [--id ID] [-n COUNT]"))
     parse.add_argument('-a',
                        '--action',
                        action='store',
                        default='run',
-                       help='Run/test the project, default run')
+                       help=('Run/test the project, default run; '
+                             'dead_letter/replay to print/replay dead '
+                             'letters of chitu'))
     parse.add_argument('-v',
                        '--version',
                        action='version',
@@ -162,6 +184,14 @@ if __name__ == '__main__':
                        '--port',
                        default='8000',
                        help="TCP port on which to listen, default is '8000'.")
+    parse.add_argument('--id',
+                       action='append',
+                       help='Dead letter id to replay, default the oldest')
+    parse.add_argument('-n',
+                       '--count',
+                       type=int,
+                       default=100,
+                       help='Max dead letters to print/replay, default 100')
 
     command = parse.parse_args().action
     target = parse.parse_args().target
@@ -184,5 +214,9 @@ if __name__ == '__main__':
         log.info("Serving on http://{}:{}".format(host, port))
         waitress.serve(get_app(), host=host, port=port, _quiet=True)
 
+    elif command in ('dead_letter', 'replay'):
+        args = parse.parse_args()
+        manage_dead_letter(command, args.id, args.count)
+
     elif command == 'test':
         pass
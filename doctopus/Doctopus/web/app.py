@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 import falcon
 from Doctopus.utils.util import get_conf
-from Doctopus.web.data import (NodeStatus, Reload, Restart, SeverStatus,
-                               Status, Upload)
+from Doctopus.web.data import (DeadLetter, NodeStatus, Reload, Restart,
+                               SeverStatus, Status, Upload)
 
 
 def create_client(conf):
@@ -11,6 +11,8 @@ def create_client(conf):
     api.add_route('/reload/', Reload(conf))
     api.add_route('/restart/', Restart(conf))
     api.add_route('/upload/', Upload(conf))
+    if conf.get('application') == 'chitu':
+        api.add_route('/dead_letter/', DeadLetter(conf))
     return api
 
 
@@ -4,6 +4,7 @@ import time
 
 import falcon
 import requests
+from Doctopus.lib import dead_letter
 from Doctopus.lib.database_wrapper import RedisWrapper
 
 
@@ -143,3 +144,45 @@ class Upload:
         resp.body = json.dumps("Upload configuration now, wait please")
         resp.content_type = "application/json"
         resp.status = falcon.HTTP_200
+
+
+class DeadLetter:
+    """
+    GET: list dead letters, POST: replay dead letters
+    params:
+        stream: data stream name, default all streams
+        start: min dead letter id of GET, default '-'
+        id: dead letter ids of POST, default the oldest count letters
+        count: max dead letters, default 100
+    """
+
+    def __init__(self, conf):
+        self.streams = list()
+        for address, stream in dead_letter.streams(conf):
+            key = dead_letter.stream_key(address, stream)
+            self.streams.append((key, RedisWrapper(address), stream))
+
+    def on_get(self, req, resp):
+        count = req.get_param_as_int('count') or 100
+        start = req.get_param('start') or '-'
+        data = dict()
+        for key, redis, stream in self.__select(req):
+            data[key] = dead_letter.inspect(redis, stream, start, count)
+        resp.body = json.dumps(data, default=str)
+        resp.content_type = "application/json"
+        resp.status = falcon.HTTP_200
+
+    def on_post(self, req, resp):
+        count = req.get_param_as_int('count') or 100
+        ids = req.get_param_as_list('id')
+        data = dict()
+        for key, redis, stream in self.__select(req):
+            data[key] = dead_letter.replay(redis, stream, ids, count)
+        resp.body = json.dumps({'replayed': data})
+        resp.content_type = "application/json"
+        resp.status = falcon.HTTP_200
+
+    def __select(self, req):
+        stream = req.get_param('stream')
+        return [(key, redis, name) for key, redis, name in self.streams
+                if not stream or stream == name]
@@ -26,6 +26,7 @@ if sys.version_info[0] == 3 and sys.version_info[1] >= 5:
               'pendulum', 'redis', 'influxdb', 'msgpack-python', 'toml',
               'falcon', 'waitress', 'kafka-python', 'paho-mqtt'
           ],
+          extras_require={'asyncio': ['redis>=4.2', 'aiohttp']},
           entry_points={'console_scripts': ['doctopus=Doctopus:main']})
 else:
     setup(name='Doctopus',
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark enque_script.lua against enque_script_v2.lua
+
+Both scripts are fed with the same records, records/s are measured inside
+redis from INFO commandstats (usec_per_call of EVALSHA), so network round
+trips are not counted. The data_stream entries written by both scripts are
+compared to make sure v2 keeps the same dedup and heartbeat behaviour.
+
+usage:
+    python test/bench_enque_script.py [-n 20000] [--db 4]
+"""
+import argparse
+import os
+import random
+import time
+
+import msgpack
+import redis
+
+CONF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'Doctopus', 'conf')
+
+
+def make_records(n, eqpts=50):
+    """
+    records of eqpts devices, value changes on about half of the records
+    """
+    records = []
+    for i in range(n):
+        eqpt_no = 'DEV0-{}'.format(i % eqpts)
+        fields = {
+            'status': random.randint(0, 1),
+            'temp': random.choice([21.5, 22.0]),
+            'msg': 'this is a msg',
+            'unit': 's',
+            'tags': {
+                'eqpt_no': eqpt_no
+            },
+        }
+        records.append((msgpack.packb('test_table'), msgpack.packb(fields),
+                        msgpack.packb(1600000000 + i // eqpts * 3)))
+    return records
+
+
+def run(client, script_file, records):
+    client.flushdb()
+    with open(script_file, 'r') as fn:
+        sha = client.script_load(fn.read())
+    client.config_resetstat()
+
+    start = time.time()
+    pipe = client.pipeline(transaction=False)
+    for i, (table_name, fields, timestamp) in enumerate(records):
+        pipe.evalsha(sha, 1, table_name, fields, timestamp)
+        if i % 1000 == 999:
+            pipe.execute()
+    pipe.execute()
+    wall = time.time() - start
+
+    usec_per_call = client.info('commandstats')['cmdstat_evalsha'][
+        'usec_per_call']
+    entries = [
+        msgpack.unpackb(v[b'data'], raw=True)
+        for _, v in client.xrange('data_stream')
+    ]
+    return usec_per_call, wall, entries
+
+
+def main():
+    parse = argparse.ArgumentParser(prog='bench_enque_script')
+    parse.add_argument('-n', type=int, default=20000, help='records')
+    parse.add_argument('--host', default='127.0.0.1')
+    parse.add_argument('--port', type=int, default=6379)
+    parse.add_argument('--db', type=int, default=4)
+    args = parse.parse_args()
+
+    client = redis.StrictRedis(host=args.host, port=args.port, db=args.db)
+    records = make_records(args.n)
+
+    results = dict()
+    for name in ['enque_script.lua', 'enque_script_v2.lua']:
+        results[name] = run(client, os.path.join(CONF_PATH, name), records)
+        usec_per_call, wall, entries = results[name]
+        print('{:<22} {:>8.2f} us/call  {:>10.0f} records/s in redis  '
+              '{:>8.0f} records/s wall  {} entries'.format(
+                  name, usec_per_call, 1000000 / usec_per_call,
+                  args.n / wall, len(entries)))
+
+    v1, v2 = results['enque_script.lua'][2], results['enque_script_v2.lua'][2]
+    print('same data_stream entries: {}'.format(
+        [msgpack.unpackb(e[b'fields'], raw=True) for e in v1] ==
+        [msgpack.unpackb(e[b'fields'], raw=True) for e in v2]))
+    client.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark LineEncoder against the json path of the influxdb client
+
+The same points are encoded by influxdb.line_protocol.make_lines (what
+InfluxDBClient.write_points does) and by LineEncoder, the bodies must be
+the same. Points of a few devices with the same tags are used, like the
+data from ziyan.
+
+usage:
+    python test/bench_line_protocol.py [-n 100000] [--eqpts 50] [--batch 500]
+"""
+import argparse
+import random
+import time
+
+from influxdb.line_protocol import make_lines
+
+from Doctopus.lib.line_protocol import LineEncoder
+
+
+def make_points(n, eqpts=50):
+    points = []
+    for i in range(n):
+        points.append({
+            'measurement': 'test_table',
+            'tags': {
+                'eqpt_no': 'DEV0-{}'.format(i % eqpts),
+                'line': 'line 1',
+                'workshop': 'ws,2'
+            },
+            'time': 1600000000 + i // eqpts,
+            'fields': {
+                'status': random.randint(0, 1),
+                'temp': random.choice([21.5, 22.0]),
+                'count': i,
+                'msg': 'this is a msg',
+            },
+            'unit': 's'
+        })
+    return points
+
+
+def run(encode, points, batch):
+    start = time.time()
+    bodies = [
+        encode(points[i:i + batch]) for i in range(0, len(points), batch)
+    ]
+    return time.time() - start, bodies
+
+
+def main():
+    parse = argparse.ArgumentParser(prog='bench_line_protocol')
+    parse.add_argument('-n', type=int, default=100000, help='points')
+    parse.add_argument('--eqpts', type=int, default=50, help='series')
+    parse.add_argument('--batch', type=int, default=500,
+                       help='points per request')
+    args = parse.parse_args()
+
+    points = make_points(args.n, args.eqpts)
+    encoder = LineEncoder()
+    results = {
+        'make_lines': run(
+            lambda batch: make_lines({'points': batch}, 's').encode('utf-8'),
+            points, args.batch),
+        'LineEncoder': run(lambda batch: encoder.encode(batch, 's'), points,
+                           args.batch),
+    }
+    for name, (seconds, bodies) in results.items():
+        print('{:<12} {:>10.0f} points/s  {:>8.3f}s  {} bytes'.format(
+            name, args.n / seconds, seconds, sum(len(b) for b in bodies)))
+    print('same bodies: {}'.format(
+        results['make_lines'][1] == results['LineEncoder'][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import unittest
+
+from Doctopus.lib.adaptive_batch import AdaptiveBatcher
+
+
+class TestAdaptiveBatch(unittest.TestCase):
+    def setUp(self):
+        self.batcher = AdaptiveBatcher({
+            'batch_size': 100,
+            'min_batch_size': 10,
+            'max_batch_size': 1000,
+            'max_linger': 500,
+            'write_latency_target': 200,
+            'batch_increase': 100,
+            'batch_decrease': 0.5
+        })
+
+    def testAdditiveIncrease(self):
+        self.assertEqual(self.batcher.linger, 50)
+        self.batcher.record(0.05)
+        self.assertEqual(self.batcher.batch_size, 200)
+        self.assertEqual(self.batcher.linger, 100)
+        for _ in range(20):
+            self.batcher.record(0.05)
+        self.assertEqual(self.batcher.batch_size, 1000)
+        self.assertEqual(self.batcher.linger, 500)
+
+    def testMultiplicativeDecrease(self):
+        self.batcher.batch_size = 800
+        # slow write
+        self.batcher.record(0.5)
+        self.assertEqual(self.batcher.batch_size, 400)
+        # failed write
+        self.batcher.record(0.01, False)
+        self.assertEqual(self.batcher.batch_size, 200)
+        for _ in range(10):
+            self.batcher.record(0.01, False)
+        self.assertEqual(self.batcher.batch_size, 10)
+        self.assertEqual(self.batcher.setpoint()['decreased'], 7)
+
+    def testErrorRate(self):
+        self.batcher.record(0.01, False)
+        # error rate still above threshold, hold the batch size
+        self.batcher.record(0.01)
+        self.assertEqual(self.batcher.batch_size, 50)
+        while self.batcher.error_rate >= 0.1:
+            self.batcher.record(0.01)
+        self.batcher.record(0.01)
+        self.assertGreater(self.batcher.batch_size, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from Doctopus.lib.bounded_queue import BoundedQueue
+
+
+class TestBoundedQueue(unittest.TestCase):
+    def testDropOldest(self):
+        queue = BoundedQueue(maxsize=2, policy='drop_oldest')
+        for i in range(3):
+            queue.put(i)
+        self.assertEqual([queue.get(), queue.get()], [1, 2])
+        self.assertEqual(queue.stats()['dropped'], 1)
+
+    def testDropNewest(self):
+        queue = BoundedQueue(maxsize=2, policy='drop_newest')
+        for i in range(3):
+            queue.put(i)
+        self.assertEqual([queue.get(), queue.get()], [0, 1])
+        self.assertEqual(queue.stats()['dropped'], 1)
+
+    def testCoalesce(self):
+        queue = BoundedQueue(maxsize=2, policy='coalesce')
+        queue.put({'table_name': 'a', 'v': 1})
+        queue.put({'table_name': 'b', 'v': 1})
+        queue.put({'table_name': 'a', 'v': 2})
+        self.assertEqual(queue.get(), {'table_name': 'a', 'v': 2})
+        self.assertEqual(queue.get(), {'table_name': 'b', 'v': 1})
+        # no data of the same table, drop the oldest one
+        queue.put({'table_name': 'a', 'v': 3})
+        queue.put({'table_name': 'b', 'v': 3})
+        queue.put({'table_name': 'c', 'v': 3})
+        self.assertEqual(queue.get()['table_name'], 'b')
+        self.assertEqual(queue.stats()['dropped'], 2)
+
+    def testBlock(self):
+        queue = BoundedQueue(maxsize=1)
+        queue.put(0)
+        self.assertRaises(Exception, queue.put, 1, timeout=0.01)
+
+    def testUnknownPolicy(self):
+        self.assertRaises(ValueError, BoundedQueue, 1, 'unknown')
+
+
+if __name__ == "__main__":
+    unittest.main()
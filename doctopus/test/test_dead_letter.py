@@ -0,0 +1,62 @@
+import unittest
+
+import redis
+
+from Doctopus.lib import dead_letter, stream_format
+from Doctopus.lib.database_wrapper import RedisWrapper
+
+
+class TestDeadLetter(unittest.TestCase):
+    def setUp(self):
+        conf: dict = {
+            "host": "127.0.0.1",
+            "port": 6379,
+            "db": 4,
+        }
+        self.client = RedisWrapper(conf)
+        self.db = redis.StrictRedis(**conf)
+        self.stream = "test_dead_letter_stream"
+        self.group = "test_group"
+        self.dead_stream = dead_letter.dead_letter_name(self.stream)
+        self.db.delete(self.stream, self.dead_stream)
+        self.client.addGroup(self.group, self.stream)
+
+    def tearDown(self):
+        self.db.delete(self.stream, self.dead_stream)
+
+    def testEntry(self):
+        raw_data = {"id": "1-0", "raw": b"data", "v": 2, "delivered": 3}
+        entry = dead_letter.entry(raw_data, ValueError("bad"), self.group,
+                                  self.stream)
+        self.assertEqual(entry['id'], "1-0")
+        self.assertEqual(entry['reason'], "bad")
+        self.assertEqual(entry['delivered'], 3)
+        self.assertEqual(entry['data'], b"data")
+
+    def testMoveAndReplay(self):
+        fields = stream_format.encode('test_table', {'temp': 21.5}, 1)
+        self.db.xadd(self.stream, fields)
+        id, raw = self.client.readGroup(self.group, "chitu",
+                                        stream=self.stream)[0][1][0]
+        raw_data = {"id": id.decode(), "raw": raw[b'data'], "v": 2}
+
+        self.client.deadLetter(self.group, [
+            dead_letter.entry(raw_data, "refused", self.group, self.stream)
+        ], self.dead_stream, stream=self.stream)
+        self.assertEqual(
+            self.db.xpending(self.stream, self.group)['pending'], 0)
+
+        letters = dead_letter.inspect(self.client, self.stream)
+        self.assertEqual(len(letters), 1)
+        self.assertEqual(letters[0]['id'], id.decode())
+        self.assertEqual(letters[0]['reason'], "refused")
+        self.assertEqual(letters[0]['data']['fields'], {'temp': 21.5})
+
+        self.assertEqual(dead_letter.replay(self.client, self.stream), 1)
+        self.assertEqual(self.db.xlen(self.dead_stream), 0)
+        _, replayed = self.db.xrange(self.stream)[-1]
+        self.assertEqual(replayed, raw)
+
+
+if __name__ == "__main__":
+    unittest.main()
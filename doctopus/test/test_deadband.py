@@ -0,0 +1,101 @@
+import os
+import unittest
+
+import msgpack
+import redis
+
+from Doctopus.lib.database_wrapper import RedisWrapper
+from Doctopus.lib.deadband import Deadband, preload
+
+
+def make_data(temp, timestamp, status=1, eqpt_no='DEV0-1000'):
+    return {
+        'table_name': 'test_table',
+        'fields': {
+            'temp': temp,
+            'status': status,
+            'unit': 's',
+            'tags': {'eqpt_no': eqpt_no}
+        },
+        'timestamp': timestamp
+    }
+
+
+class TestDeadband(unittest.TestCase):
+    def setUp(self):
+        self.deadband = Deadband({
+            'time_range': 10,
+            'fields': {'temp': 0.5}
+        })
+
+    def testTolerance(self):
+        self.assertTrue(self.deadband.check(make_data(20.0, 0)))
+        self.assertFalse(self.deadband.check(make_data(20.3, 1)))
+        self.assertFalse(self.deadband.check(make_data(19.6, 2)))
+        self.assertTrue(self.deadband.check(make_data(20.6, 3)))
+        # no tolerance for status
+        self.assertTrue(self.deadband.check(make_data(20.6, 4, status=0)))
+        self.assertEqual(self.deadband.suppressed, 2)
+
+    def testTimeRange(self):
+        self.assertTrue(self.deadband.check(make_data(20.0, 0)))
+        self.assertFalse(self.deadband.check(make_data(20.0, 9)))
+        self.assertTrue(self.deadband.check(make_data(20.0, 10)))
+
+    def testTableConf(self):
+        deadband = Deadband({
+            'time_range': 10,
+            'tables': {
+                'test_table': {
+                    'time_range': 5,
+                    'fields': {'temp': {'rel': 0.1}}
+                }
+            }
+        })
+        self.assertTrue(deadband.check(make_data(20.0, 0)))
+        self.assertFalse(deadband.check(make_data(21.9, 1)))
+        self.assertTrue(deadband.check(make_data(22.1, 2)))
+        self.assertTrue(deadband.check(make_data(22.1, 7)))
+
+    def testSeries(self):
+        self.assertTrue(self.deadband.check(make_data(20.0, 0)))
+        self.assertTrue(self.deadband.check(make_data(20.0, 0, eqpt_no='x')))
+
+
+class TestPreload(unittest.TestCase):
+    def setUp(self):
+        conf = {"host": "127.0.0.1", "port": 6379, "db": 4}
+        self.client = RedisWrapper(conf)
+        self.db = redis.StrictRedis(**conf)
+        self.stream = "test_deadband_stream"
+        self.db.delete(self.stream, "threshold_DEV0-1000_test_table")
+        self.client.script_load(os.path.join(
+            os.path.dirname(__file__), '..', 'Doctopus', 'conf',
+            'enque_script_v2.lua'))
+
+    def tearDown(self):
+        self.db.delete(self.stream, "threshold_DEV0-1000_test_table")
+
+    def enqueue(self, key, data):
+        return self.client.enqueue(
+            table_name=msgpack.packb(data['table_name']),
+            fields=msgpack.packb(data['fields']),
+            timestamp=msgpack.packb(data['timestamp']),
+            stream_format=2, stream=self.stream, deadband=key)
+
+    def testInstances(self):
+        # two ziyan instances sharing one redis db
+        loose = preload(self.client, {'fields': {'temp': 5}})
+        strict = preload(self.client, {'fields': {'temp': 0.1}})
+        self.assertNotEqual(loose, strict)
+        self.assertEqual(preload(self.client, {'fields': {'temp': 5}}), loose)
+
+        self.enqueue(loose, make_data(20.0, 0))
+        self.enqueue(loose, make_data(21.0, 1))
+        self.assertEqual(self.db.xlen(self.stream), 1)
+        self.enqueue(strict, make_data(22.0, 2))
+        self.assertEqual(self.db.xlen(self.stream), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
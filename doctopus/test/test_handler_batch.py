@@ -0,0 +1,84 @@
+import unittest
+
+from Doctopus.Doctopus_main import Handler
+from Doctopus.lib.Sender import Sender
+
+
+class MyHandler(Handler):
+    def user_handle(self, raw_data):
+        yield raw_data
+
+
+class TestHandlerBatch(unittest.TestCase):
+    def setUp(self):
+        conf = {
+            'user_conf': {
+                'handler': {
+                    'table_name': 'wave',
+                    'field_name_list': ['x', 'y'],
+                    'unit': 's',
+                    'tags': {'eqpt_no': 'DEV0-1000'}
+                }
+            }
+        }
+        self.handler = MyHandler(conf)
+
+    def testRows(self):
+        batch = self.handler.process({
+            'data_value': [[1, 2], [3, 4]],
+            'timestamp': [100, 101]
+        })
+        datas = Sender.expand_batch(batch)
+        self.assertEqual(len(datas), 2)
+        self.assertEqual(datas[1]['fields']['x'], 3)
+        self.assertEqual(datas[1]['fields']['unit'], 's')
+        self.assertEqual(datas[1]['fields']['tags']['eqpt_no'], 'DEV0-1000')
+        self.assertEqual(datas[1]['timestamp'], 101)
+
+    def testColumns(self):
+        batch = self.handler.process({
+            'data_value': {'a': [1, 2, 3], 'b': [4, 5, 6]},
+            'timestamp': [1, 2, 3]
+        })
+        datas = Sender.expand_batch(batch)
+        self.assertEqual([d['fields']['b'] for d in datas], [4, 5, 6])
+
+    def testRowsWithoutTimestamp(self):
+        batch = {'data_value': [[1, 2], [3, 4]], 'batch': True}
+        self.assertIsNone(self.handler.process(batch))
+
+        self.handler.sample_interval = 2
+        datas = Sender.expand_batch(self.handler.process(batch))
+        self.assertEqual([d['fields']['y'] for d in datas], [2, 4])
+        self.assertEqual(datas[1]['timestamp'] - datas[0]['timestamp'], 2)
+
+    def testColumnsWithoutTimestamp(self):
+        self.handler.sample_interval = 5
+        batch = self.handler.process({
+            'data_value': {'a': [1, 2], 'b': [3, 4]},
+            'timestamp': 100,
+            'batch': True
+        })
+        datas = Sender.expand_batch(batch)
+        self.assertEqual([(d['fields']['a'], d['fields']['b']) for d in datas],
+                         [(1, 3), (2, 4)])
+        self.assertEqual([d['timestamp'] for d in datas], [100, 105])
+
+    def testNoAutoDetect(self):
+        # a dict of columns is a single point unless batch is set
+        data = self.handler.process({'data_value': {'a': [1, 2]},
+                                     'timestamp': 100})
+        self.assertEqual(data['fields']['a'], [1, 2])
+
+    def testSinglePointDict(self):
+        data = self.handler.process({'data_value': {'a': 1, 'b': 2.5}})
+        self.assertEqual(data['fields']['b'], 2.5)
+
+    def testSinglePoint(self):
+        data = self.handler.process({'data_value': [1, 2], 'timestamp': 100})
+        self.assertEqual(data['fields']['y'], 2)
+        self.assertEqual(data['timestamp'], 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import gzip
+import io
+import unittest
+
+from influxdb.line_protocol import make_lines
+
+from Doctopus.lib.line_protocol import LineEncoder, gzip_body
+
+
+class TestLineProtocol(unittest.TestCase):
+    def setUp(self):
+        self.encoder = LineEncoder()
+        self.points = [{
+            'measurement': 'test table',
+            'tags': {
+                'eqpt_no': 'DEV0-1000',
+                'line': 'a,b=c',
+                'empty': ''
+            },
+            'fields': {
+                'temp': 21.5,
+                'status': 1,
+                'msg': 'this is a "msg"',
+                'none': None
+            },
+            'time': 1600000000
+        }, {
+            'measurement': 'test table',
+            'tags': {
+                'eqpt_no': 'DEV0-1000',
+                'line': 'a,b=c',
+                'empty': ''
+            },
+            'fields': {
+                'temp': 22.0,
+                'status': 0,
+                'msg': 'line\nbreak'
+            },
+            'time': 1600000003
+        }]
+
+    def testSameAsClient(self):
+        for _ in range(2):
+            # second time from the caches
+            self.assertEqual(
+                self.encoder.encode(self.points, 's'),
+                make_lines({'points': self.points}, 's').encode('utf-8'))
+
+    def testNoneAndEmpty(self):
+        point = {
+            'measurement': 't',
+            'tags': {'eqpt_no': None, 'line': '', 'site': 'a'},
+            'fields': {'msg': '', 'none': None, 'temp': 1.5},
+            'time': 1
+        }
+        self.assertEqual(self.encoder.encode([point]),
+                         make_lines({'points': [point]}).encode('utf-8'))
+        self.assertNotIn(b'eqpt_no', self.encoder.encode([point]))
+
+    def testBool(self):
+        point = {'measurement': 't', 'fields': {'on': True, 'off': False},
+                 'time': 1}
+        self.assertEqual(self.encoder.encode([point]), b't off=false,on=true 1\n')
+
+    def testTimeString(self):
+        point = dict(self.points[0], time='2020-09-13T12:26:40Z')
+        self.assertEqual(
+            self.encoder.encode([point], 's'),
+            make_lines({'points': [point]}, 's').encode('utf-8'))
+
+    def testGzip(self):
+        body = self.encoder.encode(self.points * 100, 's')
+        compressed = gzip_body(body)
+        self.assertLess(len(compressed), len(body))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(compressed)).read(),
+                         body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
+import os
 import unittest
 
-from Doctopus.lib.database_wrapper import RedisWrapper
+import redis
+
+from Doctopus.lib.database_wrapper import (RedisWrapper, connection_pool,
+                                           id_tuple, next_id, trim_args)
 
 
 class TestRedis(unittest.TestCase):
@@ -24,6 +28,13 @@ class TestRedis(unittest.TestCase):
         print(result)
         print("===============================")
 
+    def testReadGroupBatch(self):
+        group_name = "test_group"
+        consumer = "chitu"
+        result = self.client.readGroup(group_name, consumer,
+                                       count=100, block=100)
+        print(result)
+
     def testPending(self):
         group_name = "test_group"
         result = self.client.xPending(group_name)
@@ -36,11 +47,86 @@ class TestRedis(unittest.TestCase):
         result = self.client.readPending(group_name, consumer, id)
         print(result)
 
+    def testPendingRange(self):
+        group_name = "test_group"
+        consumer = "chitu"
+        result = self.client.pendingRange(group_name, consumer, "0-0", 10)
+        print(result)
+        ids = [p['message_id'] for p in result]
+        if ids:
+            print(self.client.claimData(group_name, consumer, ids))
+
     def testACK(self):
         group_name = "test_group"
         id = "1571041740221-0"
         self.client.ack(group_name, id)
 
+    def testSharedPool(self):
+        conf = {"host": "127.0.0.1", "port": 6379, "db": 4}
+        self.assertIs(connection_pool(conf), connection_pool(dict(conf)))
+        self.assertIsNot(connection_pool(conf),
+                         connection_pool(dict(conf, db=5)))
+
+    def testPoolSize(self):
+        conf = {"host": "127.0.0.1", "port": 6379}
+        # sized for the blocking threads when no max_connections is set
+        self.assertEqual(
+            connection_pool(dict(conf, db=11), 80).max_connections, 90)
+        self.assertEqual(
+            connection_pool(dict(conf, db=12), 4).max_connections, 50)
+        self.assertEqual(
+            connection_pool(dict(conf, db=13, max_connections=8),
+                            80).max_connections, 8)
+
+    def testTrimArgs(self):
+        self.assertEqual(trim_args({}), (100000, '~', 0))
+        self.assertEqual(
+            trim_args({"maxlen": 0, "approximate_trim": False,
+                       "retention": 3600}), (0, '=', 3600))
+        self.assertLess(id_tuple(b"1571038514316-9"),
+                        id_tuple("1571038514316-10"))
+        self.assertEqual(next_id(b"1571038514316-9"), "1571038514316-10")
+        self.assertEqual(next_id("0-0"), "0-1")
+
+    def testGroupLag(self):
+        stream = "test_lag_stream"
+        db = redis.StrictRedis(host="127.0.0.1", port=6379, db=4)
+        db.delete(stream)
+        self.client.addGroup("test_group", stream)
+        pipe = db.pipeline(transaction=False)
+        for i in range(25000):
+            pipe.xadd(stream, {'data': i})
+        pipe.execute()
+        db.xreadgroup("test_group", "chitu", {stream: '>'}, count=3000)
+        self.assertEqual(self.client.groupLag("test_group", stream), 22000)
+        self.assertEqual(
+            self.client.groupLag("test_group", stream, limit=5001), 5001)
+        db.xtrim(stream, 1000, approximate=False)
+        self.assertEqual(self.client.groupLag("test_group", stream), 1000)
+        db.delete(stream)
+
+    def testEnqueueManyRejected(self):
+        import msgpack
+        stream = "test_enqueue_stream"
+        db = redis.StrictRedis(host="127.0.0.1", port=6379, db=4)
+        db.delete(stream, "threshold_D1_test_table")
+        self.client.script_load(os.path.join(
+            os.path.dirname(__file__), '..', 'Doctopus', 'conf',
+            'enque_script_v2.lua'))
+        records = [{
+            'table_name': msgpack.packb('test_table'),
+            'fields': msgpack.packb({'v': i, 'unit': 's',
+                                     'tags': {'eqpt_no': 'D1'}}),
+            'timestamp': msgpack.packb(1600000000 + i * 20),
+            'stream_format': 2,
+            'stream': stream
+        } for i in range(3)]
+        records.insert(1, dict(records[0], fields=b'\xc1'))
+        results = self.client.enqueue_many(records, raise_on_error=False)
+        self.assertIsInstance(results[1], redis.exceptions.ResponseError)
+        self.assertEqual(db.xlen(stream), 3)
+        db.delete(stream, "threshold_D1_test_table")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from Doctopus.lib.transport import sink_conf, sinks
+
+
+class TestSinkConf(unittest.TestCase):
+    def setUp(self):
+        self.conf = {
+            'send_to_where': 'influxdb',
+            'data_stream': {
+                'group': 'test_group',
+                'consumer': 'chitu',
+                'batch_size': 100,
+                'kafka': {
+                    'batch_size': 500
+                }
+            }
+        }
+
+    def testSingleSink(self):
+        self.assertEqual(sinks(self.conf), ['influxdb'])
+        stream_conf = sink_conf(self.conf, 'influxdb')
+        self.assertEqual(stream_conf['group'], 'test_group')
+        self.assertNotIn('kafka', stream_conf)
+
+    def testMultiSink(self):
+        self.conf['send_to_where'] = ['influxdb', 'kafka']
+        self.assertEqual(sinks(self.conf), ['influxdb', 'kafka'])
+
+        influxdb = sink_conf(self.conf, 'influxdb')
+        kafka = sink_conf(self.conf, 'kafka')
+        # the first sink keeps the group of a single sink
+        self.assertEqual(influxdb['group'], 'test_group')
+        self.assertEqual(influxdb['batch_size'], 100)
+        self.assertEqual(kafka['group'], 'test_group_kafka')
+        self.assertEqual(kafka['batch_size'], 500)
+
+    def testGroupOverride(self):
+        self.conf['send_to_where'] = ['influxdb', 'kafka']
+        self.conf['data_stream']['kafka']['group'] = 'kafka_group'
+        self.assertEqual(sink_conf(self.conf, 'kafka')['group'],
+                         'kafka_group')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import shutil
+import tempfile
+import unittest
+
+from Doctopus.lib.spill import SpillFile, SpillFull
+
+
+def make_entries(start, n):
+    return [('{}-0'.format(i).encode(), {b'data': b'x' * 100})
+            for i in range(start, start + n)]
+
+
+class TestSpill(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.spill = SpillFile(self.path, segment_size=1000, max_bytes=10000)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testReadInOrder(self):
+        self.assertTrue(self.spill.empty())
+        for i in range(0, 30, 5):
+            self.spill.append(make_entries(i, 5))
+        self.assertGreater(len(self.spill.segments()), 1)
+
+        ids = []
+        while not self.spill.empty():
+            entries, position = self.spill.read(7)
+            ids.extend(id for id, _ in entries)
+            self.spill.commit(position)
+        self.assertEqual(ids, [id for id, _ in make_entries(0, 30)])
+        self.assertEqual(self.spill.segments(), [])
+        self.assertEqual(self.spill.size(), 0)
+        self.spill.append(make_entries(30, 1))
+        self.assertEqual(self.spill.read(2)[0], make_entries(30, 1))
+
+    def testCursor(self):
+        self.spill.append(make_entries(0, 20))
+        entries, position = self.spill.read(3)
+        self.spill.commit(position)
+        # read without commit is read again
+        self.spill.read(3)
+        spill = SpillFile(self.path, segment_size=1000, max_bytes=10000)
+        entries, _ = spill.read(1)
+        self.assertEqual(entries, make_entries(3, 1))
+
+    def testFull(self):
+        with self.assertRaises(SpillFull):
+            for i in range(0, 200, 10):
+                self.spill.append(make_entries(i, 10))
+        self.assertLessEqual(self.spill.size(), 10000)
+
+
+if __name__ == '__main__':
+    unittest.main()
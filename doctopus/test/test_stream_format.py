@@ -0,0 +1,46 @@
+import unittest
+
+from Doctopus.lib import stream_format
+
+
+class TestStreamFormat(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            'table_name': 'test_table',
+            'time': 1600000000,
+            'fields': {
+                'temp': 21.5,
+                'msg': 'this is a msg',
+                'unit': 's',
+                'tags': {'eqpt_no': 'DEV0-1000'}
+            }
+        }
+
+    def encode(self, fmt):
+        raw = stream_format.encode(self.data['table_name'],
+                                   self.data['fields'], self.data['time'],
+                                   fmt)
+        return fmt, raw['data']
+
+    def testVersion(self):
+        self.assertEqual(stream_format.version({b'data': b''}), 1)
+        self.assertEqual(stream_format.version({b'v': b'2', b'data': b''}), 2)
+
+    def testDecode(self):
+        for fmt in (stream_format.FORMAT_V1, stream_format.FORMAT_V2):
+            self.assertEqual(stream_format.decode(*self.encode(fmt)[::-1]),
+                             self.data)
+
+    def testDecodeBatch(self):
+        entries = [
+            self.encode(stream_format.FORMAT_V2),
+            self.encode(stream_format.FORMAT_V1),
+            (stream_format.FORMAT_V2, b'\xc1'),
+            self.encode(stream_format.FORMAT_V2),
+        ]
+        result = stream_format.decode_batch(entries)
+        self.assertEqual(result, [self.data, self.data, None, self.data])
+
+
+if __name__ == "__main__":
+    unittest.main()
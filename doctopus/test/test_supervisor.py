@@ -0,0 +1,47 @@
+import unittest
+
+from Doctopus.lib.supervisor import partition
+
+
+class TestPartition(unittest.TestCase):
+    def setUp(self):
+        self.address = [{'host': '127.0.0.1', 'port': 6379, 'db': 1},
+                        {'host': '127.0.0.1', 'port': 6379, 'db': 2}]
+        self.conf = {
+            'redis_instance': {
+                'address': self.address
+            },
+            'data_stream': {
+                'shards': 2,
+                'process_mode': 'address'
+            }
+        }
+
+    def testAddress(self):
+        self.assertEqual(partition(self.conf), [
+            ('worker_127.0.0.1_6379_1', [(self.address[0], [0, 1])]),
+            ('worker_127.0.0.1_6379_2', [(self.address[1], [0, 1])]),
+        ])
+
+    def testShard(self):
+        self.conf['data_stream']['process_mode'] = 'shard'
+        self.assertEqual(partition(self.conf), [
+            ('worker_127.0.0.1_6379_1_0', [(self.address[0], [0])]),
+            ('worker_127.0.0.1_6379_1_1', [(self.address[0], [1])]),
+            ('worker_127.0.0.1_6379_2_0', [(self.address[1], [0])]),
+            ('worker_127.0.0.1_6379_2_1', [(self.address[1], [1])]),
+        ])
+
+    def testSameDb(self):
+        self.address[:] = [{'host': '10.0.0.1', 'port': 6379, 'db': 1},
+                           {'host': '10.0.0.2', 'port': 6379, 'db': 1},
+                           {'unix_socket_path': '/var/run/redis.sock',
+                            'db': 1}]
+        names = [name for name, _ in partition(self.conf)]
+        self.assertEqual(names, ['worker_10.0.0.1_6379_1',
+                                 'worker_10.0.0.2_6379_1',
+                                 'worker_var_run_redis.sock_1'])
+
+
+if __name__ == "__main__":
+    unittest.main()
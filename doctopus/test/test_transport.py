@@ -0,0 +1,70 @@
+import unittest
+from unittest import mock
+
+import redis
+
+from Doctopus.lib import stream_format
+from Doctopus.lib.database_wrapper import (InfluxdbWrapper, RedisWrapper,
+                                           stream_name)
+from Doctopus.lib.transport import Transport
+
+
+class TestSharedInFlight(unittest.TestCase):
+    def setUp(self):
+        address: dict = {
+            "host": "127.0.0.1",
+            "port": 6379,
+            "db": 4,
+        }
+        self.conf = {
+            'application': 'chitu',
+            'redis': address,
+            'send_to_where': 'influxdb',
+            'influxdb': {
+                'username': 'root',
+                'password': 'root',
+                'db': 'test'
+            },
+            'data_stream': {
+                'group': 'test_transport_group',
+                'consumer': 'chitu',
+                'retry_backoff': 0
+            }
+        }
+        self.shard = 9
+        self.stream = stream_name(self.shard)
+        self.db = redis.StrictRedis(**address)
+        self.db.delete(self.stream)
+        client = RedisWrapper(address)
+        # no influxdb is needed, nothing is sent
+        with mock.patch.object(InfluxdbWrapper, 'test_connect',
+                               return_value=True):
+            self.work = Transport(self.conf, address, self.shard,
+                                  redis_client=client)
+            self.pending = Transport(self.conf, address, self.shard,
+                                     redis_client=client, peer=self.work)
+
+    def tearDown(self):
+        self.db.delete(self.stream)
+
+    def testShared(self):
+        self.assertIs(self.pending.in_flight, self.work.in_flight)
+        self.assertIs(self.pending.db, self.work.db)
+
+    def testSlowSend(self):
+        self.db.xadd(self.stream,
+                     stream_format.encode('test_table', {'temp': 21.5}, 1))
+        raw_data = self.work.getData()
+
+        # the work thread is still sending it
+        res, _ = self.pending.getPendingData()
+        self.assertEqual(res, [])
+
+        # the send failed without ack, the pending thread retries it
+        self.work.in_flight.discard(raw_data['id'])
+        res, _ = self.pending.getPendingData()
+        self.assertEqual([r['id'] for r in res], [raw_data['id']])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import shutil
+import tempfile
+import unittest
+
+from Doctopus.lib.wal import HEADER, WriteAheadLog
+
+
+def make_payloads(start, n):
+    return ['{:05d}'.format(i).encode() * 20 for i in range(start, start + n)]
+
+
+class TestWal(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.wal = WriteAheadLog(self.path, segment_size=1024,
+                                 max_bytes=10240)
+
+    def tearDown(self):
+        self.wal.close()
+        shutil.rmtree(self.path)
+
+    def replay(self, wal, count=7):
+        payloads = []
+        while not wal.empty():
+            records, position = wal.read(count)
+            payloads.extend(records)
+            wal.commit(position)
+        return payloads
+
+    def testReplayInOrder(self):
+        self.assertTrue(self.wal.empty())
+        for i in range(0, 40, 4):
+            self.wal.append(make_payloads(i, 4))
+        self.assertGreater(len(self.wal.segments()), 1)
+        self.assertEqual(self.replay(self.wal), make_payloads(0, 40))
+        self.assertEqual(self.wal.segments(), [self.wal.seq])
+
+    def testReopen(self):
+        self.wal.append(make_payloads(0, 20))
+        records, position = self.wal.read(5)
+        self.wal.commit(position)
+        self.wal.close()
+
+        wal = WriteAheadLog(self.path, segment_size=1024, max_bytes=10240)
+        wal.append(make_payloads(20, 5))
+        self.assertEqual(self.replay(wal), make_payloads(5, 20))
+        wal.close()
+
+    def testCorrupt(self):
+        # 9 records in the first segment, 6 in the second
+        self.wal.append(make_payloads(0, 15))
+        first = self.wal.segment_file(self.wal.segments()[0])
+        size = HEADER.size + len(make_payloads(0, 1)[0])
+        with open(first, 'r+b') as fn:
+            # break the payload of the third record
+            fn.seek(size * 2 + HEADER.size)
+            fn.write(b'x')
+        payloads = self.replay(self.wal)
+        self.assertEqual(payloads,
+                         make_payloads(0, 2) + make_payloads(9, 6))
+        self.assertEqual(self.wal.corrupt, 1)
+
+    def testMaxBytes(self):
+        for i in range(0, 200, 10):
+            self.wal.append(make_payloads(i, 10))
+        self.assertLessEqual(self.wal.size(), 10240)
+        self.assertGreater(self.wal.dropped, 0)
+        payloads = self.replay(self.wal)
+        self.assertEqual(len(payloads) + self.wal.dropped, 200)
+        self.assertEqual(payloads, make_payloads(200 - len(payloads),
+                                                 len(payloads)))
+
+
+if __name__ == '__main__':
+    unittest.main()